@@ -1,61 +1,66 @@
+import io
 import os
 import tempfile
 import subprocess
 import logging
 import re
-import shutil
+import time
+import uuid
 import atexit
+import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from threading import Timer
+from typing import Callable, Dict, List, Optional
 
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, g, request, send_file, jsonify, make_response
 from flask_cors import CORS
-from mermaid_processor import MermaidProcessor
-
-# 设置详细的日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # 控制台输出
-        logging.FileHandler('docgen.log', encoding='utf-8')  # 文件输出
-    ]
+from capabilities import get_capabilities
+from conversion_cache import conversion_cache_entry, conversion_cache_key, get_conversion_cache
+from disk_cache import make_cache_key
+from docx_repack import get_docx_repacker
+from image_optimizer import get_image_optimizer
+from template_registry import TemplateRegistry
+from workspace import WorkspaceManager
+from markdown_ingest import IngestRequest, MarkdownIngestBuffer, ingest_file
+from batch_archive import BatchArchiveError, read_markdown_archive, stream_zip
+from output_formats import (
+    OUTPUT_FORMATS, OutputFormatError, markdown_to_ast, parse_formats, write_formats
 )
-logger = logging.getLogger(__name__)
+from metrics import (
+    CONVERSIONS, CONVERSION_SECONDS, STAGE_SECONDS, StageTimings, format_metric,
+    render_metrics, stage_timer
+)
+from mermaid_processor import MermaidProcessor, RenderMemo, get_image_format, get_render_cache
+from mermaid_browser import get_browser_pool
+from mermaid_validator import get_failure_cache
+from pandoc_server import (
+    PandocServerConversionError, PandocServerUnavailable, get_pandoc_server_pool
+)
+from jobs import ConversionJob, JobQueue, JobQueueFull, JOB_FAILED, JOB_SUCCEEDED
+from logging_config import configure_logging, get_correlation_id, reset_correlation_id, set_correlation_id
 
-# 全局字典存储需要清理的临时文件
-_temp_files_to_cleanup = {}
+# 日志经队列由后台线程写出（控制台 + docgen.log），级别和格式见 logging_config
+configure_logging()
+logger = logging.getLogger(__name__)
 
-def delayed_cleanup(file_path, delay=300):
-    """延迟清理临时文件"""
-    def cleanup():
-        try:
-            if file_path.exists():
-                shutil.rmtree(file_path, ignore_errors=True)
-                logger.info(f"Cleaned up temporary directory: {file_path}")
-            # 从全局字典中移除
-            _temp_files_to_cleanup.pop(str(file_path), None)
-        except Exception as e:
-            logger.warning(f"Failed to cleanup temporary directory: {e}")
+# 客户端传入的 X-Request-ID 只接受简单字符，避免日志注入
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
 
-    # 添加到全局字典
-    _temp_files_to_cleanup[str(file_path)] = cleanup
+class WorkdirFile(io.FileIO):
+    """只读文件，关闭时调用 on_close（用于删除其所在的请求工作目录）"""
 
-    # 设置延迟清理
-    timer = Timer(delay, cleanup)
-    timer.daemon = True  # 设置为守护线程，主程序退出时不会阻止
-    timer.start()
+    def __init__(self, path: Path, on_close: Callable[[], None]):
+        super().__init__(path, 'rb')
+        self.on_close = on_close
 
-# 注册退出时的清理函数
-def cleanup_all_temp_files():
-    """清理所有临时文件"""
-    for cleanup_func in _temp_files_to_cleanup.values():
+    def close(self):
+        if self.closed:
+            return
         try:
-            cleanup_func()
-        except:
-            pass
-
-atexit.register(cleanup_all_temp_files)
+            super().close()
+        finally:
+            self.on_close()
 
 
 def is_safe_filename(filename: str) -> bool:
@@ -82,116 +87,545 @@ def is_safe_filename(filename: str) -> bool:
 
     return True
 
-def validate_template_name(template_name: str, template_folder: str) -> bool:
-    """验证模板文件名是否安全"""
+def validate_template_name(template_name: str, template_registry: TemplateRegistry) -> bool:
+    """验证模板文件名是否安全且存在于模板目录中"""
     if not template_name or not template_name.endswith('.docx'):
         return False
     if not is_safe_filename(template_name):
         return False
 
-    # 确保文件路径在模板目录内
-    template_path = Path(template_folder) / template_name
-    try:
-        template_path.resolve().relative_to(Path(template_folder).resolve())
-        return True
-    except ValueError:
-        return False
+    # 注册表只收录模板目录下的文件，查表即可保证路径位于模板目录内
+    return template_registry.get(template_name) is not None
 
 def check_pandoc_available() -> bool:
-    """检查Pandoc是否可用"""
-    try:
-        subprocess.run(['pandoc', '--version'],
-                      capture_output=True, check=True, timeout=10)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-        return False
+    """检查Pandoc是否可用（读取能力注册表的缓存结果，不启动子进程）"""
+    return get_capabilities().is_available("pandoc")
 
 
-def process_mermaid_blocks_detailed(markdown_text: str, workdir: Path) -> str:
+def process_mermaid_blocks_detailed(markdown_text: str, workdir: Path,
+                                    summary: Optional[Dict] = None,
+                                    timings: Optional[StageTimings] = None,
+                                    render_memo: Optional[RenderMemo] = None,
+                                    diagram_format: Optional[str] = None) -> str:
     """
     使用MermaidProcessor处理Markdown中的Mermaid代码块
     包含详细的日志记录和错误处理
-    """
-    logger.info("=== Starting Mermaid processing ===")
-    logger.info(f"Work directory: {workdir}")
-    logger.info(f"Input text length: {len(markdown_text)} characters")
-    logger.info(f"Test mode: {os.environ.get('MERMAID_TEST_MODE', 'false')}")
 
-    # 确保workdir的images目录存在（用于Pandoc处理）
-    workdir_images = workdir / "images"
-    workdir_images.mkdir(exist_ok=True)
-    logger.info(f"Workdir images directory: {workdir_images}")
+    Args:
+        markdown_text: Markdown内容
+        workdir: 请求工作目录
+        summary: 可选，用于回传处理结果（mermaid_blocks / mermaid_unique / mermaid_failed）
+        timings: 可选，请求级阶段耗时记录
+        render_memo: 可选，与同批次其他文档共享的渲染结果
+        diagram_format: 图表图片格式（png 或 svg），为None时使用全局配置
+    """
+    if summary is None:
+        summary = {}
+    logger.debug("=== Starting Mermaid processing ===")
+    logger.debug("Work directory: %s", workdir)
+    logger.debug("Input text length: %s characters", len(markdown_text))
+    logger.debug("Test mode: %s", os.environ.get('MERMAID_TEST_MODE', 'false'))
 
     try:
-        # 使用MermaidProcessor处理（图片将保存到项目images目录）
-        with MermaidProcessor() as processor:
-            logger.info("MermaidProcessor initialized successfully")
+        # 使用MermaidProcessor处理（图片直接生成到工作目录的images文件夹，供Pandoc使用）
+        with MermaidProcessor(render_memo=render_memo, image_format=diagram_format) as processor:
+            logger.debug("MermaidProcessor initialized successfully")
 
             # 提取Mermaid块
-            processed_content, mermaid_blocks = processor.extract_mermaid_blocks(markdown_text)
-            logger.info(f"Extracted {len(mermaid_blocks)} Mermaid blocks")
+            with stage_timer("mermaid_extract", timings):
+                processed_content, mermaid_blocks = processor.extract_mermaid_blocks(markdown_text)
+            logger.info("Extracted %s Mermaid blocks", len(mermaid_blocks))
 
             if not mermaid_blocks:
                 logger.info("No Mermaid blocks found, returning original content")
                 return markdown_text
 
-            # 详细记录每个块的信息
-            for i, block in enumerate(mermaid_blocks):
-                logger.info(f"Block {i+1}: {block['id']}")
-                logger.info(f"  - Filename: {block['filename']}")
-                logger.info(f"  - Code preview: {block['code'][:100]}...")
-
-            # 处理所有Mermaid块（生成到项目images目录）
-            successful_images, failed_blocks = processor.process_all_mermaid_blocks(str(workdir))
-            logger.info(f"Processing results: {len(successful_images)} successful, {len(failed_blocks)} failed")
+            # 详细记录每个块的信息（仅DEBUG级别）
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, block in enumerate(mermaid_blocks):
+                    logger.debug("Block %s: %s", i+1, block['id'])
+                    logger.debug("  - Filename: %s", block['filename'])
+                    logger.debug("  - Code preview: %s...", block['code'][:100])
+
+            # 处理所有Mermaid块
+            with stage_timer("mermaid_render", timings):
+                successful_images, failed_blocks = processor.process_all_mermaid_blocks(str(workdir))
+            logger.info("Processing results: %s successful, %s failed", len(successful_images), len(failed_blocks))
+            summary["mermaid_blocks"] = len(mermaid_blocks)
+            summary["mermaid_unique"] = len({block['filename'] for block in mermaid_blocks})
+            summary["mermaid_failed"] = len(failed_blocks)
 
-            # 将生成的图片复制到工作目录的images文件夹（供Pandoc使用）
-            copied_images = []
             for img_path in successful_images:
-                if os.path.exists(img_path):
-                    file_size = os.path.getsize(img_path)
-                    logger.info(f"✓ Generated project image: {img_path} ({file_size} bytes)")
-
-                    # 复制到工作目录的images文件夹
-                    filename = os.path.basename(img_path)
-                    workdir_img_path = workdir_images / filename
-                    try:
-                        import shutil
-                        shutil.copy2(img_path, workdir_img_path)
-                        copied_images.append(str(workdir_img_path))
-                        logger.info(f"✓ Copied image to workdir: {workdir_img_path}")
-                    except Exception as e:
-                        logger.error(f"✗ Failed to copy {img_path} to workdir: {e}")
-                else:
-                    logger.warning(f"Image path reported as successful but file not found: {img_path}")
+                logger.debug("✓ Generated image: %s", img_path)
 
             # 记录失败的块
             if failed_blocks:
-                logger.error(f"Failed blocks indices: {failed_blocks}")
+                logger.error("Failed blocks indices: %s", failed_blocks)
                 for index in failed_blocks:
                     if index < len(mermaid_blocks):
                         block = mermaid_blocks[index]
-                        logger.error(f"  - Failed block: {block['id']}")
+                        logger.error("  - Failed block: %s", block['id'])
 
             # 恢复失败的块
             if failed_blocks:
                 processed_content = processor.restore_failed_blocks(processed_content, failed_blocks)
-                logger.info(f"Restored {len(failed_blocks)} failed blocks to original format")
+                logger.info("Restored %s failed blocks to original format", len(failed_blocks))
 
             logger.info("=== Mermaid processing completed ===")
             return processed_content
 
     except Exception as e:
-        logger.error(f"Exception in Mermaid processing: {e}")
-        logger.error(f"Exception type: {type(e).__name__}")
+        logger.error("Exception in Mermaid processing: %s", e)
+        logger.error("Exception type: %s", type(e).__name__)
         import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.error("Traceback: %s", traceback.format_exc())
         # 发生异常时返回原始内容，让用户知道处理失败但可以继续
         logger.warning("Returning original content due to processing error")
+        summary["mermaid_failed"] = max(summary.get("mermaid_blocks", 0), 1)
         return markdown_text
 
+class ConversionError(Exception):
+    """转换失败，包含返回给客户端的错误信息和HTTP状态码"""
+
+    def __init__(self, message: str, status: int = 500, details: str = None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+    def to_response(self) -> tuple[dict, int]:
+        body = {"error": self.message}
+        if self.details is not None:
+            body["details"] = self.details
+        return body, self.status
+
+
+def validate_upload(files, form, template_registry: TemplateRegistry):
+    """
+    校验上传的Markdown文件和模板参数
+
+    Args:
+        files: request.files
+        form: request.form
+        template_registry: 模板注册表
+
+    Returns:
+        Tuple[上传文件, 模板名称或None, 流式接收结果（解码后的文本、内容哈希等）]
+
+    Raises:
+        ConversionError: 校验失败（400）
+    """
+    if "file" not in files:
+        logger.warning("Conversion request without file")
+        raise ConversionError("No file part in request", 400)
+
+    file = files["file"]
+    if file.filename == "":
+        logger.warning("Conversion request with empty filename")
+        raise ConversionError("No file selected", 400)
+
+    # 验证文件类型
+    if not file.filename.lower().endswith(('.md', '.markdown')):
+        logger.warning("Invalid file type uploaded: %s", file.filename)
+        raise ConversionError("Only Markdown files (.md, .markdown) are allowed", 400)
+
+    # 验证文件名安全性
+    if not is_safe_filename(file.filename):
+        logger.warning("Unsafe filename detected: %s", file.filename)
+        raise ConversionError("Invalid filename", 400)
+
+    template_name = form.get("template")
+
+    # 验证模板名称
+    if template_name:
+        if not validate_template_name(template_name, template_registry):
+            logger.warning("Invalid template requested: %s", template_name)
+            raise ConversionError("Invalid template name", 400)
+
+    # 验证文件内容：上传时已完成二进制检测和UTF-8解码
+    try:
+        ingested = ingest_file(file)
+    except Exception as e:
+        logger.error("Error reading file content: %s", e)
+        raise ConversionError("Error reading uploaded file", 400)
+
+    check_ingested(ingested, file.filename)
+    return file, template_name or None, ingested
+
+
+def parse_diagram_format(value: Optional[str]) -> str:
+    """
+    解析请求中的 diagram_format 字段（png 或 svg），为空时使用全局配置
+
+    Raises:
+        ConversionError: 不支持的格式（400）
+    """
+    try:
+        return get_image_format(value)
+    except ValueError as e:
+        logger.warning("Invalid diagram format requested: %s", value)
+        raise ConversionError(str(e), 400)
+
+
+def check_ingested(ingested: MarkdownIngestBuffer, display_name: str):
+    """
+    检查上传内容是否为UTF-8文本
+
+    Raises:
+        ConversionError: 二进制或非UTF-8内容（400）
+    """
+    if ingested.is_binary:
+        logger.warning("Binary file detected: %s", display_name)
+        raise ConversionError("File appears to be binary, not text", 400)
+    if ingested.decode_error is not None:
+        logger.warning("Failed to decode markdown file as UTF-8: %s, error: %s", display_name, ingested.decode_error)
+        raise ConversionError("File is not valid UTF-8 text", 400)
+
+
+def collect_batch_sources(files, max_files: int, max_archive_bytes: int) -> List[Dict]:
+    """
+    收集批量转换的输入：多个 files 字段，或一个 archive 字段（zip）
+
+    Args:
+        files: request.files
+        max_files: 文件数上限
+        max_archive_bytes: zip解压后总大小上限
+
+    Returns:
+        [{"name": 显示名称, "output": 结果在zip中的路径, "ingested": 接收结果或None, "error": 错误信息或None}]
+
+    Raises:
+        ConversionError: 请求整体无效（400）
+    """
+    sources = []
+    if "archive" in files:
+        archive = files["archive"]
+        try:
+            entries = read_markdown_archive(archive.stream, max_files, max_archive_bytes)
+        except BatchArchiveError as e:
+            logger.warning("Rejected batch archive %s: %s", archive.filename, e)
+            raise ConversionError(str(e), 400)
+        for name, data in entries:
+            ingested = MarkdownIngestBuffer()
+            ingested.write(data)
+            ingested.finish()
+            sources.append({"name": name, "ingested": ingested, "error": None})
+    else:
+        uploads = files.getlist("files")
+        if len(uploads) > max_files:
+            raise ConversionError(f"Too many files (limit {max_files})", 400)
+        for file in uploads:
+            source = {"name": file.filename, "ingested": None, "error": None}
+            if not file.filename.lower().endswith(('.md', '.markdown')):
+                source["error"] = "Only Markdown files (.md, .markdown) are allowed"
+            elif not is_safe_filename(file.filename):
+                source["error"] = "Invalid filename"
+            else:
+                source["ingested"] = ingest_file(file)
+            sources.append(source)
+
+    if not sources:
+        raise ConversionError("No Markdown files in request", 400)
+
+    # 结果文件名：扩展名改为 .docx，重名时追加序号
+    used = set()
+    for source in sources:
+        stem = source["name"].rsplit('.', 1)[0]
+        output = f"{stem}.docx"
+        counter = 2
+        while output in used:
+            output = f"{stem}-{counter}.docx"
+            counter += 1
+        used.add(output)
+        source["output"] = output
+
+        if source["error"] is None:
+            try:
+                check_ingested(source["ingested"], source["name"])
+            except ConversionError as e:
+                source["error"] = e.message
+    return sources
+
+
+def run_pandoc_subprocess(markdown_text: str, output_path: Path, tmpdir_path: Path,
+                          template_path: Optional[Path], display_name: str):
+    """
+    启动pandoc子进程完成转换，Markdown通过stdin传入
+
+    Raises:
+        ConversionError: 转换失败
+    """
+    # 不修改进程工作目录：通过 cwd 和 --resource-path 让相对图片路径在请求工作目录中解析，
+    # 多个线程可以同时转换
+    cmd = [
+        "pandoc",
+        "-f", "markdown",
+        "-o", str(output_path),
+        f"--resource-path={tmpdir_path}",
+    ]
+    if template_path is not None:
+        cmd.extend(["--reference-doc", str(template_path)])
+
+    try:
+        logger.debug("Pandoc working directory: %s", tmpdir_path)
+        logger.debug("Output file: %s", output_path)
+
+        # 检查工作目录中的images文件夹（仅DEBUG级别，避免每次请求额外扫描目录）
+        if logger.isEnabledFor(logging.DEBUG):
+            workdir_images = tmpdir_path / "images"
+            if workdir_images.exists():
+                image_files = list(workdir_images.glob("*.png"))
+                logger.debug("Found %s images in working directory: %s", len(image_files), workdir_images)
+                for img in image_files[:3]:  # 显示前3个图片文件名
+                    logger.debug("  - %s", img.name)
+            else:
+                logger.debug("No images directory in working directory: %s", workdir_images)
+
+        result = subprocess.run(
+            cmd,
+            input=markdown_text,
+            encoding="utf-8",
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=60,  # 60秒超时
+            cwd=tmpdir_path
+        )
+        logger.info("Pandoc conversion successful for %s", display_name)
+        logger.debug("Pandoc stdout: %s", result.stdout.strip())
+
+    except subprocess.TimeoutExpired:
+        logger.error("Pandoc conversion timeout for %s", display_name)
+        raise ConversionError("Conversion timeout - file may be too large or complex", 500)
+    except FileNotFoundError:
+        logger.error("Pandoc not found during conversion")
+        raise ConversionError("Pandoc not found. Please install pandoc and ensure it is in PATH.", 500)
+    except subprocess.CalledProcessError as exc:
+        logger.error("Pandoc conversion failed for %s: %s", display_name, exc.stderr)
+        raise ConversionError("Pandoc conversion failed", 500, details=exc.stderr)
+
+
+def run_pandoc_server(markdown_text: str, output_path: Path, tmpdir_path: Path,
+                      template_path: Optional[Path], display_name: str) -> bool:
+    """
+    通过常驻 pandoc-server 进程池完成转换
+
+    Returns:
+        是否已完成转换；服务不可用时返回False，由调用方回退到子进程方式
+
+    Raises:
+        ConversionError: pandoc 报告转换失败
+    """
+    try:
+        get_pandoc_server_pool().convert(markdown_text, output_path, tmpdir_path, template_path)
+    except PandocServerUnavailable as e:
+        logger.warning("pandoc-server unavailable, falling back to pandoc subprocess: %s", e)
+        return False
+    except PandocServerConversionError as e:
+        logger.error("Pandoc conversion failed for %s: %s", display_name, e)
+        raise ConversionError("Pandoc conversion failed", 500, details=str(e))
+
+    logger.info("Pandoc conversion successful for %s (pandoc-server)", display_name)
+    return True
+
+
+def prepare_markdown(tmpdir_path: Path, markdown_text: str, display_name: str,
+                     summary: Dict, has_mermaid: Optional[bool] = None,
+                     timings: Optional[StageTimings] = None, render_memo: Optional[RenderMemo] = None,
+                     diagram_format: Optional[str] = None) -> str:
+    """
+    把 Markdown 中的 mermaid 代码块转换成图片（写入工作目录）
+
+    Returns:
+        替换为图片引用后的Markdown文本；图表处理出现非致命错误时返回原文
+
+    Raises:
+        ConversionError: 图表处理出现致命错误
+    """
+    try:
+        logger.info("Starting Mermaid processing for file: %s", display_name)
+        logger.debug("Markdown length: %s characters", len(markdown_text))
+
+        # 检查是否包含Mermaid代码块
+        if has_mermaid is None:
+            has_mermaid = "```mermaid" in markdown_text.lower()
+        if has_mermaid:
+            logger.info("Mermaid code blocks detected in the input")
+            processed_markdown = process_mermaid_blocks_detailed(
+                markdown_text, tmpdir_path, summary, timings, render_memo, diagram_format
+            )
+
+            if processed_markdown != markdown_text:
+                markdown_text = processed_markdown
+                logger.info("Successfully processed mermaid blocks for %s", display_name)
+            else:
+                logger.info("Mermaid processing completed but content unchanged for %s", display_name)
+        else:
+            logger.info("No Mermaid code blocks found in the input file")
+
+    except Exception as e:
+        # Mermaid 处理失败时记录详细错误但不中断转换
+        logger.error("Mermaid processing failed for %s: %s", display_name, e)
+        logger.error("Exception type: %s", type(e).__name__)
+        import traceback
+        logger.error("Traceback: %s", traceback.format_exc())
+
+        # 检查是否是RuntimeError（来自原有的mermaid处理）
+        if isinstance(e, RuntimeError):
+            logger.error("Critical Mermaid processing error, aborting conversion")
+            raise ConversionError(f"Mermaid processing failed: {str(e)}", 500)
+        else:
+            logger.warning("Non-critical Mermaid processing error, continuing with Pandoc conversion using original file")
+            summary["mermaid_failed"] = max(summary.get("mermaid_failed", 0), 1)
+
+    return markdown_text
+
+
+def check_template_path(template_path: Optional[Path]) -> Optional[Path]:
+    """模板文件在转换前被删除时不使用模板"""
+    if template_path is not None:
+        if template_path.is_file():
+            logger.info("Using template: %s", template_path.name)
+        else:
+            logger.warning("Template file not found: %s", template_path.name)
+            template_path = None
+    return template_path
+
+
+def repack_docx(output_path: Path, display_name: str, timings: Optional[StageTimings] = None):
+    """按部件类型重新压缩 pandoc 生成的DOCX并合并重复媒体；失败时保留原文件"""
+    repacker = get_docx_repacker()
+    if repacker is None:
+        return
+    try:
+        with stage_timer("docx_repack", timings):
+            stats = repacker.repack(str(output_path))
+    except Exception as e:
+        logger.warning("Failed to repack DOCX for %s, keeping pandoc output: %s", display_name, e)
+        return
+    logger.debug("Repacked DOCX for %s: %s -> %s bytes (%s media stored, %s deduplicated)",
+                 display_name, stats["original_bytes"], stats["repacked_bytes"],
+                 stats["stored"], stats["deduplicated"])
+
+
+def run_conversion(tmpdir_path: Path, markdown_text: str, template_path: Optional[Path],
+                   display_name: str, progress: Optional[Callable[[str], None]] = None,
+                   summary: Optional[Dict] = None, has_mermaid: Optional[bool] = None,
+                   timings: Optional[StageTimings] = None, render_memo: Optional[RenderMemo] = None,
+                   diagram_format: Optional[str] = None) -> Path:
+    """
+    对Markdown文本执行 Mermaid 处理和 Pandoc 转换
+
+    Args:
+        tmpdir_path: 请求工作目录（图片和输出文件写在这里）
+        markdown_text: Markdown内容
+        template_path: 参考模板路径，不使用模板时为None
+        display_name: 用于日志的原始文件名
+        progress: 进度回调，参数为当前阶段名称
+        summary: 可选，用于回传处理结果（如 mermaid_failed，存在失败图表时结果不应缓存）
+        has_mermaid: 是否包含Mermaid代码块（上传时已检测），为None时在此检测
+        timings: 可选，请求级阶段耗时记录
+        render_memo: 可选，与同批次其他文档共享的渲染结果
+        diagram_format: 图表图片格式（png 或 svg），为None时使用全局配置
+
+    Returns:
+        生成的DOCX文件路径
+
+    Raises:
+        ConversionError: 转换失败
+    """
+    output_path = tmpdir_path / "output.docx"
+    if summary is None:
+        summary = {}
+
+    def report(stage: str):
+        if progress is not None:
+            progress(stage)
+
+    # 在调用 Pandoc 之前，先把 Markdown 中的 mermaid 代码块转换成图片
+    report("mermaid")
+    markdown_text = prepare_markdown(
+        tmpdir_path, markdown_text, display_name, summary, has_mermaid, timings, render_memo, diagram_format
+    )
+
+    report("pandoc")
+    template_path = check_template_path(template_path)
+
+    with stage_timer("pandoc", timings):
+        converted = False
+        if os.environ.get("PANDOC_ENGINE", "subprocess").lower() == "server":
+            converted = run_pandoc_server(markdown_text, output_path, tmpdir_path, template_path, display_name)
+        if not converted:
+            run_pandoc_subprocess(markdown_text, output_path, tmpdir_path, template_path, display_name)
+
+        if not output_path.exists():
+            logger.error("Output file was not created for %s", display_name)
+            raise ConversionError("Output file was not created", 500)
+
+    repack_docx(output_path, display_name, timings)
+
+    report("done")
+    return output_path
+
+
+def run_multi_format_conversion(tmpdir_path: Path, markdown_text: str, template_path: Optional[Path],
+                                display_name: str, formats: List[str], summary: Optional[Dict] = None,
+                                has_mermaid: Optional[bool] = None,
+                                timings: Optional[StageTimings] = None,
+                                diagram_format: Optional[str] = None) -> Dict[str, Path]:
+    """
+    一次解析生成多种输出格式
+
+    Mermaid 图片只生成一次；Markdown 由 pandoc 解析为 JSON AST 后，各格式的 writer 并行运行。
+    始终使用 pandoc 子进程（pandoc-server 不支持 PDF 等需要外部程序的格式）。
+
+    Args:
+        tmpdir_path: 请求工作目录
+        markdown_text: Markdown内容
+        template_path: 参考模板路径（仅用于DOCX），不使用模板时为None
+        display_name: 用于日志的原始文件名
+        formats: output_formats.OUTPUT_FORMATS 中的格式名称列表
+        summary: 可选，用于回传处理结果
+        has_mermaid: 是否包含Mermaid代码块，为None时在此检测
+        timings: 可选，请求级阶段耗时记录
+        diagram_format: 图表图片格式（png 或 svg），为None时使用全局配置
+
+    Returns:
+        格式名称 -> 输出文件路径
+
+    Raises:
+        ConversionError: 转换失败
+    """
+    if summary is None:
+        summary = {}
+    markdown_text = prepare_markdown(
+        tmpdir_path, markdown_text, display_name, summary, has_mermaid, timings, diagram_format=diagram_format
+    )
+    template_path = check_template_path(template_path)
+
+    try:
+        with stage_timer("pandoc_parse", timings):
+            ast_path = markdown_to_ast(markdown_text, tmpdir_path)
+        with stage_timer("pandoc_write", timings):
+            outputs = write_formats(
+                ast_path, formats, tmpdir_path, template_path, os.environ.get("PANDOC_PDF_ENGINE")
+            )
+    except OutputFormatError as e:
+        logger.error("Pandoc conversion failed for %s: %s %s", display_name, e, e.details or "")
+        raise ConversionError(str(e), 500, details=e.details)
+
+    if "docx" in outputs:
+        repack_docx(outputs["docx"], display_name, timings)
+
+    logger.info("Pandoc conversion successful for %s (%s)", display_name, ", ".join(formats))
+    return outputs
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
+    # Markdown上传在解析请求体时即完成解码和检测，无需先落盘再读取
+    app.request_class = IngestRequest
     CORS(app)
 
     app.config["UPLOAD_FOLDER"] = os.environ.get(
@@ -201,32 +635,400 @@ def create_app() -> Flask:
         "TEMPLATE_FOLDER", str(Path(app.root_path) / "templates_store")
     )
     app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
+    app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", "2"))
+    app.config["JOB_MAX_QUEUE"] = int(os.environ.get("JOB_MAX_QUEUE", "20"))
+    app.config["JOB_RESULT_TTL"] = int(os.environ.get("JOB_RESULT_TTL", "600"))
+
+    app.config["TEMPLATE_POLL_INTERVAL"] = float(os.environ.get("TEMPLATE_POLL_INTERVAL", "5"))
+    # 是否在同步转换响应中附带 Server-Timing 阶段耗时
+    app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+    app.config["WORKSPACE_MAX_MB"] = float(os.environ.get("WORKSPACE_MAX_MB", "2048"))
+    app.config["WORKSPACE_ORPHAN_AGE"] = float(os.environ.get("WORKSPACE_ORPHAN_AGE", "3600"))
+    # 工作目录后端：disk（UPLOAD_FOLDER）或 memory（内存文件系统，超过阈值的转换仍使用磁盘）
+    app.config["WORKSPACE_BACKEND"] = os.environ.get("WORKSPACE_BACKEND", "disk").lower()
+    app.config["WORKSPACE_MEMORY_DIR"] = os.environ.get("WORKSPACE_MEMORY_DIR", "/dev/shm/docgen_workspaces")
+    app.config["WORKSPACE_MEMORY_THRESHOLD_MB"] = float(os.environ.get("WORKSPACE_MEMORY_THRESHOLD_MB", "4"))
+    app.config["WORKSPACE_MEMORY_MIN_FREE_MB"] = float(os.environ.get("WORKSPACE_MEMORY_MIN_FREE_MB", "256"))
+    # 批量转换：所有批量请求共享的并发转换数、单次请求的文件数和zip解压后大小上限
+    app.config["BATCH_WORKERS"] = int(os.environ.get("BATCH_WORKERS", "4"))
+    app.config["BATCH_MAX_FILES"] = int(os.environ.get("BATCH_MAX_FILES", "50"))
+    app.config["BATCH_MAX_UNCOMPRESSED_MB"] = float(os.environ.get("BATCH_MAX_UNCOMPRESSED_MB", "64"))
 
-    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
     os.makedirs(app.config["TEMPLATE_FOLDER"], exist_ok=True)
 
-    # 启动时检查Pandoc
+    # 工作目录管理：统一创建、到期回收和配额控制，启动时清理遗留目录
+    workspaces = WorkspaceManager(
+        app.config["UPLOAD_FOLDER"],
+        max_bytes=int(app.config["WORKSPACE_MAX_MB"] * 1024 * 1024),
+        orphan_age=app.config["WORKSPACE_ORPHAN_AGE"],
+        memory_root=app.config["WORKSPACE_MEMORY_DIR"] if app.config["WORKSPACE_BACKEND"] == "memory" else None,
+        memory_threshold=int(app.config["WORKSPACE_MEMORY_THRESHOLD_MB"] * 1024 * 1024),
+        memory_min_free=int(app.config["WORKSPACE_MEMORY_MIN_FREE_MB"] * 1024 * 1024)
+    )
+    atexit.register(workspaces.shutdown)
+
+    # 启动时探测外部工具，之后由后台线程定期刷新
+    get_capabilities().start()
     if not check_pandoc_available():
         logger.warning("Pandoc not found. Please install pandoc to use conversion features.")
     else:
         logger.info("Pandoc is available")
 
+    # 模板注册表：启动时建立索引，后台轮询目录变化
+    template_registry = TemplateRegistry(
+        app.config["TEMPLATE_FOLDER"], poll_interval=app.config["TEMPLATE_POLL_INTERVAL"]
+    )
+    template_registry.start()
+
+    def resolve_template(template_name: Optional[str]) -> tuple[Optional[Path], str]:
+        """返回模板路径及其内容哈希，不使用模板时返回 (None, '')"""
+        info = template_registry.get(template_name) if template_name else None
+        if info is None:
+            return None, ''
+        return Path(info["path"]), info["sha256"]
+
+    def send_output(path: Path, etag: Optional[str] = None, workdir: Optional[Path] = None,
+                    output_format: str = "docx"):
+        """
+        发送转换结果文件
+
+        Args:
+            path: 文件路径
+            etag: 可选的ETag
+            workdir: 可选，响应结束后需要删除的工作目录
+            output_format: 输出格式，决定下载文件名和响应类型
+        """
+        spec = OUTPUT_FORMATS[output_format]
+        download_name = f"document.{spec['extension']}"
+        if workdir is None:
+            # 不使用 send_file 按文件生成的ETag：只有完整的结果才带ETag
+            response = send_file(
+                path,
+                as_attachment=True,
+                download_name=download_name,
+                mimetype=spec["mimetype"],
+                etag=False,
+            )
+        else:
+            # send_file 的响应直接交给服务器（可走sendfile），不会触发 call_on_close，
+            # 因此把清理挂在文件关闭上：服务器发送完毕关闭文件时删除工作目录
+            sent_at = time.perf_counter()
+
+            def release():
+                STAGE_SECONDS.observe(time.perf_counter() - sent_at, stage="response_send")
+                workspaces.remove(workdir)
+
+            file = WorkdirFile(path, release)
+            stat = os.fstat(file.fileno())
+            response = send_file(
+                file,
+                as_attachment=True,
+                download_name=download_name,
+                mimetype=spec["mimetype"],
+                last_modified=stat.st_mtime,
+            )
+            # send_file 无法得知文件对象的大小；304等条件响应没有正文，不能带完整长度
+            if response.status_code == 200:
+                response.content_length = stat.st_size
+        if etag:
+            response.set_etag(etag)
+        return response
+
+    def finish_sync(rv, result: str, timings: StageTimings, started: float):
+        """记录同步转换的结果指标，并按配置附带 Server-Timing 响应头"""
+        elapsed = time.perf_counter() - started
+        CONVERSIONS.inc(mode="sync", result=result)
+        CONVERSION_SECONDS.observe(elapsed, mode="sync")
+        response = make_response(rv)
+        if app.config["SERVER_TIMING"]:
+            timings.add("total", elapsed)
+            response.headers["Server-Timing"] = timings.server_timing()
+        return response
+
+    def not_modified(etag: str):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    def store_in_cache(cache_key: str, output_path: Path, summary: Dict, output_format: str = "docx") -> bool:
+        """
+        只缓存所有图表都渲染成功的结果，避免临时故障被长期复用
+
+        Returns:
+            结果是否完整；只有完整的结果才以缓存键作为ETag发送，
+            否则客户端会凭ETag得到304而一直保留有图表缺失的文件
+        """
+        if summary.get("mermaid_failed"):
+            return False
+        conversion_cache = get_conversion_cache()
+        if conversion_cache is not None:
+            conversion_cache.store(conversion_cache_entry(cache_key, output_format), str(output_path))
+        return True
+
+    def convert_to_formats(display_name: str, ingested: MarkdownIngestBuffer, template_name: Optional[str],
+                           formats: List[str], diagram_format: str, timings: StageTimings, started: float):
+        """
+        多格式输出：只请求一种格式时直接返回该文件，否则返回包含各格式文件的zip
+
+        每种格式单独缓存，只生成缓存中缺少的格式。
+        """
+        template_path, template_hash = resolve_template(template_name)
+        cache_keys = {
+            fmt: conversion_cache_key(ingested.sha256, template_hash, fmt, diagram_format) for fmt in formats
+        }
+        etag = cache_keys[formats[0]] if len(formats) == 1 else make_cache_key(*cache_keys.values())
+        if request.if_none_match.contains(etag):
+            logger.info("Client already has conversion result for %s", display_name)
+            return finish_sync(not_modified(etag), "not_modified", timings, started)
+
+        tmpdir_path = workspaces.create(ingested.size)
+        try:
+            outputs = {}
+            conversion_cache = get_conversion_cache()
+            if conversion_cache is not None:
+                for fmt in formats:
+                    cached_output = tmpdir_path / f"output.{OUTPUT_FORMATS[fmt]['extension']}"
+                    if conversion_cache.fetch(conversion_cache_entry(cache_keys[fmt], fmt), str(cached_output)):
+                        outputs[fmt] = cached_output
+
+            missing = [fmt for fmt in formats if fmt not in outputs]
+            result = "cached"
+            if missing:
+                logger.info("Starting conversion for file: %s (%s)", display_name, ", ".join(missing))
+                summary = {}
+                produced = run_multi_format_conversion(
+                    tmpdir_path, ingested.finish(), template_path, display_name, missing,
+                    summary=summary, has_mermaid=ingested.has_mermaid, timings=timings,
+                    diagram_format=diagram_format
+                )
+                complete = [
+                    store_in_cache(cache_keys[fmt], path, summary, fmt) for fmt, path in produced.items()
+                ]
+                if not all(complete):
+                    etag = None
+                outputs.update(produced)
+                result = "success"
+            else:
+                logger.info("Conversion cache hit for file: %s (%s)", display_name, ", ".join(formats))
+        except ConversionError as e:
+            workspaces.remove(tmpdir_path)
+            return finish_sync(e.to_response(), "failed", timings, started)
+        except Exception as e:
+            workspaces.remove(tmpdir_path)
+            logger.error("Unexpected error during conversion: %s", e)
+            return finish_sync(({"error": "Internal server error"}, 500), "failed", timings, started)
+
+        if len(formats) == 1:
+            return finish_sync(
+                send_output(outputs[formats[0]], etag, workdir=tmpdir_path, output_format=formats[0]),
+                result, timings, started
+            )
+
+        entries = [(f"document.{OUTPUT_FORMATS[fmt]['extension']}", str(outputs[fmt])) for fmt in formats]
+        response = app.response_class(
+            stream_zip(iter(entries)),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=document.zip"},
+        )
+        if etag:
+            response.set_etag(etag)
+        response.call_on_close(lambda: workspaces.remove(tmpdir_path))
+        return finish_sync(response, result, timings, started)
+
+    def execute_job(job: ConversionJob):
+        """后台线程中执行转换任务"""
+        summary = {}
+        job.timings = StageTimings()
+        started = time.perf_counter()
+        try:
+            job.result_path = run_conversion(
+                job.workdir, job.markdown_text, job.template_path, job.display_name,
+                progress=job.set_stage, summary=summary, has_mermaid=job.has_mermaid,
+                timings=job.timings, diagram_format=job.diagram_format
+            )
+            if store_in_cache(job.cache_key, job.result_path, summary):
+                job.etag = job.cache_key
+            CONVERSIONS.inc(mode="job", result="success")
+        except ConversionError as e:
+            CONVERSIONS.inc(mode="job", result="failed")
+            job.mark_failed(e.message, e.details)
+            workspaces.remove(job.workdir)
+            return
+        except Exception:
+            CONVERSIONS.inc(mode="job", result="failed")
+            workspaces.remove(job.workdir)
+            raise
+        finally:
+            CONVERSION_SECONDS.observe(time.perf_counter() - started, mode="job")
+            # 转换完成后不再需要原文，释放内存
+            job.markdown_text = None
+
+        # 结果保留到任务过期后再清理
+        workspaces.schedule_removal(job.workdir, delay=app.config["JOB_RESULT_TTL"])
+
+    job_queue = JobQueue(
+        execute_job,
+        num_workers=app.config["JOB_WORKERS"],
+        max_backlog=app.config["JOB_MAX_QUEUE"],
+        result_ttl=app.config["JOB_RESULT_TTL"]
+    )
+
+    # 批量转换共享的线程池，限制所有批量请求的总并发
+    batch_executor = ThreadPoolExecutor(
+        max_workers=app.config["BATCH_WORKERS"], thread_name_prefix="batch-convert"
+    )
+    atexit.register(batch_executor.shutdown, wait=False, cancel_futures=True)
+
+    def convert_batch_item(source: Dict, template_path: Optional[Path], template_hash: str,
+                           render_memo: RenderMemo, diagram_format: str) -> Dict:
+        """
+        在批量线程池中转换一个文件（不抛出异常，失败信息写入返回结果）
+
+        Returns:
+            {"status", "path", "workdir", "error", "details", "summary", "timings"}
+        """
+        ingested = source["ingested"]
+        timings = StageTimings()
+        summary = {}
+        outcome = {"status": "failed", "path": None, "workdir": None, "error": None, "details": None,
+                   "summary": summary, "timings": timings}
+        started = time.perf_counter()
+        cache_key = conversion_cache_key(ingested.sha256, template_hash, diagram_format=diagram_format)
+        workdir = workspaces.create(ingested.size)
+        try:
+            # 缓存结果链接到工作目录，避免发送前被缓存淘汰
+            conversion_cache = get_conversion_cache()
+            cached_output = workdir / "output.docx"
+            if conversion_cache is not None and conversion_cache.fetch(
+                    conversion_cache_entry(cache_key), str(cached_output)):
+                outcome.update(status="cached", path=cached_output, workdir=workdir)
+                return outcome
+
+            output_path = run_conversion(
+                workdir, ingested.finish(), template_path, source["name"], summary=summary,
+                has_mermaid=ingested.has_mermaid, timings=timings, render_memo=render_memo,
+                diagram_format=diagram_format
+            )
+            store_in_cache(cache_key, output_path, summary)
+            outcome.update(status="succeeded", path=output_path, workdir=workdir)
+            return outcome
+        except ConversionError as e:
+            workspaces.remove(workdir)
+            outcome.update(error=e.message, details=e.details)
+            return outcome
+        except Exception as e:
+            workspaces.remove(workdir)
+            logger.error("Unexpected error converting %s in batch: %s", source["name"], e)
+            outcome.update(error="Internal server error")
+            return outcome
+        finally:
+            # 清单中的状态名沿用 succeeded，指标标签与同步、任务模式一致
+            CONVERSIONS.inc(mode="batch", result="success" if outcome["status"] == "succeeded" else outcome["status"])
+            CONVERSION_SECONDS.observe(time.perf_counter() - started, mode="batch")
+
+    @app.before_request
+    def assign_request_id():
+        """为每个请求分配关联ID（优先沿用客户端或网关传入的 X-Request-ID）"""
+        request_id = request.headers.get("X-Request-ID", "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        g.request_id = request_id
+        g.request_id_token = set_correlation_id(request_id)
+
+    @app.after_request
+    def echo_request_id(response):
+        if "request_id" in g:
+            response.headers["X-Request-ID"] = g.request_id
+        return response
+
+    @app.teardown_request
+    def clear_request_id(exc):
+        token = g.pop("request_id_token", None)
+        if token is not None:
+            reset_correlation_id(token)
+
     @app.route("/api/health", methods=["GET"])
     def health() -> tuple[dict, int]:
+        render_cache = get_render_cache()
+        conversion_cache = get_conversion_cache()
+        failure_cache = get_failure_cache()
+        # 未安装 Pillow 时图片优化被跳过，在此明确显示
+        image_optimizer = get_image_optimizer()
+
+        renderer = os.environ.get("MERMAID_RENDERER", "cli").lower()
+        renderer_info = {"backend": renderer}
+        if renderer == "browser":
+            renderer_info.update(get_browser_pool().stats())
+
+        pandoc_engine = os.environ.get("PANDOC_ENGINE", "subprocess").lower()
+        pandoc_engine_info = {"backend": pandoc_engine}
+        if pandoc_engine == "server":
+            pandoc_engine_info.update(get_pandoc_server_pool().stats())
+
         return {
             "status": "ok",
-            "pandoc_available": check_pandoc_available()
+            "pandoc_available": check_pandoc_available(),
+            "tools": get_capabilities().snapshot(),
+            "mermaid_cache": render_cache.stats() if render_cache else {"enabled": False},
+            "mermaid_failure_cache": failure_cache.stats() if failure_cache else {"enabled": False},
+            "conversion_cache": conversion_cache.stats() if conversion_cache else {"enabled": False},
+            "mermaid_image_optimizer": (
+                {"enabled": True, "settings": image_optimizer.signature} if image_optimizer else {"enabled": False}
+            ),
+            "mermaid_renderer": renderer_info,
+            "pandoc_engine": pandoc_engine_info,
+            "jobs": job_queue.stats(),
+            "workspaces": workspaces.stats(),
         }, 200
 
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """Prometheus文本格式的指标（进程内统计，多进程部署时需逐个进程采集）"""
+        extra = []
+        cache_samples = []
+        for name, cache in (("mermaid", get_render_cache()), ("conversion", get_conversion_cache())):
+            if cache is not None:
+                stats = cache.stats()
+                cache_samples.append(({"cache": name, "result": "hit"}, stats["hits"]))
+                cache_samples.append(({"cache": name, "result": "miss"}, stats["misses"]))
+        extra += format_metric("docgen_cache_requests_total", "counter", "Cache lookups by result", cache_samples)
+
+        job_stats = job_queue.stats()
+        extra += format_metric("docgen_jobs_queued", "gauge", "Jobs waiting for a worker",
+                               [({}, job_stats["queued"])])
+        extra += format_metric("docgen_jobs_rejected_total", "counter", "Jobs rejected because the queue was full",
+                               [({}, job_stats["rejected"])])
+
+        workspace_stats = workspaces.stats()
+        extra += format_metric("docgen_workspaces", "gauge", "Request workdirs by state", [
+            ({"state": "active"}, workspace_stats["active"]),
+            ({"state": "scheduled"}, workspace_stats["scheduled"]),
+        ])
+        extra += format_metric("docgen_workspace_scheduled_bytes", "gauge",
+                               "Disk used by workdirs waiting for removal",
+                               [({}, workspace_stats["scheduled_bytes"])])
+        extra += format_metric("docgen_workspaces_created_total", "counter", "Request workdirs created by backend", [
+            ({"backend": "memory"}, workspace_stats["created_in_memory"]),
+            ({"backend": "disk"}, workspace_stats["created"] - workspace_stats["created_in_memory"]),
+        ])
+        extra += format_metric(
+            "docgen_workspace_memory_fallbacks_total", "counter",
+            "Workdirs placed on disk although in-memory workdirs are enabled",
+            [({"reason": reason}, count) for reason, count in sorted(workspace_stats["memory_fallback_reasons"].items())]
+        )
+
+        return app.response_class(render_metrics(extra), mimetype="text/plain; version=0.0.4")
+
     @app.route("/api/templates", methods=["GET"])
     def list_templates():
-        templates_dir = Path(app.config["TEMPLATE_FOLDER"])
         templates = [
             {
-                "name": p.name,
-                "path": str(p.resolve()),
+                "name": info["name"],
+                "path": info["path"],
+                "size": info["size"],
+                "mtime": info["mtime"],
             }
-            for p in templates_dir.glob("*.docx")
+            for info in template_registry.list()
         ]
         return jsonify(templates)
 
@@ -235,230 +1037,243 @@ def create_app() -> Flask:
         if not check_pandoc_available():
             return {"error": "Pandoc not available. Please install pandoc first."}, 503
 
-        if "file" not in request.files:
-            logger.warning("Conversion request without file")
-            return {"error": "No file part in request"}, 400
-
-        file = request.files["file"]
-        if file.filename == "":
-            logger.warning("Conversion request with empty filename")
-            return {"error": "No file selected"}, 400
-
-        # 验证文件类型
-        if not file.filename.lower().endswith(('.md', '.markdown')):
-            logger.warning(f"Invalid file type uploaded: {file.filename}")
-            return {"error": "Only Markdown files (.md, .markdown) are allowed"}, 400
-
-        # 验证文件名安全性
-        if not is_safe_filename(file.filename):
-            logger.warning(f"Unsafe filename detected: {file.filename}")
-            return {"error": "Invalid filename"}, 400
-
-        template_name = request.form.get("template")
-
-        # 验证模板名称
-        if template_name:
-            if not validate_template_name(template_name, app.config["TEMPLATE_FOLDER"]):
-                logger.warning(f"Invalid template requested: {template_name}")
-                return {"error": "Invalid template name"}, 400
+        timings = StageTimings()
+        started = time.perf_counter()
 
-        logger.info(f"Starting conversion for file: {file.filename}")
+        # 请求体在首次访问时解析，上传内容同时完成流式解码
+        with stage_timer("upload", timings):
+            files, form = request.files, request.form
 
-        upload_dir = Path(app.config["UPLOAD_FOLDER"])
-        upload_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            with stage_timer("decode", timings):
+                file, template_name, ingested = validate_upload(files, form, template_registry)
+            formats = parse_formats(form.get("formats"))
+            diagram_format = parse_diagram_format(form.get("diagram_format"))
+        except ConversionError as e:
+            return finish_sync(e.to_response(), "rejected", timings, started)
+        except ValueError as e:
+            logger.warning("Invalid output formats requested: %s", form.get("formats"))
+            return finish_sync(({"error": str(e)}, 400), "rejected", timings, started)
+
+        if formats != ["docx"]:
+            return convert_to_formats(file.filename, ingested, template_name, formats, diagram_format, timings, started)
+
+        # 相同内容、模板和工具版本的转换结果可直接复用；客户端已有该结果时返回304
+        template_path, template_hash = resolve_template(template_name)
+        cache_key = conversion_cache_key(ingested.sha256, template_hash, diagram_format=diagram_format)
+
+        if request.if_none_match.contains(cache_key):
+            logger.info("Client already has conversion result for %s", file.filename)
+            return finish_sync(not_modified(cache_key), "not_modified", timings, started)
+
+        conversion_cache = get_conversion_cache()
+        if conversion_cache is not None:
+            cached_path = conversion_cache.lookup(conversion_cache_entry(cache_key))
+            if cached_path is not None:
+                logger.info("Conversion cache hit for file: %s", file.filename)
+                return finish_sync(send_output(cached_path, cache_key), "cached", timings, started)
+
+        logger.info("Starting conversion for file: %s", file.filename)
+
+        tmpdir_path = workspaces.create(ingested.size)
 
-        # 验证文件内容（简单检查是否为文本文件）
         try:
-            file_content = file.read(1024)  # 读取前1KB检查
-            file.seek(0)  # 重置文件指针
+            summary = {}
+            output_path = run_conversion(
+                tmpdir_path, ingested.finish(), template_path, file.filename,
+                summary=summary, has_mermaid=ingested.has_mermaid, timings=timings,
+                diagram_format=diagram_format
+            )
+            etag = cache_key if store_in_cache(cache_key, output_path, summary) else None
 
-            # 检查是否为文本文件
-            if b'\x00' in file_content[:512]:  # 检查空字节，通常表示二进制文件
-                logger.warning(f"Binary file detected: {file.filename}")
-                return {"error": "File appears to be binary, not text"}, 400
+            # 直接发送pandoc输出文件，响应发送完毕即清理工作目录
+            return finish_sync(send_output(output_path, etag, workdir=tmpdir_path), "success", timings, started)
 
+        except ConversionError as e:
+            # 转换失败时立即清理临时目录
+            workspaces.remove(tmpdir_path)
+            logger.info("Cleaned up temporary directory due to conversion error: %s", tmpdir_path)
+            return finish_sync(e.to_response(), "failed", timings, started)
         except Exception as e:
-            logger.error(f"Error reading file content: {e}")
-            return {"error": "Error reading uploaded file"}, 400
+            # 如果出错，立即清理临时目录
+            workspaces.remove(tmpdir_path)
+            logger.info("Cleaned up temporary directory due to error: %s", tmpdir_path)
+            logger.error("Unexpected error during conversion: %s", e)
+            return finish_sync(({"error": "Internal server error"}, 500), "failed", timings, started)
+
+    @app.route("/api/convert/batch", methods=["POST"])
+    def convert_batch():
+        """
+        批量转换：上传多个 files 字段或一个 archive 字段（zip），
+        返回边转换边发送的zip，其中包含各文件的DOCX和 manifest.json（逐个文件的结果）
+        """
+        if not check_pandoc_available():
+            return {"error": "Pandoc not available. Please install pandoc first."}, 503
 
-        # 使用不自动删除的临时目录
-        tmpdir_path = Path(tempfile.mkdtemp(dir=upload_dir))
-        input_path = tmpdir_path / "input.md"
-        output_path = tmpdir_path / "output.docx"
+        template_name = request.form.get("template")
+        if template_name and not validate_template_name(template_name, template_registry):
+            logger.warning("Invalid template requested: %s", template_name)
+            return {"error": "Invalid template name"}, 400
 
         try:
-            file.save(input_path)
-
-            # 在调用 Pandoc 之前，先把 Markdown 中的 mermaid 代码块转换成图片
-            try:
-                logger.info(f"Starting Mermaid processing for file: {file.filename}")
-                markdown_text = input_path.read_text(encoding="utf-8")
-                logger.info(f"Successfully read markdown file, length: {len(markdown_text)} characters")
-
-                # 检查是否包含Mermaid代码块
-                if "```mermaid" in markdown_text.lower():
-                    logger.info("Mermaid code blocks detected in the input")
-                    processed_markdown = process_mermaid_blocks_detailed(markdown_text, tmpdir_path)
-
-                    if processed_markdown != markdown_text:
-                        input_path.write_text(processed_markdown, encoding="utf-8")
-                        logger.info("Successfully processed mermaid blocks and updated input file for %s", file.filename)
-                    else:
-                        logger.info("Mermaid processing completed but content unchanged for %s", file.filename)
-                else:
-                    logger.info("No Mermaid code blocks found in the input file")
-
-            except UnicodeDecodeError as e:
-                logger.error(f"Failed to decode markdown file as UTF-8: {file.filename}, error: {e}")
-                logger.warning("Continuing with Pandoc conversion using original file")
-            except Exception as e:
-                # Mermaid 处理失败时记录详细错误但不中断转换
-                logger.error(f"Mermaid processing failed for {file.filename}: {e}")
-                logger.error(f"Exception type: {type(e).__name__}")
-                import traceback
-                logger.error(f"Traceback: {traceback.format_exc()}")
-
-                # 检查是否是RuntimeError（来自原有的mermaid处理）
-                if isinstance(e, RuntimeError):
-                    logger.error("Critical Mermaid processing error, aborting conversion")
-                    # 出错时立即清理临时目录
-                    try:
-                        if tmpdir_path.exists():
-                            shutil.rmtree(tmpdir_path, ignore_errors=True)
-                            logger.info(f"Cleaned up temporary directory due to mermaid error: {tmpdir_path}")
-                    except Exception:
-                        pass
-                    return {"error": f"Mermaid processing failed: {str(e)}"}, 500
-                else:
-                    logger.warning("Non-critical Mermaid processing error, continuing with Pandoc conversion using original file")
-
-            cmd = ["pandoc", str(input_path), "-o", str(output_path)]
-
-            if template_name:
-                tpl_path = Path(app.config["TEMPLATE_FOLDER"]) / template_name
-                if tpl_path.is_file():
-                    cmd.extend(["--reference-doc", str(tpl_path)])
-                    logger.info(f"Using template: {template_name}")
-                else:
-                    logger.warning(f"Template file not found: {template_name}")
-
-            try:
-                # 保存当前工作目录并切换到临时目录，确保相对图片路径能正确解析
-                original_cwd = os.getcwd()
-                pandoc_work_dir = tmpdir_path
-
-                logger.info(f"Original working directory: {original_cwd}")
-                logger.info(f"Changing to Pandoc working directory: {pandoc_work_dir}")
-                logger.info(f"Input file: {input_path}")
-                logger.info(f"Output file: {output_path}")
-
-                # 检查工作目录中的images文件夹是否存在
-                workdir_images = tmpdir_path / "images"
-                if workdir_images.exists():
-                    image_files = list(workdir_images.glob("*.png"))
-                    logger.info(f"Found {len(image_files)} images in working directory: {workdir_images}")
-                    for img in image_files[:3]:  # 显示前3个图片文件名
-                        logger.info(f"  - {img.name}")
-                else:
-                    logger.warning(f"Images directory not found in working directory: {workdir_images}")
-
-                # 切换到临时目录
-                os.chdir(pandoc_work_dir)
-
+            diagram_format = parse_diagram_format(request.form.get("diagram_format"))
+            sources = collect_batch_sources(
+                request.files, app.config["BATCH_MAX_FILES"],
+                int(app.config["BATCH_MAX_UNCOMPRESSED_MB"] * 1024 * 1024)
+            )
+        except ConversionError as e:
+            return e.to_response()
+
+        template_path, template_hash = resolve_template(template_name)
+
+        # 整批共享的图表渲染结果，相同图表在所有文件中只渲染一次
+        batch_dir = workspaces.create()
+        render_memo = RenderMemo(str(batch_dir / "diagrams"))
+
+        manifest = []
+        futures = {}
+        for source in sources:
+            entry = {"name": source["name"], "output": source["output"], "status": "failed",
+                     "error": source["error"]}
+            manifest.append(entry)
+            if source["error"] is None:
+                context = contextvars.copy_context()
+                future = batch_executor.submit(
+                    context.run, convert_batch_item, source, template_path, template_hash, render_memo,
+                    diagram_format
+                )
+                futures[future] = entry
+            else:
+                CONVERSIONS.inc(mode="batch", result="rejected")
+        logger.info("Started batch conversion of %d file(s), %d rejected",
+                    len(futures), len(sources) - len(futures))
+
+        def release_unsent(future):
+            outcome = future.result()
+            if outcome["workdir"] is not None:
+                workspaces.remove(outcome["workdir"])
+
+        pending = set(futures)
+
+        def entries():
+            # 先完成的先发送
+            for future in as_completed(futures):
+                pending.discard(future)
+                outcome = future.result()
+                entry = futures[future]
+                summary = outcome["summary"]
+                entry.update(
+                    status=outcome["status"], error=outcome["error"],
+                    mermaid_blocks=summary.get("mermaid_blocks", 0),
+                    mermaid_unique=summary.get("mermaid_unique", 0),
+                    mermaid_failed=summary.get("mermaid_failed", 0),
+                    timings_ms=outcome["timings"].as_dict(),
+                )
+                if outcome["details"]:
+                    entry["details"] = outcome["details"]
+                if outcome["path"] is None:
+                    continue
                 try:
-                    # 在临时目录中执行Pandoc
-                    result = subprocess.run(
-                        cmd,
-                        check=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        timeout=60,  # 60秒超时
-                        cwd=pandoc_work_dir  # 明确指定工作目录
-                    )
-                    logger.info(f"Pandoc conversion successful for {file.filename}")
-                    logger.info(f"Pandoc stdout: {result.stdout.strip()}")
-
+                    yield entry["output"], str(outcome["path"])
                 finally:
-                    # 无论成功失败都要恢复原工作目录
-                    os.chdir(original_cwd)
-                    logger.info(f"Restored working directory to: {original_cwd}")
+                    workspaces.remove(outcome["workdir"])
+
+            yield "manifest.json", json.dumps(
+                {"files": manifest, "diagrams": render_memo.stats()}, ensure_ascii=False, indent=2
+            ).encode("utf-8")
+
+        def close_batch():
+            # 客户端提前断开（包括尚未开始读取响应）：取消未开始的转换，
+            # 进行中的转换完成后删除其工作目录
+            for future in pending:
+                if not future.cancel():
+                    future.add_done_callback(release_unsent)
+            workspaces.remove(batch_dir)
+
+        response = app.response_class(
+            stream_zip(entries()),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=documents.zip"},
+        )
+        response.call_on_close(close_batch)
+        return response
+
+    @app.route("/api/jobs", methods=["POST"])
+    def create_job():
+        if not check_pandoc_available():
+            return {"error": "Pandoc not available. Please install pandoc first."}, 503
 
-            except subprocess.TimeoutExpired:
-                # 确保在异常情况下也恢复工作目录
-                try:
-                    if 'original_cwd' in locals():
-                        os.chdir(original_cwd)
-                        logger.info(f"Restored working directory after timeout to: {original_cwd}")
-                except Exception as e:
-                    logger.error(f"Failed to restore working directory: {e}")
-                logger.error(f"Pandoc conversion timeout for {file.filename}")
-                return {"error": "Conversion timeout - file may be too large or complex"}, 500
-            except FileNotFoundError:
-                # 确保在异常情况下也恢复工作目录
-                try:
-                    if 'original_cwd' in locals():
-                        os.chdir(original_cwd)
-                        logger.info(f"Restored working directory after FileNotFoundError to: {original_cwd}")
-                except Exception as e:
-                    logger.error(f"Failed to restore working directory: {e}")
-                logger.error("Pandoc not found during conversion")
-                return {
-                    "error": "Pandoc not found. Please install pandoc and ensure it is in PATH."
-                }, 500
-            except subprocess.CalledProcessError as exc:
-                # 确保在异常情况下也恢复工作目录
-                try:
-                    if 'original_cwd' in locals():
-                        os.chdir(original_cwd)
-                        logger.info(f"Restored working directory after CalledProcessError to: {original_cwd}")
-                except Exception as e:
-                    logger.error(f"Failed to restore working directory: {e}")
-                logger.error(f"Pandoc conversion failed for {file.filename}: {exc.stderr}")
-                return {
-                    "error": "Pandoc conversion failed",
-                    "details": exc.stderr,
-                }, 500
-
-            if not output_path.exists():
-                logger.error(f"Output file was not created for {file.filename}")
-                return {"error": "Output file was not created"}, 500
-
-            # 复制文件到另一个临时位置，避免文件锁定
-            final_output_path = tmpdir_path / "final_output.docx"
-            shutil.copy2(output_path, final_output_path)
-
-            # 清理原始的pandoc输出文件
-            if output_path.exists():
-                output_path.unlink()
-
-            # 设置延迟清理，给文件下载留出足够时间
-            delayed_cleanup(tmpdir_path, delay=300)  # 5分钟后清理
-
-            return send_file(
-                final_output_path,
-                as_attachment=True,
-                download_name="document.docx",
-                mimetype=(
-                    "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                ),
-            )
+        try:
+            file, template_name, ingested = validate_upload(request.files, request.form, template_registry)
+            diagram_format = parse_diagram_format(request.form.get("diagram_format"))
+        except ConversionError as e:
+            return e.to_response()
+
+        template_path, template_hash = resolve_template(template_name)
 
+        tmpdir_path = workspaces.create(ingested.size)
+
+        try:
+            job = ConversionJob(tmpdir_path, template_path, file.filename)
+            job.correlation_id = get_correlation_id()
+            job.diagram_format = diagram_format
+            job.cache_key = conversion_cache_key(ingested.sha256, template_hash, diagram_format=diagram_format)
+
+            # 缓存命中时任务直接完成，无需排队
+            conversion_cache = get_conversion_cache()
+            cached_output = tmpdir_path / "output.docx"
+            if conversion_cache is not None and conversion_cache.fetch(
+                    conversion_cache_entry(job.cache_key), str(cached_output)):
+                job.result_path = cached_output
+                job.etag = job.cache_key
+                job_queue.complete(job)
+                CONVERSIONS.inc(mode="job", result="cached")
+                workspaces.schedule_removal(tmpdir_path, delay=app.config["JOB_RESULT_TTL"])
+                logger.info("Conversion cache hit for job %s: %s", job.id, file.filename)
+                return job.to_dict(), 200, {"Location": f"/api/jobs/{job.id}"}
+
+            job.markdown_text = ingested.finish()
+            job.has_mermaid = ingested.has_mermaid
+            job_queue.submit(job)
+        except JobQueueFull:
+            CONVERSIONS.inc(mode="job", result="rejected")
+            workspaces.remove(tmpdir_path)
+            logger.warning("Job queue full, rejecting conversion for %s", file.filename)
+            return {"error": "Too many pending conversions, please retry later"}, 429, {"Retry-After": "5"}
         except Exception as e:
-            # 如果出错，立即清理临时目录
-            try:
-                if tmpdir_path.exists():
-                    shutil.rmtree(tmpdir_path, ignore_errors=True)
-                    logger.info(f"Cleaned up temporary directory due to error: {tmpdir_path}")
-            except:
-                pass
-            logger.error(f"Unexpected error during conversion: {e}")
+            workspaces.remove(tmpdir_path)
+            logger.error("Failed to create conversion job: %s", e)
             return {"error": "Internal server error"}, 500
 
+        logger.info("Queued conversion job %s for file: %s", job.id, file.filename)
+        return job.to_dict(), 202, {"Location": f"/api/jobs/{job.id}"}
+
+    @app.route("/api/jobs/<job_id>", methods=["GET"])
+    def get_job(job_id: str):
+        job = job_queue.get(job_id)
+        if job is None:
+            return {"error": "Job not found"}, 404
+        return job.to_dict(), 200
+
+    @app.route("/api/jobs/<job_id>/result", methods=["GET"])
+    def get_job_result(job_id: str):
+        job = job_queue.get(job_id)
+        if job is None:
+            return {"error": "Job not found"}, 404
+        if job.status == JOB_FAILED:
+            return {"error": job.error, "details": job.details}, 500
+        if job.status != JOB_SUCCEEDED:
+            return {"error": "Job not finished", "status": job.status}, 409
+        if job.etag and request.if_none_match.contains(job.etag):
+            return not_modified(job.etag)
+        if job.result_path is None or not job.result_path.exists():
+            return {"error": "Job result expired"}, 410
+
+        return send_output(job.result_path, job.etag)
+
     return app
 
 
 if __name__ == "__main__":
     flask_app = create_app()
     flask_app.run(host="0.0.0.0", port=5000, debug=True)
-
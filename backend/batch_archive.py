@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+批量转换的压缩包读写
+读取上传的zip中的Markdown文件，并把转换结果边生成边以zip流的形式发送给客户端。
+"""
+
+import io
+import posixpath
+import zipfile
+from typing import Iterable, Iterator, List, Tuple, Union
+
+MARKDOWN_SUFFIXES = ('.md', '.markdown')
+
+
+class BatchArchiveError(Exception):
+    """上传的压缩包无法使用"""
+
+
+def read_markdown_archive(stream, max_files: int, max_bytes: int) -> List[Tuple[str, bytes]]:
+    """
+    读取zip中的全部Markdown文件
+
+    Args:
+        stream: 上传的zip文件流（需可随机访问）
+        max_files: Markdown文件数上限
+        max_bytes: 解压后总大小上限
+
+    Returns:
+        [(包内相对路径, 文件内容)]，按包内顺序
+
+    Raises:
+        BatchArchiveError: 不是有效的zip、包含不安全路径或超出限制
+    """
+    try:
+        archive = zipfile.ZipFile(stream)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise BatchArchiveError(f"Invalid zip archive: {e}")
+
+    with archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and info.filename.lower().endswith(MARKDOWN_SUFFIXES)
+            and not posixpath.basename(info.filename).startswith('.')
+            and not info.filename.startswith('__MACOSX/')
+        ]
+        if len(members) > max_files:
+            raise BatchArchiveError(f"Too many Markdown files in archive (limit {max_files})")
+        if sum(info.file_size for info in members) > max_bytes:
+            raise BatchArchiveError("Archive content too large")
+
+        entries = []
+        total = 0
+        for info in members:
+            name = posixpath.normpath(info.filename.replace('\\', '/'))
+            if name.startswith(('/', '../')) or name == '..':
+                raise BatchArchiveError(f"Unsafe path in archive: {info.filename}")
+            with archive.open(info) as member:
+                # 不信任头部记录的大小，按实际读取量再次限制
+                data = member.read(max_bytes - total + 1)
+            total += len(data)
+            if total > max_bytes:
+                raise BatchArchiveError("Archive content too large")
+            entries.append((name, data))
+        return entries
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """只写、不可随机访问的缓冲区，zipfile 写入的数据由生成器分块取走"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, Union[str, bytes]]]) -> Iterator[bytes]:
+    """
+    逐个条目生成zip数据流
+
+    Args:
+        entries: (包内路径, 文件路径或字节内容) 的迭代器，可以是边转换边产出的生成器
+
+    Yields:
+        zip数据块
+    """
+    buffer = _ChunkBuffer()
+    try:
+        # DOCX本身已是压缩格式，直接存储；清单等小文本同样存储即可
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for arcname, content in entries:
+                if isinstance(content, bytes):
+                    archive.writestr(arcname, content)
+                else:
+                    archive.write(content, arcname)
+                chunk = buffer.drain()
+                if chunk:
+                    yield chunk
+        chunk = buffer.drain()
+        if chunk:
+            yield chunk
+    finally:
+        # 客户端中途断开时也要让条目生成器执行清理
+        close = getattr(entries, 'close', None)
+        if close is not None:
+            close()
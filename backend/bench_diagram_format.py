@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+图表图片格式基准测试
+分别以 PNG 和 SVG 渲染同一文档中的Mermaid图表并生成DOCX，对比渲染耗时和输出体积。
+需要本机可用的 mmdc 和 pandoc；渲染缓存在测试中禁用。
+用法: python bench_diagram_format.py [图表数量 ...]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+# 每次都真实渲染，避免缓存命中影响对比
+os.environ["MERMAID_CACHE_ENABLED"] = "false"
+os.environ["MERMAID_FAILURE_CACHE_ENABLED"] = "false"
+
+from app import run_conversion  # noqa: E402
+from metrics import StageTimings  # noqa: E402
+
+FORMATS = ('png', 'svg')
+
+
+def build_document(diagrams: int) -> str:
+    """生成包含指定数量互不相同的Mermaid图表的Markdown文档"""
+    parts = ["# 基准测试文档\n\n"]
+    for i in range(diagrams):
+        parts.append(f"## 第{i + 1}节\n\n说明文字。\n\n")
+        parts.append(
+            f"```mermaid\ngraph TD\n    A{i}[接收请求] --> B{i}{{校验}}\n"
+            f"    B{i} -->|通过| C{i}[渲染图表]\n    B{i} -->|失败| D{i}[返回错误]\n"
+            f"    C{i} --> E{i}[生成文档]\n```\n\n"
+        )
+    return ''.join(parts)
+
+
+def media_bytes(docx_path: Path) -> int:
+    with zipfile.ZipFile(docx_path) as archive:
+        return sum(info.file_size for info in archive.infolist() if info.filename.startswith('word/media/'))
+
+
+def run(document: str, diagram_format: str):
+    with tempfile.TemporaryDirectory() as workdir:
+        timings = StageTimings()
+        summary = {}
+        started = time.perf_counter()
+        output = run_conversion(
+            Path(workdir), document, None, f"bench-{diagram_format}.md",
+            summary=summary, timings=timings, diagram_format=diagram_format
+        )
+        total_ms = (time.perf_counter() - started) * 1000
+        if summary.get("mermaid_failed"):
+            raise RuntimeError(f"{summary['mermaid_failed']} diagram(s) failed to render as {diagram_format}")
+        stages = timings.as_dict()
+        return {
+            "render_ms": stages.get("mermaid_render", 0.0),
+            "pandoc_ms": stages.get("pandoc", 0.0),
+            "total_ms": total_ms,
+            "docx_kb": output.stat().st_size / 1024,
+            "media_kb": media_bytes(output) / 1024,
+        }
+
+
+def main():
+    logging.disable(logging.WARNING)
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 5, 20]
+
+    print(f"{'diagrams':>8} {'format':>6} {'render':>9} {'pandoc':>9} {'total':>9} {'docx(KB)':>9} {'media(KB)':>10}")
+    for count in counts:
+        document = build_document(count)
+        for diagram_format in FORMATS:
+            result = run(document, diagram_format)
+            print(f"{count:>8} {diagram_format:>6} {result['render_ms']:>7.0f}ms {result['pandoc_ms']:>7.0f}ms "
+                  f"{result['total_ms']:>7.0f}ms {result['docx_kb']:>9.1f} {result['media_kb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Mermaid代码块提取/恢复基准测试
+对比逐块 str.replace 的旧实现与单次扫描按位置拼接的新实现，
+用法: python bench_mermaid_extract.py [图表数量 ...]
+"""
+
+import logging
+import sys
+import time
+
+from mermaid_processor import MermaidProcessor
+
+PARAGRAPH = "这是一段用于填充文档的正文内容，模拟真实交底书中图表之间的说明文字。\n\n" * 20
+
+
+def build_document(diagrams: int) -> str:
+    """生成包含指定数量Mermaid图表的Markdown文档"""
+    parts = ["# 基准测试文档\n\n"]
+    for i in range(diagrams):
+        parts.append(PARAGRAPH)
+        parts.append(f"```mermaid\ngraph TD\n    A{i}[开始] --> B{i}[处理]\n    B{i} --> C{i}[结束]\n```\n\n")
+    return ''.join(parts)
+
+
+def legacy_extract(processor: MermaidProcessor, content: str):
+    """旧实现：findall 后对整篇内容逐块 replace"""
+    blocks = []
+    processed_content = content
+    for i, mermaid_code in enumerate(processor.mermaid_pattern.findall(content)):
+        mermaid_code = mermaid_code.strip()
+        if not processor._is_valid_mermaid(mermaid_code):
+            continue
+        image_reference = f"![图表](images/diagram-{i + 1}.png)"
+        original_block = f'```mermaid\n{mermaid_code}\n```'
+        blocks.append((original_block, image_reference))
+        processed_content = processed_content.replace(original_block, image_reference, 1)
+    return processed_content, blocks
+
+
+def legacy_restore(content: str, blocks, failed_indices):
+    for index in sorted(failed_indices, reverse=True):
+        original_block, image_reference = blocks[index]
+        content = content.replace(image_reference, original_block, 1)
+    return content
+
+
+def timed(func, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    # 屏蔽逐块日志，只测量提取本身
+    logging.disable(logging.INFO)
+    counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500, 1000]
+    processor = MermaidProcessor()
+    # 计时提取时使用独立实例，避免覆盖 processor 中供恢复使用的块信息
+    scratch = MermaidProcessor()
+
+    print(f"{'diagrams':>8} {'size(KB)':>9} {'legacy extract':>15} {'extract':>9} "
+          f"{'legacy restore':>15} {'restore':>9}")
+    for count in counts:
+        document = build_document(count)
+        # 每隔一个图表视为渲染失败
+        failed = list(range(0, count, 2))
+
+        legacy_content, legacy_blocks = legacy_extract(processor, document)
+        processed_content, _ = processor.extract_mermaid_blocks(document)
+        restored = processor.restore_failed_blocks(processed_content, failed)
+        assert processor.restore_failed_blocks(processed_content, list(range(count))) == document
+
+        legacy_extract_ms = timed(lambda: legacy_extract(processor, document))
+        extract_ms = timed(lambda: scratch.extract_mermaid_blocks(document))
+        legacy_restore_ms = timed(lambda: legacy_restore(legacy_content, legacy_blocks, failed))
+        restore_ms = timed(lambda: processor.restore_failed_blocks(processed_content, failed))
+
+        print(f"{count:>8} {len(document.encode('utf-8')) / 1024:>9.0f} {legacy_extract_ms:>13.1f}ms "
+              f"{extract_ms:>7.1f}ms {legacy_restore_ms:>13.1f}ms {restore_ms:>7.1f}ms")
+        assert restored.count("```mermaid") == len(failed)
+
+    processor.cleanup()
+    scratch.cleanup()
+
+
+if __name__ == "__main__":
+    main()
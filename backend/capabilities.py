@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+外部工具能力探测
+启动时探测 pandoc、mmdc 等外部工具是否可用及其版本，之后由后台线程按TTL定期刷新，
+请求路径上只读取缓存结果，不再启动子进程。
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+_capabilities: Optional["CapabilityRegistry"] = None
+_capabilities_lock = threading.Lock()
+
+
+class CapabilityRegistry:
+    """外部工具探测结果注册表"""
+
+    def __init__(self, ttl: float):
+        """
+        Args:
+            ttl: 探测结果有效期（秒），后台线程按此间隔刷新
+        """
+        self.ttl = ttl
+        self._commands: Dict[str, Callable[[], List[str]]] = {}
+        self._results: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def register(self, name: str, command: Callable[[], List[str]]):
+        """
+        注册需要探测的工具
+
+        Args:
+            name: 工具名称
+            command: 返回版本查询命令的函数（每次探测时调用，以便读取最新配置）
+        """
+        with self._lock:
+            self._commands[name] = command
+
+    def probe(self, name: str) -> Dict:
+        """立即探测一个工具并更新结果"""
+        cmd = self._commands[name]()
+        started = time.perf_counter()
+        result = {
+            "available": False,
+            "version": None,
+            "path": shutil.which(cmd[0]),
+            "error": None,
+        }
+        try:
+            completed = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+            if completed.returncode == 0:
+                result["available"] = True
+                output = completed.stdout.strip()
+                result["version"] = output.splitlines()[0] if output else None
+            else:
+                result["error"] = completed.stderr.strip()[:200] or f"exit code {completed.returncode}"
+        except (OSError, subprocess.TimeoutExpired) as e:
+            result["error"] = str(e)
+
+        result["probe_latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["probed_at"] = time.time()
+
+        with self._lock:
+            previous = self._results.get(name)
+            self._results[name] = result
+
+        if previous is None or previous["available"] != result["available"] or previous["version"] != result["version"]:
+            if result["available"]:
+                logger.info("Tool %s available: %s (%s)", name, result['version'], result['path'])
+            else:
+                logger.warning("Tool %s not available: %s", name, result['error'])
+        return result
+
+    def probe_all(self):
+        for name in list(self._commands):
+            self.probe(name)
+
+    def get(self, name: str) -> Optional[Dict]:
+        """
+        读取缓存的探测结果；从未探测过的工具会同步探测一次
+
+        Returns:
+            探测结果，未注册的工具返回None
+        """
+        with self._lock:
+            result = self._results.get(name)
+            registered = name in self._commands
+        if result is None and registered:
+            result = self.probe(name)
+        return result
+
+    def is_available(self, name: str) -> bool:
+        result = self.get(name)
+        return bool(result and result["available"])
+
+    def start(self):
+        """同步完成首次探测，并启动后台刷新线程"""
+        self.probe_all()
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="capability-refresh", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.ttl):
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.warning("Capability refresh failed: %s", e)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: dict(result) for name, result in self._results.items()}
+
+
+def _mermaid_cli_command() -> List[str]:
+    from mermaid_processor import resolve_mermaid_cli
+    return [resolve_mermaid_cli(), "--version"]
+
+
+def get_capabilities() -> CapabilityRegistry:
+    """
+    获取进程共享的能力注册表
+
+    通过环境变量配置：
+        CAPABILITY_PROBE_TTL: 刷新间隔秒数（默认300）
+    """
+    global _capabilities
+    with _capabilities_lock:
+        if _capabilities is None:
+            _capabilities = CapabilityRegistry(ttl=float(os.environ.get("CAPABILITY_PROBE_TTL", "300")))
+            _capabilities.register("pandoc", lambda: ["pandoc", "--version"])
+            _capabilities.register("mmdc", _mermaid_cli_command)
+        return _capabilities
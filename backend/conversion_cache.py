@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+整篇文档转换结果缓存
+相同的Markdown内容、模板、输出格式和工具版本会得到相同的结果，命中时直接返回缓存文件；
+缓存键同时作为HTTP ETag使用。
+"""
+
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+from capabilities import get_capabilities
+from disk_cache import DiskLRUCache, make_cache_key
+from docx_repack import repack_settings_key
+from output_formats import OUTPUT_FORMATS
+from mermaid_processor import image_settings_key
+
+_conversion_cache: Optional[DiskLRUCache] = None
+_conversion_cache_lock = threading.Lock()
+
+
+def conversion_cache_key(content_sha256: str, template_hash: str = '', output_format: str = 'docx',
+                         diagram_format: str = 'png') -> str:
+    """
+    计算转换结果的缓存键
+
+    Args:
+        content_sha256: 上传的Markdown原始内容的SHA-256
+        template_hash: 参考模板内容哈希（来自模板注册表），不使用模板时为空
+        output_format: 输出格式；DOCX计入重新打包设置，其他格式计入格式名称
+        diagram_format: 图表图片格式，PNG不计入键中；渲染倍率和PNG优化参数与渲染缓存键相同
+
+    Returns:
+        缓存键（同时用作ETag）
+    """
+    capabilities = get_capabilities()
+    pandoc = capabilities.get("pandoc") or {}
+    mmdc = capabilities.get("mmdc") or {}
+
+    parts = [
+        content_sha256,
+        template_hash,
+        pandoc.get("version"),
+        mmdc.get("version"),
+        os.environ.get("MERMAID_RENDERER", "cli").lower(),
+    ]
+    if diagram_format != 'png':
+        parts.append(f"diagrams:{diagram_format}")
+    # 修改DPI、倍率等设置后不再返回按旧设置生成的文档（也不再以旧ETag返回304）
+    parts.extend(image_settings_key(diagram_format))
+    if output_format == 'docx':
+        # 重新打包的压缩级别和媒体合并会改变生成的文件
+        parts.append(repack_settings_key())
+    else:
+        parts.append(output_format)
+        if output_format == 'pdf':
+            parts.append(os.environ.get("PANDOC_PDF_ENGINE"))
+    return make_cache_key(*parts)
+
+
+def conversion_cache_entry(cache_key: str, output_format: str = 'docx') -> str:
+    """缓存目录中的条目名：缓存键加输出格式的扩展名"""
+    return f"{cache_key}.{OUTPUT_FORMATS[output_format]['extension']}"
+
+
+def get_conversion_cache() -> Optional[DiskLRUCache]:
+    """
+    获取进程共享的转换结果缓存
+
+    通过环境变量配置：
+        CONVERSION_CACHE_ENABLED: 是否启用（默认 true）
+        CONVERSION_CACHE_DIR: 缓存目录
+        CONVERSION_CACHE_MAX_MB: 容量上限（默认 1024MB）
+        CONVERSION_CACHE_MAX_AGE_DAYS: 条目最大存活天数（默认 7 天）
+
+    Returns:
+        缓存实例，禁用时返回None
+    """
+    global _conversion_cache
+    if os.environ.get("CONVERSION_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    with _conversion_cache_lock:
+        if _conversion_cache is None:
+            cache_dir = os.environ.get(
+                "CONVERSION_CACHE_DIR",
+                str(Path(tempfile.gettempdir()) / "docgen_cache" / "documents")
+            )
+            max_mb = float(os.environ.get("CONVERSION_CACHE_MAX_MB", "1024"))
+            max_age_days = float(os.environ.get("CONVERSION_CACHE_MAX_AGE_DAYS", "7"))
+            _conversion_cache = DiskLRUCache(
+                cache_dir,
+                max_bytes=int(max_mb * 1024 * 1024),
+                max_age=max_age_days * 86400
+            )
+        return _conversion_cache
@@ -173,7 +173,7 @@ def main():
 
     if created_files:
         print(f"\n🎉 成功创建 {len(created_files)} 个模板文件!")
-        print("重启后端服务后即可在前端使用这些模板。")
+        print("将模板复制到 templates_store 目录后即可在前端使用，无需重启后端服务。")
         print("\n提示: 这些是基础模板，您可以在Word中打开并自定义样式。")
     else:
         print("\n❌ 没有成功创建任何模板文件")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+基于内容哈希的磁盘缓存模块
+用于缓存渲染/转换结果文件，支持按容量和过期时间的LRU淘汰
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(src, dest):
+    """硬链接 src 到 dest，跨文件系统或不支持硬链接时复制"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def make_cache_key(*parts) -> str:
+    """
+    根据若干组成部分生成缓存键
+
+    Args:
+        parts: 参与哈希的内容（字符串、字节或其他可转为字符串的值）
+
+    Returns:
+        SHA-256 十六进制摘要
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            data = part
+        else:
+            data = str(part).encode('utf-8')
+        # 写入长度前缀，避免不同拆分方式得到相同的键
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class DiskLRUCache:
+    """磁盘LRU缓存，条目以文件形式保存在缓存目录中"""
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float, suffix: str = ''):
+        """
+        初始化缓存
+
+        Args:
+            directory: 缓存目录
+            max_bytes: 缓存总容量上限（字节）
+            max_age: 条目最大存活时间（秒），0表示不过期
+            suffix: 缓存文件扩展名；为空时文件名即为键，调用方可在键中带上各条目的实际扩展名
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+
+        self._lock = threading.Lock()
+        # key -> (size, mtime)，按最近使用顺序排列
+        self._index: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    def _entry_path(self, key: str) -> Path:
+        """缓存条目路径（按前两位分目录，避免单目录文件过多）"""
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def _load_index(self):
+        """启动时扫描缓存目录，重建内存索引"""
+        entries = []
+        for path in self.directory.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            key = path.name[:len(path.name) - len(self.suffix)] if self.suffix else path.name
+            entries.append((stat.st_mtime, key, stat.st_size))
+
+        # 按修改时间排序，最近使用的放在末尾
+        for mtime, key, size in sorted(entries):
+            self._index[key] = (size, mtime)
+            self._total_bytes += size
+
+        logger.info("Disk cache loaded: %s (%s entries, %s bytes)", self.directory, len(self._index), self._total_bytes)
+
+        with self._lock:
+            self._evict_locked()
+
+    def _is_expired(self, mtime: float, now: float) -> bool:
+        return self.max_age > 0 and now - mtime > self.max_age
+
+    def _remove_locked(self, key: str):
+        """删除条目（调用方需持有锁）"""
+        size, _ = self._index.pop(key, (0, 0))
+        self._total_bytes -= size
+        try:
+            self._entry_path(key).unlink()
+        except OSError:
+            pass
+
+    def _evict_locked(self):
+        """淘汰过期条目以及超出容量的最久未使用条目（调用方需持有锁）"""
+        now = time.time()
+        for key in [k for k, (_, mtime) in self._index.items() if self._is_expired(mtime, now)]:
+            self._remove_locked(key)
+            self.evictions += 1
+
+        while self._index and self._total_bytes > self.max_bytes:
+            oldest_key = next(iter(self._index))
+            self._remove_locked(oldest_key)
+            self.evictions += 1
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """
+        查找缓存条目并标记为最近使用
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            命中时返回缓存文件路径，否则返回None
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            path = self._entry_path(key)
+            now = time.time()
+
+            if entry is None or self._is_expired(entry[1], now) or not path.exists():
+                if entry is not None:
+                    self._remove_locked(key)
+                self.misses += 1
+                return None
+
+            # 更新访问时间，使LRU顺序在重启后依然有效
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+            self._index[key] = (entry[0], now)
+            self._index.move_to_end(key)
+            self.hits += 1
+            return path
+
+    def fetch(self, key: str, dest: str) -> bool:
+        """
+        将缓存条目放到目标路径
+
+        优先使用硬链接（不复制数据），跨文件系统时退回复制。
+        目标文件与缓存条目可能共享同一份数据，调用方不应原地修改目标文件。
+
+        Args:
+            key: 缓存键
+            dest: 目标文件路径
+
+        Returns:
+            是否命中
+        """
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, dest)
+            return True
+        except OSError as e:
+            logger.warning("Failed to copy cache entry %s: %s", key, e)
+            return False
+
+    def store(self, key: str, src: str):
+        """
+        将文件写入缓存（原子替换）；同一文件系统内以硬链接方式写入，不复制数据
+
+        Args:
+            key: 缓存键
+            src: 源文件路径
+        """
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            os.close(fd)
+            os.unlink(tmp_path)
+            link_or_copy(src, tmp_path)
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except OSError as e:
+            logger.warning("Failed to store cache entry %s: %s", key, e)
+            try:
+                os.unlink(tmp_path)
+            except (OSError, UnboundLocalError):
+                pass
+            return
+
+        with self._lock:
+            old_size, _ = self._index.pop(key, (0, 0))
+            self._total_bytes += size - old_size
+            self._index[key] = (size, time.time())
+            self.stores += 1
+            self._evict_locked()
+
+    def stats(self) -> Dict:
+        """缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "directory": str(self.directory),
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
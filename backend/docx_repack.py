@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+DOCX重新打包
+pandoc 生成的DOCX对所有部件统一使用deflate压缩，其中PNG/JPEG等已压缩的图片再压缩几乎没有收益。
+本模块一次遍历原压缩包，按部件类型选择压缩方式：已压缩的媒体直接存储，XML等文本部件使用
+可配置的deflate级别；内容相同的媒体只保留一份，并改写关系文件中的引用。
+"""
+
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import zipfile
+from typing import Dict, Optional
+from xml.sax.saxutils import escape, unescape
+import logging
+
+logger = logging.getLogger(__name__)
+
+_repacker: Optional["DocxRepacker"] = None
+_repacker_lock = threading.Lock()
+
+# 已是压缩格式的媒体，deflate 只会耗费CPU
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.wdp', '.tif', '.tiff'}
+
+CONTENT_TYPES_PART = '[Content_Types].xml'
+
+_RELATIONSHIP = re.compile(r'<Relationship\b[^>]*>')
+_TARGET = re.compile(r'\bTarget="([^"]*)"')
+_OVERRIDE = re.compile(r'<Override\b[^>]*\bPartName="([^"]*)"[^>]*/>\s*')
+
+
+def _is_media(name: str) -> bool:
+    return '/media/' in f'/{name}'
+
+
+def _rels_base(rels_name: str) -> str:
+    """关系文件所属部件的目录，如 word/_rels/document.xml.rels -> word"""
+    return posixpath.dirname(posixpath.dirname(rels_name))
+
+
+def _rewrite_relationships(xml: str, base: str, renamed: Dict[str, str]) -> str:
+    """把指向重复媒体的 Target 改为保留的那一份（相对路径保持相对）"""
+
+    def replace_relationship(match):
+        element = match.group(0)
+        if 'TargetMode="External"' in element:
+            return element
+        target_match = _TARGET.search(element)
+        if target_match is None:
+            return element
+        target = unescape(target_match.group(1))
+        if target.startswith('/'):
+            part = target.lstrip('/')
+        else:
+            part = posixpath.normpath(posixpath.join(base, target))
+        kept = renamed.get(part)
+        if kept is None:
+            return element
+        new_target = '/' + kept if target.startswith('/') else posixpath.relpath(kept, base or '.')
+        return element[:target_match.start(1)] + escape(new_target, {'"': '&quot;'}) + element[target_match.end(1):]
+
+    return _RELATIONSHIP.sub(replace_relationship, xml)
+
+
+def _drop_overrides(xml: str, removed: Dict[str, str]) -> str:
+    """删除已去重部件的 Override 条目"""
+    return _OVERRIDE.sub(lambda m: '' if m.group(1).lstrip('/') in removed else m.group(0), xml)
+
+
+class DocxRepacker:
+    """按部件类型重新压缩DOCX并去除重复媒体"""
+
+    def __init__(self, level: int = 6, dedupe: bool = True):
+        """
+        Args:
+            level: XML等文本部件的deflate级别（1-9，越大越小越慢）
+            dedupe: 是否合并内容相同的媒体文件
+        """
+        self.level = max(1, min(level, 9))
+        self.dedupe = dedupe
+
+    @property
+    def signature(self) -> str:
+        """重新打包参数，参与转换缓存键（同时是ETag），参数变化后不再复用旧的文档"""
+        return f"repack:level={self.level},dedupe={self.dedupe}"
+
+    def _write(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo, data: bytes):
+        """保留原条目的时间和属性，按扩展名选择存储或deflate"""
+        entry = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+        entry.external_attr = info.external_attr
+        if posixpath.splitext(info.filename)[1].lower() in STORED_EXTENSIONS:
+            archive.writestr(entry, data, compress_type=zipfile.ZIP_STORED)
+        else:
+            archive.writestr(entry, data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=self.level)
+
+    def repack(self, path: str) -> Dict[str, int]:
+        """
+        重新打包DOCX文件
+
+        部件按原顺序逐个写出；关系文件和 [Content_Types].xml 很小，缓存到最后再写，
+        这样遍历一次即可知道哪些媒体被合并。结果写入临时文件后替换原文件，
+        不会修改与之硬链接的其他文件（如转换缓存中的条目）。
+
+        Args:
+            path: DOCX文件路径
+
+        Returns:
+            统计：parts、stored、deduplicated、original_bytes、repacked_bytes
+        """
+        original_size = os.path.getsize(path)
+        stats = {"parts": 0, "stored": 0, "deduplicated": 0, "original_bytes": original_size}
+        # 媒体内容哈希 -> 保留的部件名；被合并的部件名 -> 保留的部件名
+        media_by_hash: Dict[str, str] = {}
+        renamed: Dict[str, str] = {}
+        deferred = []
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.docx.tmp')
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(path) as source, \
+                    zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+                for info in source.infolist():
+                    if info.is_dir():
+                        continue
+                    name = info.filename
+                    if name == CONTENT_TYPES_PART or name.endswith('.rels'):
+                        deferred.append((info, source.read(info)))
+                        continue
+
+                    data = source.read(info)
+                    if self.dedupe and _is_media(name):
+                        digest = hashlib.sha256(data).hexdigest()
+                        kept = media_by_hash.setdefault(digest, name)
+                        if kept != name:
+                            renamed[name] = kept
+                            stats["deduplicated"] += 1
+                            continue
+
+                    self._write(target, info, data)
+                    stats["parts"] += 1
+                    if target.getinfo(name).compress_type == zipfile.ZIP_STORED:
+                        stats["stored"] += 1
+
+                for info, data in deferred:
+                    if renamed:
+                        xml = data.decode('utf-8')
+                        if info.filename == CONTENT_TYPES_PART:
+                            xml = _drop_overrides(xml, renamed)
+                        else:
+                            xml = _rewrite_relationships(xml, _rels_base(info.filename), renamed)
+                        data = xml.encode('utf-8')
+                    self._write(target, info, data)
+                    stats["parts"] += 1
+
+            stats["repacked_bytes"] = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        logger.debug("Repacked %s: %s -> %s bytes, %s media part(s) deduplicated",
+                     path, original_size, stats["repacked_bytes"], stats["deduplicated"])
+        return stats
+
+
+def repack_settings_key() -> str:
+    """DOCX重新打包设置，计入DOCX输出的转换缓存键"""
+    repacker = get_docx_repacker()
+    return repacker.signature if repacker is not None else "repack:off"
+
+
+def get_docx_repacker() -> Optional[DocxRepacker]:
+    """
+    获取进程共享的DOCX重新打包器
+
+    通过环境变量配置：
+        DOCX_REPACK_ENABLED: 是否启用（默认 true）
+        DOCX_DEFLATE_LEVEL: XML等文本部件的deflate级别（默认 6）
+        DOCX_DEDUPE_MEDIA: 是否合并内容相同的媒体（默认 true）
+
+    Returns:
+        重新打包器实例，禁用时返回None
+    """
+    global _repacker
+    if os.environ.get("DOCX_REPACK_ENABLED", "true").lower() != "true":
+        return None
+
+    with _repacker_lock:
+        if _repacker is None:
+            _repacker = DocxRepacker(
+                level=int(os.environ.get("DOCX_DEFLATE_LEVEL", "6")),
+                dedupe=os.environ.get("DOCX_DEDUPE_MEDIA", "true").lower() == "true",
+            )
+        return _repacker
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+图表图片优化
+Mermaid渲染的PNG在嵌入文档前裁掉四周空白并以最高压缩级别无损重新压缩，可选量化为调色板图像（有损，默认关闭），
+同时可写入DPI，使图片在文档中按预期的物理尺寸显示。依赖 Pillow（已列入 requirements.txt）；
+未安装时跳过优化，启动后首次使用时记录警告，/api/health 中显示为未启用。
+"""
+
+import os
+import tempfile
+import threading
+from typing import Optional, Tuple
+import logging
+
+try:
+    from PIL import Image, ImageChops
+except ImportError:  # Pillow 为可选依赖
+    Image = None
+    ImageChops = None
+
+logger = logging.getLogger(__name__)
+
+_optimizer: Optional["ImageOptimizer"] = None
+_optimizer_lock = threading.Lock()
+_missing_pillow_logged = False
+
+
+class ImageOptimizer:
+    """PNG图片的裁剪、量化和重新压缩"""
+
+    def __init__(self, crop: bool = True, padding: int = 8, colors: int = 0, dpi: int = 0):
+        """
+        Args:
+            crop: 是否裁掉与背景色相同的四周空白
+            padding: 裁剪后保留的边距（像素）
+            colors: 量化的调色板颜色数（有损），0表示不量化（只做无损重新压缩）
+            dpi: 写入图片的DPI，0表示保持渲染器的设置；以 MERMAID_IMAGE_SCALE 倍率渲染时
+                设为 96×倍率，图片在文档中的尺寸不变而清晰度提高
+        """
+        self.crop = crop
+        self.padding = max(0, padding)
+        self.colors = max(0, min(colors, 256))
+        self.dpi = max(0, dpi)
+
+    @property
+    def signature(self) -> str:
+        """优化参数，参与渲染缓存键，参数变化后不会复用旧的缓存图片"""
+        return f"crop={self.crop},padding={self.padding},colors={self.colors},dpi={self.dpi}"
+
+    def _content_box(self, image, has_alpha: bool) -> Optional[Tuple[int, int, int, int]]:
+        """内容区域（透明背景按透明度，否则按与左上角像素颜色的差异），整张图都是背景时返回None"""
+        if has_alpha:
+            box = image.convert('RGBA').getchannel('A').getbbox()
+        else:
+            rgb = image.convert('RGB')
+            background = Image.new('RGB', rgb.size, rgb.getpixel((0, 0)))
+            box = ImageChops.difference(rgb, background).getbbox()
+        if box is None:
+            return None
+        left, top, right, bottom = box
+        return (
+            max(0, left - self.padding),
+            max(0, top - self.padding),
+            min(image.width, right + self.padding),
+            min(image.height, bottom + self.padding),
+        )
+
+    def optimize(self, path: str) -> Tuple[int, int]:
+        """
+        优化PNG文件
+
+        结果写入临时文件后替换原文件，不会修改与之硬链接的其他文件（如渲染缓存中的条目）。
+
+        Args:
+            path: PNG文件路径
+
+        Returns:
+            (优化前字节数, 优化后字节数)；未采用优化结果时两者相同
+        """
+        original_size = os.path.getsize(path)
+        with Image.open(path) as source:
+            image = source.convert(source.mode)
+            dpi = self.dpi or source.info.get('dpi')
+            has_alpha = source.mode in ('RGBA', 'LA') or 'transparency' in source.info
+
+        cropped = False
+        if self.crop:
+            box = self._content_box(image, has_alpha)
+            if box is not None and box != (0, 0, image.width, image.height):
+                image = image.crop(box)
+                cropped = True
+
+        if self.colors and image.mode != 'P':
+            # 图表多为少量纯色加抗锯齿边缘，量化后肉眼无差别但体积明显减小
+            if has_alpha:
+                image = image.convert('RGBA').quantize(self.colors, method=Image.Quantize.FASTOCTREE)
+            else:
+                image = image.convert('RGB').quantize(self.colors)
+
+        save_options = {"optimize": True}
+        if dpi:
+            save_options["dpi"] = dpi if isinstance(dpi, tuple) else (dpi, dpi)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.png.tmp')
+        os.close(fd)
+        try:
+            image.save(tmp_path, format='PNG', **save_options)
+            optimized_size = os.path.getsize(tmp_path)
+            # 未裁剪、未设置DPI且没有变小时保留原图
+            if optimized_size >= original_size and not cropped and not self.dpi:
+                os.unlink(tmp_path)
+                return original_size, original_size
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        logger.debug("Optimized %s: %s -> %s bytes", path, original_size, optimized_size)
+        return original_size, optimized_size
+
+
+def get_image_optimizer() -> Optional[ImageOptimizer]:
+    """
+    获取进程共享的图片优化器
+
+    通过环境变量配置：
+        MERMAID_IMAGE_OPTIMIZE: 是否启用（默认 true，需要安装 Pillow）
+        MERMAID_IMAGE_CROP: 是否裁掉四周空白（默认 true）
+        MERMAID_IMAGE_PADDING: 裁剪后保留的边距像素（默认 8）
+        MERMAID_IMAGE_COLORS: 调色板颜色数，量化会损失颜色；0表示不量化（默认 0）
+        MERMAID_IMAGE_DPI: 写入的DPI，0表示不修改（默认 0）
+
+    Returns:
+        优化器实例，禁用或未安装 Pillow 时返回None
+    """
+    global _optimizer, _missing_pillow_logged
+    if os.environ.get("MERMAID_IMAGE_OPTIMIZE", "true").lower() != "true":
+        return None
+    if Image is None:
+        if not _missing_pillow_logged:
+            _missing_pillow_logged = True
+            logger.warning("Pillow is not installed, Mermaid image optimization is disabled")
+        return None
+
+    with _optimizer_lock:
+        if _optimizer is None:
+            _optimizer = ImageOptimizer(
+                crop=os.environ.get("MERMAID_IMAGE_CROP", "true").lower() == "true",
+                padding=int(os.environ.get("MERMAID_IMAGE_PADDING", "8")),
+                colors=int(os.environ.get("MERMAID_IMAGE_COLORS", "0")),
+                dpi=int(os.environ.get("MERMAID_IMAGE_DPI", "0")),
+            )
+        return _optimizer
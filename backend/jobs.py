@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+异步转换任务队列
+任务提交后立即返回任务ID，由固定数量的后台线程依次执行，客户端轮询状态并下载结果
+"""
+
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Optional
+import logging
+
+from logging_config import reset_correlation_id, set_correlation_id
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# 各阶段对应的大致进度百分比
+STAGE_PROGRESS = {
+    "queued": 0,
+    "mermaid": 20,
+    "pandoc": 60,
+    "done": 100,
+}
+
+
+class JobQueueFull(Exception):
+    """任务队列已满"""
+
+
+class ConversionJob:
+    """单个转换任务"""
+
+    def __init__(self, workdir: Path, template_path: Optional[Path], display_name: str):
+        """
+        Args:
+            workdir: 任务工作目录
+            template_path: 参考模板路径
+            display_name: 原始文件名
+        """
+        self.id = uuid.uuid4().hex
+        self.workdir = workdir
+        # 待转换的Markdown文本及是否包含Mermaid代码块（上传时已解码检测）
+        self.markdown_text: Optional[str] = None
+        self.has_mermaid: Optional[bool] = None
+        # 图表图片格式（png 或 svg）
+        self.diagram_format: Optional[str] = None
+        self.template_path = template_path
+        self.display_name = display_name
+
+        self.status = JOB_QUEUED
+        self.stage = "queued"
+        self.error: Optional[str] = None
+        self.details: Optional[str] = None
+        self.result_path: Optional[Path] = None
+        # 结果缓存键
+        self.cache_key: Optional[str] = None
+        # 下载结果的ETag，仅在结果完整（可缓存）时等于缓存键
+        self.etag: Optional[str] = None
+        # 各阶段耗时（metrics.StageTimings），开始执行后设置
+        self.timings = None
+        # 日志关联ID，默认沿用提交任务的请求ID
+        self.correlation_id = self.id[:16]
+
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def set_stage(self, stage: str):
+        """更新当前执行阶段（由转换流程回调）"""
+        self.stage = stage
+
+    def mark_failed(self, error: str, details: str = None):
+        self.status = JOB_FAILED
+        self.error = error
+        self.details = details
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "filename": self.display_name,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": STAGE_PROGRESS.get(self.stage, 0),
+            "error": self.error,
+            "details": self.details,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result_url": f"/api/jobs/{self.id}/result" if self.status == JOB_SUCCEEDED else None,
+            "etag": self.etag,
+            "timings_ms": self.timings.as_dict() if self.timings is not None else None,
+        }
+
+
+class JobQueue:
+    """有界任务队列 + 固定数量的工作线程"""
+
+    def __init__(self, handler: Callable[[ConversionJob], None], num_workers: int,
+                 max_backlog: int, result_ttl: float):
+        """
+        Args:
+            handler: 执行任务的函数，失败时可调用 job.mark_failed 或抛出异常
+            num_workers: 工作线程数量
+            max_backlog: 等待执行的任务数上限，超出时拒绝新任务
+            result_ttl: 任务完成后保留状态的时间（秒）
+        """
+        self.handler = handler
+        self.result_ttl = result_ttl
+
+        self._queue: "queue.Queue[ConversionJob]" = queue.Queue(maxsize=max_backlog)
+        self._jobs: Dict[str, ConversionJob] = {}
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.rejected = 0
+
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"conversion-job-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job: ConversionJob):
+        """
+        提交任务
+
+        Raises:
+            JobQueueFull: 等待队列已满
+        """
+        self._purge_expired()
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.rejected += 1
+                raise JobQueueFull()
+            self._jobs[job.id] = job
+            self.submitted += 1
+
+    def complete(self, job: ConversionJob):
+        """登记一个无需执行即已完成的任务（例如结果缓存命中）"""
+        self._purge_expired()
+        now = time.time()
+        job.status = JOB_SUCCEEDED
+        job.stage = "done"
+        job.started_at = job.finished_at = now
+        with self._lock:
+            self._jobs[job.id] = job
+            self.submitted += 1
+
+    def get(self, job_id: str) -> Optional[ConversionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge_expired(self):
+        """移除已完成且超过保留时间的任务"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and now - job.finished_at > self.result_ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            token = set_correlation_id(job.correlation_id)
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            logger.debug("Conversion job %s started: %s", job.id, job.display_name)
+
+            try:
+                self.handler(job)
+                if job.status == JOB_RUNNING:
+                    job.status = JOB_SUCCEEDED
+            except Exception as e:
+                logger.error("Conversion job %s crashed: %s", job.id, e)
+                job.mark_failed("Internal server error")
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
+
+            logger.debug("Conversion job %s %s in %.2fs", job.id, job.status, job.finished_at - job.started_at)
+            reset_correlation_id(token)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            states: Dict[str, int] = {}
+            for job in self._jobs.values():
+                states[job.status] = states.get(job.status, 0) + 1
+            return {
+                "workers": len(self._workers),
+                "queued": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "by_status": states,
+            }
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+日志配置
+业务线程只把日志记录放入队列，由后台线程统一格式化并写入控制台和 docgen.log，
+避免请求处理路径上的同步磁盘写入；每条日志附带当前请求的关联ID，可选输出JSON格式。
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from typing import Optional
+
+# 当前请求（或任务）的关联ID，未处于请求上下文时为 "-"
+_correlation_id: contextvars.ContextVar = contextvars.ContextVar("correlation_id", default="-")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# 可以推迟到后台线程格式化的日志参数类型
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+
+def get_correlation_id() -> str:
+    return _correlation_id.get()
+
+
+def set_correlation_id(value: str) -> contextvars.Token:
+    """设置当前上下文的关联ID，返回的token可用于 reset_correlation_id 恢复"""
+    return _correlation_id.set(value)
+
+
+def reset_correlation_id(token: contextvars.Token):
+    _correlation_id.reset(token)
+
+
+class _CorrelationFilter(logging.Filter):
+    """在记录产生的线程中附加关联ID（格式化在后台线程进行，届时已无法读取上下文）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _correlation_id.get()
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    直接入队原始记录的 QueueHandler
+
+    标准实现会在调用线程中先格式化消息；队列只在进程内使用，无需序列化，
+    因此参数都是不可变的标量时保留 msg/args，由后台线程在写出时再格式化。
+    参数中有列表等可变对象时（如调用方随后继续修改的命令行），在调用线程中立即格式化，
+    避免日志显示写出时的状态。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging():
+    """
+    配置根日志器（重复调用无副作用）
+
+    通过环境变量配置：
+        LOG_LEVEL: 日志级别（默认 INFO；DEBUG 时输出逐个图表的详细信息）
+        LOG_FORMAT: text 或 json（默认 text）
+        LOG_FILE: 日志文件路径（默认 docgen.log，设为空字符串则只输出到控制台）
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    if os.environ.get("LOG_FORMAT", "text").lower() == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]  # 控制台输出
+    log_file = os.environ.get("LOG_FILE", "docgen.log")
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))  # 文件输出
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(_CorrelationFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # 退出时写完队列中剩余的日志
+    atexit.register(_listener.stop)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Markdown上传流式接收
+在multipart解析器写入上传内容的同时完成UTF-8增量解码、二进制检测、内容哈希和Mermaid代码块检测，
+解码后的文本直接保存在内存中交给转换流程，避免先落盘再重复读取。
+"""
+
+import codecs
+import hashlib
+import io
+from typing import Optional
+
+from flask import Request
+
+MERMAID_FENCE = "```mermaid"
+
+# 与原有检查保持一致：前512字节中出现空字节视为二进制文件
+BINARY_SNIFF_BYTES = 512
+
+
+class MarkdownIngestBuffer(io.RawIOBase):
+    """
+    multipart文件容器：逐块接收上传内容并增量解码
+
+    werkzeug 解析请求体时调用 write() 写入每个数据块，解析完成后调用 seek(0)。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')('strict')
+        self._digest = hashlib.sha256()
+        self._parts = []
+        self._tail = ''
+        self._sniffed = b''
+        self._reader: Optional[io.BytesIO] = None
+        self._text: Optional[str] = None
+
+        self.size = 0
+        self.is_binary = False
+        self.decode_error: Optional[str] = None
+        self.has_mermaid = False
+
+    def writable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        self._digest.update(data)
+
+        if len(self._sniffed) < BINARY_SNIFF_BYTES:
+            self._sniffed += data[:BINARY_SNIFF_BYTES - len(self._sniffed)]
+            if b'\x00' in self._sniffed:
+                self.is_binary = True
+
+        # 出错后只继续计算哈希，不再解码
+        if self.is_binary or self.decode_error is not None:
+            return len(data)
+
+        try:
+            text = self._decoder.decode(data)
+        except UnicodeDecodeError as e:
+            self.decode_error = str(e)
+            self._parts = []
+            return len(data)
+
+        if text:
+            self._parts.append(text)
+            if not self.has_mermaid:
+                # 带上前一块的末尾，避免代码块标记被数据块边界截断
+                window = (self._tail + text).lower()
+                self.has_mermaid = MERMAID_FENCE in window
+                self._tail = window[-(len(MERMAID_FENCE) - 1):]
+        return len(data)
+
+    def finish(self) -> Optional[str]:
+        """
+        结束解码并返回完整文本
+
+        Returns:
+            解码后的文本；二进制或非UTF-8内容返回None
+        """
+        if self._text is None and not self.is_binary and self.decode_error is None:
+            try:
+                self._parts.append(self._decoder.decode(b'', final=True))
+            except UnicodeDecodeError as e:
+                self.decode_error = str(e)
+                self._parts = []
+                return None
+            self._text = ''.join(self._parts)
+            self._parts = []
+        return self._text
+
+    @property
+    def sha256(self) -> str:
+        """上传原始内容的SHA-256"""
+        return self._digest.hexdigest()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if self._reader is None:
+            return 0
+        return self._reader.seek(offset, whence)
+
+    def readinto(self, buffer) -> int:
+        # 兼容按文件方式读取（例如 FileStorage.save），按需把文本重新编码
+        if self._reader is None:
+            text = self.finish()
+            self._reader = io.BytesIO(text.encode('utf-8') if text is not None else b'')
+        return self._reader.readinto(buffer)
+
+
+class IngestRequest(Request):
+    """对Markdown上传使用流式接收容器的请求类"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and filename.lower().endswith(('.md', '.markdown')):
+            return MarkdownIngestBuffer()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+def ingest_file(file) -> MarkdownIngestBuffer:
+    """
+    获取上传文件的流式接收结果；未经过 IngestRequest 的文件会在此一次性读入
+
+    Args:
+        file: werkzeug FileStorage
+
+    Returns:
+        已完成解码的接收容器
+    """
+    stream = file.stream
+    if not isinstance(stream, MarkdownIngestBuffer):
+        buffer = MarkdownIngestBuffer()
+        for chunk in iter(lambda: stream.read(64 * 1024), b''):
+            buffer.write(chunk)
+        stream = buffer
+    stream.finish()
+    return stream
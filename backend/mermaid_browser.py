@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+常驻浏览器Mermaid渲染引擎
+维护若干个长期运行的Node渲染进程（mermaid_worker.js），每个进程持有一个预热的浏览器页面，
+通过stdin/stdout上的JSON行协议渲染图表；渲染达到次数上限或进程崩溃时自动重建。
+"""
+
+import atexit
+import json
+import os
+import queue
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).parent / "mermaid_worker.js"
+
+_browser_pool: Optional["BrowserRenderPool"] = None
+_browser_pool_lock = threading.Lock()
+
+
+class WorkerUnavailable(Exception):
+    """渲染进程不可用（启动失败、崩溃或超时）"""
+
+
+class DiagramRenderError(Exception):
+    """渲染器报告图表本身的语法或渲染错误，重复渲染同样会失败"""
+
+
+class BrowserRenderWorker:
+    """单个常驻渲染进程"""
+
+    def __init__(self, worker_id: int, startup_timeout: float = 60):
+        self.worker_id = worker_id
+        self.startup_timeout = startup_timeout
+        self.renders = 0
+        self.started = False
+        self.process: Optional[subprocess.Popen] = None
+        self._responses: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._next_request_id = 0
+
+    def start(self):
+        """启动渲染进程并等待浏览器就绪"""
+        cmd = [os.environ.get("MERMAID_NODE", "node"), str(WORKER_SCRIPT)]
+        puppeteer_config = os.environ.get("MERMAID_PUPPETEER_CONFIG")
+        if puppeteer_config:
+            cmd.append(puppeteer_config)
+
+        env = os.environ.copy()
+        node_path = os.environ.get("MERMAID_NODE_PATH")
+        if node_path:
+            env["NODE_PATH"] = node_path
+
+        try:
+            self.process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                encoding='utf-8',
+                bufsize=1,
+                env=env
+            )
+        except OSError as e:
+            raise WorkerUnavailable(f"Failed to start Mermaid worker: {e}")
+
+        # 独立线程读取stdout，使等待响应可以设置超时；每次启动使用新的响应队列
+        self._responses = queue.Queue()
+        reader = threading.Thread(
+            target=self._read_responses,
+            args=(self.process.stdout, self._responses),
+            name=f"mermaid-worker-{self.worker_id}-reader",
+            daemon=True
+        )
+        reader.start()
+
+        self.started = True
+        message = self._wait_response(self.startup_timeout)
+        if not message.get("ready"):
+            self.stop()
+            raise WorkerUnavailable(f"Unexpected worker handshake: {message}")
+
+        logger.info("Mermaid browser worker %s started (pid %s)", self.worker_id, self.process.pid)
+
+    @staticmethod
+    def _read_responses(stream, responses: queue.Queue):
+        for line in stream:
+            responses.put(line)
+        responses.put(None)  # 进程退出
+
+    def _wait_response(self, timeout: float) -> Dict:
+        try:
+            line = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            self.stop()
+            raise WorkerUnavailable(f"Mermaid worker {self.worker_id} timed out")
+        if line is None:
+            self.stop()
+            raise WorkerUnavailable(f"Mermaid worker {self.worker_id} exited unexpectedly")
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            self.stop()
+            raise WorkerUnavailable(f"Invalid response from Mermaid worker {self.worker_id}: {line[:200]}")
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def render(self, request: Dict, timeout: float) -> Dict:
+        """
+        发送一次渲染请求并等待结果
+
+        Args:
+            request: 渲染参数
+            timeout: 超时时间（秒）
+
+        Returns:
+            渲染进程返回的响应
+        """
+        if not self.alive:
+            raise WorkerUnavailable(f"Mermaid worker {self.worker_id} is not running")
+
+        self._next_request_id += 1
+        request = dict(request, id=self._next_request_id)
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            self.stop()
+            raise WorkerUnavailable(f"Failed to send request to Mermaid worker {self.worker_id}: {e}")
+
+        response = self._wait_response(timeout)
+        self.renders += 1
+        return response
+
+    def stop(self):
+        """停止渲染进程"""
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+        except (OSError, ValueError):
+            pass
+        logger.info("Mermaid browser worker %s stopped after %s renders", self.worker_id, self.renders)
+        self.process = None
+
+
+class BrowserRenderPool:
+    """常驻渲染进程池"""
+
+    def __init__(self, size: int, max_renders: int, timeout: float):
+        """
+        Args:
+            size: 渲染进程数量
+            max_renders: 单个进程最多渲染次数，达到后重建
+            timeout: 单次渲染超时时间（秒）
+        """
+        self.size = size
+        self.max_renders = max_renders
+        self.timeout = timeout
+
+        self._idle: "queue.Queue[BrowserRenderWorker]" = queue.Queue()
+        for worker_id in range(size):
+            self._idle.put(BrowserRenderWorker(worker_id))
+
+        self.retry_interval = 60
+        self._unavailable_until = 0.0
+
+        self._stats_lock = threading.Lock()
+        self.renders = 0
+        self.failures = 0
+        self.restarts = 0
+
+    def render(self, mermaid_code: str, output_path: str, theme: str, background: str,
+               width: int, height: int, scale: float = 1) -> bool:
+        """
+        使用空闲渲染进程渲染图表
+
+        Args:
+            mermaid_code: Mermaid代码
+            output_path: 输出图片路径
+            theme: 主题
+            background: 背景色
+            width: 视口宽度
+            height: 视口高度
+            scale: 像素倍率（截图的设备像素比）
+
+        Returns:
+            渲染是否成功
+
+        Raises:
+            WorkerUnavailable: 渲染进程不可用或浏览器出错（进程已回收），调用方应回退到CLI渲染
+            DiagramRenderError: Mermaid 报告图表解析或渲染错误
+        """
+        if time.monotonic() < self._unavailable_until:
+            raise WorkerUnavailable("Mermaid browser renderer is temporarily disabled after a startup failure")
+
+        worker = self._idle.get()
+        try:
+            # 按需启动，或在达到渲染次数上限后回收重建
+            if worker.alive and worker.renders >= self.max_renders:
+                logger.info("Recycling Mermaid worker %s after %s renders", worker.worker_id, worker.renders)
+                worker.stop()
+            if not worker.alive:
+                if worker.started:
+                    with self._stats_lock:
+                        self.restarts += 1
+                worker.renders = 0
+                try:
+                    worker.start()
+                except WorkerUnavailable:
+                    # 启动失败时暂停一段时间，避免每个图表都重复尝试启动
+                    self._unavailable_until = time.monotonic() + self.retry_interval
+                    raise
+
+            response = worker.render({
+                "code": mermaid_code,
+                "output": os.path.abspath(output_path),
+                "theme": theme,
+                "background": background,
+                "width": width,
+                "height": height,
+                "scale": scale,
+            }, self.timeout)
+            if not response.get("ok") and response.get("kind") != "parse":
+                # 浏览器或页面出错（如 Target closed）：回收该进程，调用方回退到CLI
+                worker.stop()
+                raise WorkerUnavailable(
+                    f"Mermaid worker {worker.worker_id} failed: {response.get('error')}"
+                )
+        except WorkerUnavailable:
+            with self._stats_lock:
+                self.failures += 1
+            raise
+        finally:
+            self._idle.put(worker)
+
+        with self._stats_lock:
+            self.renders += 1
+            if not response.get("ok"):
+                self.failures += 1
+
+        if not response.get("ok"):
+            logger.error("✗ Mermaid could not render diagram: %s", response.get('error'))
+            raise DiagramRenderError(response.get('error') or "render failed")
+        return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "workers": self.size,
+                "max_renders_per_worker": self.max_renders,
+                "renders": self.renders,
+                "failures": self.failures,
+                "restarts": self.restarts,
+            }
+
+    def shutdown(self):
+        """停止所有渲染进程"""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+
+
+def get_browser_pool() -> BrowserRenderPool:
+    """
+    获取进程共享的常驻渲染进程池
+
+    通过环境变量配置：
+        MERMAID_BROWSER_WORKERS: 渲染进程数量（默认2）
+        MERMAID_BROWSER_MAX_RENDERS: 单个进程最多渲染次数（默认200）
+        MERMAID_BROWSER_TIMEOUT: 单次渲染超时秒数（默认30）
+    """
+    global _browser_pool
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            _browser_pool = BrowserRenderPool(
+                size=int(os.environ.get("MERMAID_BROWSER_WORKERS", "2")),
+                max_renders=int(os.environ.get("MERMAID_BROWSER_MAX_RENDERS", "200")),
+                timeout=float(os.environ.get("MERMAID_BROWSER_TIMEOUT", "30"))
+            )
+            atexit.register(_browser_pool.shutdown)
+        return _browser_pool
@@ -4,47 +4,311 @@ Mermaid流程图处理模块
 用于检测、转换和替换Markdown中的Mermaid图表
 """
 
+import contextvars
+import hashlib
+import json
 import re
 import tempfile
 import subprocess
 import os
-import uuid
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 import logging
 
+from capabilities import get_capabilities
+from disk_cache import DiskLRUCache, link_or_copy, make_cache_key
+from mermaid_browser import DiagramRenderError, WorkerUnavailable, get_browser_pool
+from mermaid_validator import get_failure_cache, validate_mermaid
+from image_optimizer import get_image_optimizer
+from metrics import MERMAID_DIAGRAMS, MERMAID_IMAGE_BYTES, MERMAID_RENDER_SECONDS, stage_timer
+
 logger = logging.getLogger(__name__)
 
+_render_cache: Optional[DiskLRUCache] = None
+_render_cache_lock = threading.Lock()
+
+# 全局渲染并发上限：所有请求共享，防止并发请求同时启动过多Chromium进程
+_render_slots = threading.BoundedSemaphore(
+    int(os.environ.get("MERMAID_MAX_CONCURRENT_RENDERS", str(os.cpu_count() or 4)))
+)
+
+# mmdc 因图表本身有误而失败时 stderr 中的错误类型（与超时、进程崩溃等区分）
+MMDC_DIAGRAM_ERROR = re.compile(
+    r'Parse error|Lexical error|Syntax error|UnknownDiagramError|No diagram type detected', re.IGNORECASE
+)
+
+# 图表图片格式：png 为栅格图；svg 为矢量图，跳过浏览器截图，嵌入DOCX后体积更小
+IMAGE_FORMATS = ('png', 'svg')
+
+_svg_config_path: Optional[str] = None
+_svg_config_lock = threading.Lock()
+
+
+def get_image_format(requested: Optional[str] = None) -> str:
+    """
+    确定图表图片格式
+
+    Args:
+        requested: 请求指定的格式，为空时读取 MERMAID_IMAGE_FORMAT（默认png）
+
+    Returns:
+        png 或 svg
+
+    Raises:
+        ValueError: 不支持的格式
+    """
+    image_format = (requested or os.environ.get("MERMAID_IMAGE_FORMAT", "png")).strip().lower()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported diagram format: {image_format}")
+    return image_format
+
+
+def get_image_scale() -> float:
+    """渲染倍率（MERMAID_IMAGE_SCALE，默认1）"""
+    return float(os.environ.get("MERMAID_IMAGE_SCALE", "1"))
+
+
+def image_settings_key(image_format: str) -> List[str]:
+    """
+    影响图表图片内容的设置（渲染倍率、PNG优化参数），计入渲染缓存键和整篇文档的缓存键
+
+    Args:
+        image_format: png 或 svg
+
+    Returns:
+        键的组成部分；默认倍率的SVG为空。PNG优化默认启用，此时包含优化参数，
+        启用优化前渲染的缓存图片不再命中
+    """
+    parts = []
+    scale = get_image_scale()
+    if scale != 1:
+        parts.append(f"scale={scale}")
+    if image_format == 'png':
+        optimizer = get_image_optimizer()
+        if optimizer is not None:
+            parts.append(optimizer.signature)
+    return parts
+
+
+def get_svg_config_path() -> str:
+    """
+    SVG输出使用的mmdc配置文件路径（进程内只生成一次）
+
+    Mermaid默认用 foreignObject 中的HTML排版标签，Word和rsvg都无法显示，
+    因此SVG输出时改为纯SVG文本标签。
+    """
+    global _svg_config_path
+    with _svg_config_lock:
+        if _svg_config_path is None or not os.path.exists(_svg_config_path):
+            fd, path = tempfile.mkstemp(prefix='mermaid-svg-', suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"htmlLabels": False, "flowchart": {"htmlLabels": False}}, f)
+            _svg_config_path = path
+        return _svg_config_path
+
+
+def resolve_mermaid_cli() -> str:
+    """
+    解析Mermaid CLI可执行文件路径
+
+    Returns:
+        mmdc 命令或完整路径
+    """
+    mermaid_cli = os.environ.get("MERMAID_CLI", "mmdc")
+    # 在Windows下检查是否需要使用完整路径
+    if os.name == 'nt' and mermaid_cli == 'mmdc':
+        # 尝试常见的npm安装路径
+        possible_paths = [
+            r"C:\Users\BJB110\AppData\Roaming\npm\mmdc.cmd",
+            r"C:\Users\{}\AppData\Roaming\npm\mmdc.cmd".format(os.getenv('USERNAME', 'BJB110')),
+            "mmdc.cmd"  # 备用
+        ]
+        for path in possible_paths:
+            if os.path.exists(path) or path == "mmdc.cmd":
+                mermaid_cli = path
+                break
+    return mermaid_cli
+
+
+def get_mermaid_cli_version() -> str:
+    """
+    获取Mermaid CLI版本（读取能力注册表的缓存结果），作为渲染缓存键的一部分
+
+    Returns:
+        版本字符串，无法获取时返回 "unknown"
+    """
+    result = get_capabilities().get("mmdc")
+    return (result and result["version"]) or "unknown"
+
+
+def get_render_cache() -> Optional[DiskLRUCache]:
+    """
+    获取进程共享的Mermaid渲染缓存
+
+    通过环境变量配置：
+        MERMAID_CACHE_ENABLED: 是否启用（默认 true）
+        MERMAID_CACHE_DIR: 缓存目录
+        MERMAID_CACHE_MAX_MB: 容量上限（默认 512MB）
+        MERMAID_CACHE_MAX_AGE_DAYS: 条目最大存活天数（默认 30 天）
+
+    Returns:
+        缓存实例，禁用时返回None
+    """
+    global _render_cache
+    if os.environ.get("MERMAID_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    with _render_cache_lock:
+        if _render_cache is None:
+            cache_dir = os.environ.get(
+                "MERMAID_CACHE_DIR",
+                str(Path(tempfile.gettempdir()) / "docgen_cache" / "mermaid")
+            )
+            max_mb = float(os.environ.get("MERMAID_CACHE_MAX_MB", "512"))
+            max_age_days = float(os.environ.get("MERMAID_CACHE_MAX_AGE_DAYS", "30"))
+            _render_cache = DiskLRUCache(
+                cache_dir,
+                max_bytes=int(max_mb * 1024 * 1024),
+                max_age=max_age_days * 86400
+            )
+        return _render_cache
+
+
+class RenderMemo:
+    """
+    一组转换共享的渲染结果（例如批量转换的所有文件）
+
+    相同的图表只渲染一次：第一个请求者负责渲染并把结果链接到共享目录，
+    同时到达的其他请求者等待其完成后直接链接该图片。不依赖磁盘渲染缓存是否启用。
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: 保存共享图片的目录，由调用方在整组转换结束后删除
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self.rendered = 0
+        self.shared = 0
+
+    def render(self, key: str, output_path: str, render) -> bool:
+        """
+        获取图表图片，必要时调用 render() 生成
+
+        Args:
+            key: 图表内容和渲染参数的哈希
+            output_path: 目标图片路径
+            render: 生成 output_path 的函数，返回是否成功
+
+        Returns:
+            是否成功
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = {"done": threading.Event(), "path": None}
+
+        if owner:
+            try:
+                if not render():
+                    return False
+                shared_path = os.path.join(self.directory, key + os.path.splitext(output_path)[1])
+                link_or_copy(output_path, shared_path)
+                entry["path"] = shared_path
+                with self._lock:
+                    self.rendered += 1
+                return True
+            finally:
+                entry["done"].set()
+
+        entry["done"].wait()
+        if entry["path"] is None:
+            return False
+        link_or_copy(entry["path"], output_path)
+        with self._lock:
+            self.shared += 1
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"unique_rendered": self.rendered, "shared": self.shared}
+
+
 class MermaidProcessor:
     """Mermaid图表处理器"""
 
-    def __init__(self, output_dir: str = None):
+    def __init__(self, output_dir: str = None, max_workers: int = None, renderer: str = None,
+                 batch: bool = None, render_memo: Optional[RenderMemo] = None,
+                 image_format: Optional[str] = None):
         """
         初始化处理器
 
         Args:
-            output_dir: 图片输出目录，如果为None则使用项目images目录
+            output_dir: 图片输出目录，如果为None则直接输出到每次请求的 base_dir/images
+            max_workers: 单个文档的并发渲染数，如果为None则读取 MERMAID_RENDER_WORKERS（默认4）
+            renderer: 渲染后端 cli（每个图表启动一次mmdc）或 browser（常驻浏览器进程），
+                如果为None则读取 MERMAID_RENDERER（默认cli）
+            batch: 是否用一次mmdc调用渲染文档中的全部图表（仅cli后端），
+                如果为None则读取 MERMAID_BATCH（默认false）
+            render_memo: 可选，与其他文档共享的渲染结果（设置后不使用mmdc批量模式，以便逐个图表去重）
+            image_format: 图片格式 png 或 svg，如果为None则读取 MERMAID_IMAGE_FORMAT（默认png）
         """
-        # 如果没有指定输出目录，使用项目的images目录
-        if output_dir is None:
-            # 获取项目根目录（从backend目录向上两级）
-            current_dir = Path(__file__).parent
-            project_root = current_dir.parent
-            self.output_dir = str(project_root / "images")
-        else:
-            self.output_dir = output_dir
+        # 未指定输出目录时按请求输出，图片随请求工作目录一起清理
+        self.output_dir = output_dir
 
         self.mermaid_blocks: List[Dict] = []
         self.temp_dir: Optional[str] = None
 
+        # 渲染结果缓存（相同代码和参数的图表直接复用已有PNG）
+        self.render_cache = get_render_cache()
+        # 近期渲染失败过的图表，重复出现时不再启动渲染器
+        self.failure_cache = get_failure_cache()
+
+        # 并发渲染配置（实际同时运行的渲染进程数还受全局上限约束）
+        if max_workers is None:
+            max_workers = int(os.environ.get("MERMAID_RENDER_WORKERS", "4"))
+        self.max_workers = max(1, max_workers)
+
+        # 渲染后端
+        if renderer is None:
+            renderer = os.environ.get("MERMAID_RENDERER", "cli")
+        self.renderer = renderer.lower()
+        if self.renderer not in ('cli', 'browser'):
+            logger.warning("Unknown Mermaid renderer '%s', using cli", renderer)
+            self.renderer = 'cli'
+
+        # 批量渲染模式
+        if batch is None:
+            batch = os.environ.get("MERMAID_BATCH", "false").lower() == "true"
+        self.batch = batch
+        self.render_memo = render_memo
+
+        # 图片格式
+        try:
+            self.image_format = get_image_format(image_format)
+        except ValueError as e:
+            logger.warning("%s, using png", e)
+            self.image_format = 'png'
+
+        # 渲染倍率（mmdc -s / 浏览器 deviceScaleFactor）和PNG优化（裁剪、量化、重新压缩）
+        self.scale = get_image_scale()
+        self.image_optimizer = get_image_optimizer() if self.image_format == 'png' else None
+
         # 测试模式配置
         self.test_mode = os.environ.get("MERMAID_TEST_MODE", "false").lower() == "true"
         self.test_output_dir = os.environ.get("MERMAID_TEST_OUTPUT_DIR", "d:/tmp/mermaid_test")
 
         if self.test_mode:
-            logger.info(f"MermaidProcessor initialized in test mode")
-            logger.info(f"Test output directory: {self.test_output_dir}")
+            logger.info("MermaidProcessor initialized in test mode")
+            logger.info("Test output directory: %s", self.test_output_dir)
 
         # Mermaid语法检测模式
         self.mermaid_pattern = re.compile(
@@ -63,6 +327,10 @@ class MermaidProcessor:
         """
         提取Markdown中的Mermaid代码块
 
+        单次扫描记录每个代码块在原文中的位置，处理后的内容按片段一次拼接生成；
+        每个块同时记录图片引用在处理后内容中的位置，供恢复失败块时直接按位置替换。
+        图片文件名由代码内容哈希得到，文档中重复出现的相同图表引用同一个图片文件。
+
         Args:
             content: Markdown内容
 
@@ -70,49 +338,55 @@ class MermaidProcessor:
             Tuple[处理后的内容, Mermaid块列表]
         """
         self.mermaid_blocks = []
-        processed_content = content
-
-        # 查找所有Mermaid代码块
-        matches = self.mermaid_pattern.findall(content)
+        pieces = []
+        last_end = 0
+        output_length = 0
 
-        for i, mermaid_code in enumerate(matches):
-            mermaid_code = mermaid_code.strip()
+        for i, match in enumerate(self.mermaid_pattern.finditer(content)):
+            mermaid_code = match.group(1).strip()
 
             # 验证是否为有效的Mermaid语法
             if not self._is_valid_mermaid(mermaid_code):
-                logger.warning(f"Invalid Mermaid syntax detected, skipping: {mermaid_code[:50]}...")
+                logger.warning("Invalid Mermaid syntax detected, skipping: %s...", mermaid_code[:50])
                 continue
 
-            # 生成唯一ID和文件名
-            block_id = f"diagram-{i + 1}-{uuid.uuid4().hex[:8]}"
-            image_filename = f"{block_id}.png"
+            # 块ID按出现顺序区分，文件名按内容共享
+            digest = hashlib.sha256(mermaid_code.encode('utf-8')).hexdigest()
+            block_id = f"diagram-{i + 1}-{digest[:8]}"
+            image_filename = f"diagram-{digest[:16]}.{self.image_format}"
 
             # 创建图片引用 - 使用相对路径，Pandoc会正确处理
             image_reference = f"![图表](images/{image_filename})"
 
-            # 记录Mermaid块信息
+            start, end = match.span()
+            pieces.append(content[last_end:start])
+            output_length += start - last_end
+            pieces.append(image_reference)
+
+            # 记录Mermaid块信息；index 为该块在 mermaid_blocks 中的位置
             mermaid_block = {
                 'id': block_id,
                 'filename': image_filename,
                 'code': mermaid_code,
-                'original_block': f'```mermaid\n{mermaid_code}\n```',
+                'original_block': match.group(0),
                 'image_reference': image_reference,
-                'index': i
+                'index': len(self.mermaid_blocks),
+                'span': (start, end),
+                'output_span': (output_length, output_length + len(image_reference)),
             }
+            output_length += len(image_reference)
+            last_end = end
 
             self.mermaid_blocks.append(mermaid_block)
+            logger.debug("Extracted Mermaid block %s: %s...", block_id, mermaid_code[:50])
 
-            # 在内容中替换为图片引用
-            processed_content = processed_content.replace(
-                mermaid_block['original_block'],
-                image_reference,
-                1  # 只替换第一个匹配项
-            )
-
-            logger.info(f"Extracted Mermaid block {block_id}: {mermaid_code[:50]}...")
+        if not self.mermaid_blocks:
+            logger.info("Found 0 Mermaid diagram(s)")
+            return content, self.mermaid_blocks
 
-        logger.info(f"Found {len(self.mermaid_blocks)} Mermaid diagram(s)")
-        return processed_content, self.mermaid_blocks
+        pieces.append(content[last_end:])
+        logger.info("Found %s Mermaid diagram(s)", len(self.mermaid_blocks))
+        return ''.join(pieces), self.mermaid_blocks
 
     def _is_valid_mermaid(self, code: str) -> bool:
         """
@@ -138,24 +412,152 @@ class MermaidProcessor:
         设置图片输出目录
 
         Args:
-            base_dir: 基础目录（现在不再使用，保持兼容性）
+            base_dir: 基础目录（请求工作目录），未配置输出目录时图片写入 base_dir/images
 
         Returns:
             图片输出目录路径
         """
-        # 始终使用配置的输出目录（现在默认是项目images目录）
-        images_dir = Path(self.output_dir)
+        if self.output_dir is None:
+            images_dir = Path(base_dir) / "images"
+        else:
+            images_dir = Path(self.output_dir)
 
         # 确保目录存在
         images_dir.mkdir(parents=True, exist_ok=True)
 
-        logger.info(f"Mermaid images will be saved to: {images_dir}")
+        logger.debug("Mermaid images will be saved to: %s", images_dir)
         return str(images_dir)
 
     def convert_mermaid_to_image(self, mermaid_code: str, output_path: str,
                                 theme: str = 'neutral', background: str = 'white',
                                 width: int = 800, height: int = 600) -> bool:
         """
+        将Mermaid代码转换为图片，优先使用渲染缓存
+
+        Args:
+            mermaid_code: Mermaid代码
+            output_path: 输出图片路径
+            theme: 主题 (neutral, dark, forest, default)
+            background: 背景色
+            width: 图片宽度
+            height: 图片高度
+
+        Returns:
+            转换是否成功
+        """
+        if self.render_memo is not None:
+            memo_key = make_cache_key(mermaid_code, theme, background, width, height, self.image_format)
+            return self.render_memo.render(
+                memo_key, output_path,
+                lambda: self._convert_with_cache(mermaid_code, output_path, theme, background, width, height)
+            )
+        return self._convert_with_cache(mermaid_code, output_path, theme, background, width, height)
+
+    def _convert_with_cache(self, mermaid_code: str, output_path: str, theme: str,
+                            background: str, width: int, height: int) -> bool:
+        """先查渲染缓存，未命中时渲染并写入缓存"""
+        cache_key = self._cache_key(mermaid_code, theme, background, width, height)
+        if cache_key is not None:
+            if self.render_cache.fetch(cache_key, output_path):
+                logger.debug("✓ Mermaid render cache hit: %s", output_path)
+                MERMAID_DIAGRAMS.inc(result="cached")
+                return True
+
+        started = time.perf_counter()
+        try:
+            success = self._render_image(mermaid_code, output_path, theme, background, width, height)
+        except DiagramRenderError:
+            # 只记录渲染器明确报告错误的图表；超时、渲染器缺失或崩溃不应让有效图表被跳过
+            success = False
+            if self.failure_cache is not None:
+                self.failure_cache.add(self._render_key(mermaid_code, theme, background, width, height))
+        MERMAID_RENDER_SECONDS.observe(time.perf_counter() - started, renderer=self.renderer)
+        MERMAID_DIAGRAMS.inc(result="rendered" if success else "failed")
+        if not success:
+            return False
+
+        # 优化后再写入缓存，缓存命中的图片无需重复优化
+        self._optimize_image(output_path)
+
+        if cache_key is not None:
+            self.render_cache.store(cache_key, output_path)
+        return True
+
+    def _render_key(self, mermaid_code: str, theme: str = 'neutral', background: str = 'white',
+                    width: int = 800, height: int = 600) -> str:
+        """图表内容、渲染参数、图片格式和渲染器版本的哈希"""
+        parts = [mermaid_code, theme, background, width, height, get_mermaid_cli_version(), self.renderer]
+        # PNG格式不加入格式名，与加入SVG支持前的键一致
+        if self.image_format != 'png':
+            parts.append(self.image_format)
+        parts.extend(image_settings_key(self.image_format))
+        return make_cache_key(*parts)
+
+    def _optimize_image(self, output_path: str):
+        """优化新渲染的PNG；优化失败时保留原图"""
+        if self.image_optimizer is None:
+            return
+        try:
+            with stage_timer("image_optimize"):
+                original_size, optimized_size = self.image_optimizer.optimize(output_path)
+        except Exception as e:
+            logger.warning("Failed to optimize %s, keeping original image: %s", output_path, e)
+            return
+        MERMAID_IMAGE_BYTES.inc(original_size, stage="original")
+        MERMAID_IMAGE_BYTES.inc(optimized_size, stage="optimized")
+
+    def _cache_key(self, mermaid_code: str, theme: str = 'neutral', background: str = 'white',
+                   width: int = 800, height: int = 600) -> Optional[str]:
+        """渲染缓存条目名（渲染键加图片扩展名）；未启用缓存时返回None"""
+        if self.render_cache is None:
+            return None
+        return f"{self._render_key(mermaid_code, theme, background, width, height)}.{self.image_format}"
+
+    def _precheck(self, block: Dict) -> bool:
+        """
+        渲染前检查：明显无效或近期渲染失败过的图表直接判定失败
+
+        Returns:
+            是否需要渲染
+        """
+        error = validate_mermaid(block['code'])
+        if error is not None:
+            logger.warning("Mermaid block %s rejected before rendering: %s", block['id'], error)
+            MERMAID_DIAGRAMS.inc(result="invalid")
+            return False
+        if self.failure_cache is not None and self.failure_cache.contains(self._render_key(block['code'])):
+            logger.warning("Mermaid block %s failed to render recently, skipping", block['id'])
+            MERMAID_DIAGRAMS.inc(result="known_failure")
+            return False
+        return True
+
+    def _render_image(self, mermaid_code: str, output_path: str, theme: str,
+                      background: str, width: int, height: int) -> bool:
+        """
+        按配置的渲染后端生成图片；常驻浏览器后端不可用时回退到CLI
+
+        Returns:
+            渲染是否成功
+
+        Raises:
+            DiagramRenderError: 渲染器报告图表本身有错误
+        """
+        if self.renderer == 'browser':
+            try:
+                return get_browser_pool().render(
+                    mermaid_code, output_path, theme, background, width, height, self.scale
+                )
+            except WorkerUnavailable as e:
+                logger.warning("Browser renderer unavailable, falling back to Mermaid CLI: %s", e)
+
+        # 占用全局渲染槽位后再启动渲染进程
+        with _render_slots:
+            return self._run_mermaid_cli(mermaid_code, output_path, theme, background, width, height)
+
+    def _run_mermaid_cli(self, mermaid_code: str, output_path: str,
+                         theme: str = 'neutral', background: str = 'white',
+                         width: int = 800, height: int = 600) -> bool:
+        """
         使用Mermaid CLI将代码转换为图片
 
         Args:
@@ -168,6 +570,9 @@ class MermaidProcessor:
 
         Returns:
             转换是否成功
+
+        Raises:
+            DiagramRenderError: mmdc 报告图表语法或渲染错误
         """
         try:
             # 创建临时Mermaid文件
@@ -185,26 +590,14 @@ class MermaidProcessor:
                 os.makedirs(debug_dir, exist_ok=True)
 
                 # 保存原始代码
-                mmd_debug_path = os.path.join(debug_dir, os.path.basename(output_path).replace('.png', '.mmd'))
+                mmd_debug_path = os.path.join(debug_dir, os.path.splitext(os.path.basename(output_path))[0] + '.mmd')
                 with open(mmd_debug_path, 'w', encoding='utf-8') as f:
                     f.write(mermaid_code)
-                logger.info(f"Test mode: mermaid code saved to {mmd_debug_path}")
+                logger.info("Test mode: mermaid code saved to %s", mmd_debug_path)
 
             try:
                 # 构建mmdc命令 - 使用完整路径解决Python子进程PATH问题
-                mermaid_cli = os.environ.get("MERMAID_CLI", "mmdc")
-                # 在Windows下检查是否需要使用完整路径
-                if os.name == 'nt' and mermaid_cli == 'mmdc':
-                    # 尝试常见的npm安装路径
-                    possible_paths = [
-                        r"C:\Users\BJB110\AppData\Roaming\npm\mmdc.cmd",
-                        r"C:\Users\{}\AppData\Roaming\npm\mmdc.cmd".format(os.getenv('USERNAME', 'BJB110')),
-                        "mmdc.cmd"  # 备用
-                    ]
-                    for path in possible_paths:
-                        if os.path.exists(path) or path == "mmdc.cmd":
-                            mermaid_cli = path
-                            break
+                mermaid_cli = resolve_mermaid_cli()
 
                 cmd = [
                     mermaid_cli,
@@ -215,8 +608,13 @@ class MermaidProcessor:
                     '-w', str(width),
                     '-H', str(height)
                 ]
+                # 输出格式由 -o 的扩展名决定；SVG使用纯文本标签
+                if output_path.endswith('.svg'):
+                    cmd.extend(['-c', get_svg_config_path()])
+                if self.scale != 1:
+                    cmd.extend(['-s', str(self.scale)])
 
-                logger.info(f"Running Mermaid CLI: {' '.join(cmd)}")
+                logger.debug("Running Mermaid CLI: %s", cmd)
 
                 # 执行转换
                 result = subprocess.run(
@@ -228,25 +626,25 @@ class MermaidProcessor:
 
                 if result.returncode == 0:
                     # 验证输出文件是否存在
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                        file_size = os.path.getsize(output_path)
-                        logger.info(f"✓ Successfully generated image: {output_path} ({file_size} bytes)")
+                    file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+                    if file_size > 0:
+                        logger.debug("✓ Successfully generated image: %s (%s bytes)", output_path, file_size)
 
                         # 在测试模式下复制图片到调试目录
                         if self.test_mode:
                             debug_image_path = os.path.join(debug_dir, os.path.basename(output_path))
                             import shutil
                             shutil.copy2(output_path, debug_image_path)
-                            logger.info(f"Test mode: image copied to {debug_image_path}")
+                            logger.info("Test mode: image copied to %s", debug_image_path)
 
                         return True
                     else:
-                        logger.error(f"Mermaid CLI completed but output file is empty: {output_path}")
+                        logger.error("Mermaid CLI completed but output file is empty: %s", output_path)
                         return False
                 else:
-                    logger.error(f"✗ Mermaid CLI failed with code {result.returncode}")
-                    logger.error(f"stderr: {result.stderr}")
-                    logger.error(f"stdout: {result.stdout}")
+                    logger.error("✗ Mermaid CLI failed with code %s", result.returncode)
+                    logger.error("stderr: %s", result.stderr)
+                    logger.error("stdout: %s", result.stdout)
 
                     # 在测试模式下保存错误信息
                     if self.test_mode:
@@ -260,12 +658,14 @@ class MermaidProcessor:
                         error_file = os.path.join(debug_dir, "conversion_error.json")
                         with open(error_file, 'w', encoding='utf-8') as f:
                             json.dump(error_info, f, indent=2)
-                        logger.info(f"Test mode: error info saved to {error_file}")
+                        logger.info("Test mode: error info saved to %s", error_file)
 
+                    if MMDC_DIAGRAM_ERROR.search(result.stderr or ''):
+                        raise DiagramRenderError(result.stderr.strip()[:500])
                     return False
 
             except subprocess.TimeoutExpired:
-                logger.error(f"✗ Mermaid conversion timeout for: {output_path}")
+                logger.error("✗ Mermaid conversion timeout for: %s", output_path)
                 return False
 
             finally:
@@ -276,12 +676,76 @@ class MermaidProcessor:
                     except OSError:
                         pass
                 else:
-                    logger.info(f"Test mode: temporary file preserved at {temp_mmd_path}")
+                    logger.info("Test mode: temporary file preserved at %s", temp_mmd_path)
 
+        except DiagramRenderError:
+            raise
         except Exception as e:
-            logger.error(f"✗ Error converting Mermaid to image: {e}")
+            logger.error("✗ Error converting Mermaid to image: %s", e)
             return False
 
+    def _run_mermaid_cli_batch(self, blocks: List[Dict], images_dir: str) -> List[Dict]:
+        """
+        使用一次Mermaid CLI调用渲染多个图表
+
+        mmdc 以Markdown作为输入时，会把其中第N个mermaid代码块渲染为 <输出名>-N.<格式>，
+        据此将输出文件映射回各个块。
+
+        Args:
+            blocks: 待渲染的Mermaid块
+            images_dir: 图片输出目录
+
+        Returns:
+            渲染成功的块列表（即使mmdc整体失败，已生成的图片也会被采用）
+        """
+        # 批量输出目录放在images目录下，保证最终移动是同一文件系统内的重命名
+        batch_dir = tempfile.mkdtemp(prefix='mermaid-batch-', dir=images_dir)
+        try:
+            input_path = os.path.join(batch_dir, 'input.md')
+            output_path = os.path.join(batch_dir, 'output.md')
+            with open(input_path, 'w', encoding='utf-8') as f:
+                for block in blocks:
+                    f.write(f"```mermaid\n{block['code']}\n```\n\n")
+
+            cmd = [
+                resolve_mermaid_cli(),
+                '-i', input_path,
+                '-o', output_path,
+                '-e', self.image_format,
+                '-t', 'neutral',
+                '-b', 'white',
+                '-w', '800',
+                '-H', '600'
+            ]
+            if self.image_format == 'svg':
+                cmd.extend(['-c', get_svg_config_path()])
+            if self.scale != 1:
+                cmd.extend(['-s', str(self.scale)])
+            logger.info("Running Mermaid CLI in batch mode for %s diagrams", len(blocks))
+
+            try:
+                with _render_slots:
+                    result = subprocess.run(
+                        cmd,
+                        capture_output=True,
+                        text=True,
+                        timeout=30 + 10 * len(blocks)
+                    )
+                if result.returncode != 0:
+                    logger.warning("Mermaid CLI batch run failed with code %s: %s", result.returncode, result.stderr)
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.warning("Mermaid CLI batch run failed: %s", e)
+
+            rendered = []
+            for number, block in enumerate(blocks, start=1):
+                batch_image = os.path.join(batch_dir, f'output-{number}.{self.image_format}')
+                if os.path.exists(batch_image) and os.path.getsize(batch_image) > 0:
+                    os.replace(batch_image, os.path.join(images_dir, block['filename']))
+                    rendered.append(block)
+            return rendered
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
     def process_all_mermaid_blocks(self, base_dir: str) -> Tuple[List[str], List[str]]:
         """
         处理所有提取的Mermaid块
@@ -298,66 +762,147 @@ class MermaidProcessor:
         # 设置输出目录
         images_dir = self.setup_output_directory(base_dir)
 
-        successful_images = []
-        failed_blocks = []
+        total = len(self.mermaid_blocks)
+        results = [False] * total
 
+        # 相同内容的图表只渲染一次：每个图片文件由其第一个块负责渲染，其余块沿用结果
+        owners: Dict[str, int] = {}
         for i, block in enumerate(self.mermaid_blocks):
+            owners.setdefault(block['filename'], i)
+        pending = sorted(owners.values())
+        if len(pending) < total:
+            MERMAID_DIAGRAMS.inc(total - len(pending), result="deduplicated")
+            logger.info("%s Mermaid blocks share %s distinct diagrams", total, len(pending))
+        pending = [i for i in pending if self._precheck(self.mermaid_blocks[i])]
+
+        # 批量模式：先取缓存，再把其余图表交给一次mmdc调用；
+        # 批量调用未能生成的图表再逐个渲染，以便准确定位失败的块
+        if self.batch and self.renderer == 'cli' and self.render_memo is None and len(pending) > 1:
+            unique = pending
+            pending = []
+            for i in unique:
+                block = self.mermaid_blocks[i]
+                cache_key = self._cache_key(block['code'])
+                output_path = os.path.join(images_dir, block['filename'])
+                if cache_key is not None and self.render_cache.fetch(cache_key, output_path):
+                    MERMAID_DIAGRAMS.inc(result="cached")
+                    results[i] = True
+                else:
+                    pending.append(i)
+
+            if len(pending) > 1:
+                started = time.perf_counter()
+                rendered = self._run_mermaid_cli_batch(
+                    [self.mermaid_blocks[i] for i in pending], images_dir
+                )
+                MERMAID_RENDER_SECONDS.observe(time.perf_counter() - started, renderer="batch")
+                if rendered:
+                    MERMAID_DIAGRAMS.inc(len(rendered), result="rendered")
+                rendered_ids = {block['id'] for block in rendered}
+                for block in rendered:
+                    self._optimize_image(os.path.join(images_dir, block['filename']))
+                    cache_key = self._cache_key(block['code'])
+                    if cache_key is not None:
+                        self.render_cache.store(cache_key, os.path.join(images_dir, block['filename']))
+                for i in pending:
+                    if self.mermaid_blocks[i]['id'] in rendered_ids:
+                        results[i] = True
+                pending = [i for i in pending if not results[i]]
+                logger.info("Batch rendered %s diagrams, %s left for individual rendering", len(rendered), len(pending))
+
+        workers = min(self.max_workers, len(pending))
+
+        def render_block(position: int) -> bool:
+            block = self.mermaid_blocks[position]
             output_path = os.path.join(images_dir, block['filename'])
+            logger.debug("Processing Mermaid block %s/%s: %s", position + 1, total, block['id'])
+            return self.convert_mermaid_to_image(block['code'], output_path)
+
+        # 并发渲染；结果按块顺序收集，保证失败索引与块顺序一致
+        if workers > 1:
+            logger.info("Rendering %s Mermaid blocks with %s workers", len(pending), workers)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mermaid-render") as executor:
+                # 在各渲染线程中沿用当前上下文（日志关联ID）
+                futures = {i: executor.submit(contextvars.copy_context().run, render_block, i) for i in pending}
+                for i, future in futures.items():
+                    results[i] = future.result()
+        else:
+            for i in pending:
+                results[i] = render_block(i)
 
-            logger.info(f"Processing Mermaid block {i + 1}/{len(self.mermaid_blocks)}: {block['id']}")
+        for i, block in enumerate(self.mermaid_blocks):
+            results[i] = results[owners[block['filename']]]
 
-            # 转换Mermaid代码为图片
-            if self.convert_mermaid_to_image(block['code'], output_path):
-                successful_images.append(output_path)
-                logger.info(f"✓ Successfully converted {block['id']}")
+        successful_images = []
+        failed_blocks = []
+
+        for block, success in zip(self.mermaid_blocks, results):
+            if success:
+                successful_images.append(os.path.join(images_dir, block['filename']))
+                logger.debug("✓ Successfully converted %s", block['id'])
             else:
                 failed_blocks.append(block['index'])
-                logger.error(f"✗ Failed to convert {block['id']}")
+                logger.error("✗ Failed to convert %s", block['id'])
 
-        logger.info(f"Mermaid processing completed: {len(successful_images)} successful, {len(failed_blocks)} failed")
+        logger.info("Mermaid processing completed: %s successful, %s failed", len(successful_images), len(failed_blocks))
         return successful_images, failed_blocks
 
     def restore_failed_blocks(self, content: str, failed_indices: List[int]) -> str:
         """
         恢复转换失败的Mermaid代码块
 
+        按提取时记录的位置把图片引用替换回原始代码块；
+        若内容在提取后被修改、位置不再对应，则退回按文本查找替换。
+
         Args:
-            content: 已处理的内容
+            content: extract_mermaid_blocks 返回的处理后内容
             failed_indices: 失败的块索引列表
 
         Returns:
             恢复后的内容
         """
-        restored_content = content
-
-        for index in sorted(failed_indices, reverse=True):
-            # 从末尾开始恢复，避免位置偏移
-            if index < len(self.mermaid_blocks):
-                block = self.mermaid_blocks[index]
-                restored_content = restored_content.replace(
-                    block['image_reference'],
-                    block['original_block'],
-                    1
-                )
-                logger.info(f"Restored original Mermaid block: {block['id']}")
+        failed = [
+            self.mermaid_blocks[index]
+            for index in sorted(set(failed_indices))
+            if 0 <= index < len(self.mermaid_blocks)
+        ]
+        if not failed:
+            return content
 
-        return restored_content
+        spans_match = all(
+            content[block['output_span'][0]:block['output_span'][1]] == block['image_reference']
+            for block in failed
+        )
+        if not spans_match:
+            logger.warning("Content changed after extraction, restoring failed blocks by text search")
+            for block in failed:
+                content = content.replace(block['image_reference'], block['original_block'], 1)
+            return content
+
+        pieces = []
+        last_end = 0
+        for block in failed:
+            start, end = block['output_span']
+            pieces.append(content[last_end:start])
+            pieces.append(block['original_block'])
+            last_end = end
+            logger.debug("Restored original Mermaid block: %s", block['id'])
+        pieces.append(content[last_end:])
+        return ''.join(pieces)
 
     def cleanup(self):
         """清理临时文件"""
-        # 由于我们现在使用项目目录而不是临时目录，不需要清理图片文件
-        # 只清理测试模式下可能创建的临时目录
+        # 图片位于请求工作目录中，由调用方随工作目录一起清理
+        # 这里只清理测试模式下可能创建的临时目录
         if self.temp_dir and os.path.exists(self.temp_dir):
             if self.test_mode:
-                logger.info(f"Test mode: temporary directory preserved at {self.temp_dir}")
+                logger.info("Test mode: temporary directory preserved at %s", self.temp_dir)
             else:
                 try:
                     shutil.rmtree(self.temp_dir, ignore_errors=True)
-                    logger.info(f"Cleaned up temporary directory: {self.temp_dir}")
+                    logger.info("Cleaned up temporary directory: %s", self.temp_dir)
                 except Exception as e:
-                    logger.warning(f"Failed to cleanup temporary directory: {e}")
-
-        # 不再清理项目images目录中的图片文件，因为它们需要被保留用于文档中
+                    logger.warning("Failed to cleanup temporary directory: %s", e)
 
     def __enter__(self):
         return self
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Mermaid代码预检查
+在启动任何渲染进程之前，用轻量的本地规则拒绝明显无效的图表（未闭合的块、括号或引号，
+无效的方向、饼图或甘特图条目等）；同时记录渲染失败过的图表，重复上传时直接判定失败，
+不再等待渲染器报错或超时。
+
+检查只覆盖确定会导致渲染失败的错误，不能识别的写法一律放行，交给渲染器处理。
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+_failure_cache: Optional["FailureCache"] = None
+_failure_cache_lock = threading.Lock()
+
+FLOWCHART_DIRECTIONS = {'TB', 'TD', 'BT', 'RL', 'LR', '<', '>', '^', 'V'}
+
+# 时序图中需要以 end 结束的块
+SEQUENCE_BLOCKS = {'loop', 'alt', 'opt', 'par', 'critical', 'break', 'rect', 'box'}
+# 只能出现在上述块内部的分支关键字
+SEQUENCE_BRANCHES = {'else', 'and', 'option'}
+
+# 可出现在任意图表中的无障碍说明
+ACCESSIBILITY_KEYWORDS = ('acctitle', 'accdescr')
+
+# 状态图的多行注释块：note left of X ... end note
+NOTE_BLOCK = re.compile(r'^note\s+(left|right)\s+of\s+[^:]+$', re.IGNORECASE)
+
+PIE_KEYWORDS = ('title', 'showdata')
+PIE_SLICE = re.compile(r'^"[^"]*"\s*:\s*[0-9]+(\.[0-9]+)?$')
+
+GANTT_KEYWORDS = (
+    'title', 'dateformat', 'axisformat', 'tickinterval', 'excludes', 'includes', 'todaymarker',
+    'section', 'weekday', 'weekend', 'inclusiveenddates', 'topaxis', 'displaymode', 'click'
+)
+
+
+def _strip_quoted(line: str) -> str:
+    """去掉双引号中的文字（标签内容不参与括号检查）"""
+    return re.sub(r'"[^"]*"', '""', line)
+
+
+def _strip_line(line: str, in_string: bool, quoted: bool) -> Tuple[str, bool]:
+    """
+    去掉一行中 %% 之后的注释；quoted 为真时双引号是字符串界定符（可跨行），
+    字符串内容替换为空，其中的 %% 不视为注释
+
+    Returns:
+        (处理后的行, 行尾是否仍在字符串中)
+    """
+    out = []
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if in_string:
+            if char == '"':
+                in_string = False
+                out.append(char)
+        elif quoted and char == '"':
+            in_string = True
+            out.append(char)
+        elif line.startswith('%%', i):
+            break
+        else:
+            out.append(char)
+        i += 1
+    return ''.join(out), in_string
+
+
+def _statement_lines(code: str, quoted: bool = False) -> Tuple[List[str], bool]:
+    """
+    去掉注释、指令、空行和多行无障碍说明后的语句行（不含首行图表类型）
+
+    Args:
+        code: Mermaid代码
+        quoted: 双引号是否为可跨行的字符串
+
+    Returns:
+        (语句行, 代码结束时字符串是否未闭合)
+    """
+    lines = []
+    in_description = False
+    in_string = False
+    for raw in code.splitlines()[1:]:
+        if in_description:
+            if raw.strip().endswith('}'):
+                in_description = False
+            continue
+        line, in_string = _strip_line(raw, in_string, quoted)
+        line = line.strip()
+        if not line:
+            continue
+        if line.lower().startswith('accdescr') and line.endswith('{') and not in_string:
+            in_description = True
+            continue
+        lines.append(line)
+    return lines, in_string
+
+
+def _check_braces(lines: List[str], skip_relationships: bool = False) -> Optional[str]:
+    depth = 0
+    in_note = False
+    for line in lines:
+        # 注释文字不参与括号检查：单行 note 整行跳过，多行 note 跳过到 end note
+        lowered = line.lower()
+        if in_note:
+            if lowered.split() == ['end', 'note']:
+                in_note = False
+            continue
+        if lowered.split(None, 1)[0] == 'note':
+            in_note = NOTE_BLOCK.match(line) is not None
+            continue
+        # ER图关系中的基数标记（如 ||--o{）包含花括号，不计入块
+        if skip_relationships and ('--' in line or '..' in line):
+            continue
+        stripped = _strip_quoted(line)
+        depth += stripped.count('{') - stripped.count('}')
+        if depth < 0:
+            return f"unexpected '}}' near: {line[:60]}"
+    if depth > 0:
+        return "unclosed '{' block"
+    return None
+
+
+def _check_flowchart(header: str, lines: List[str], unterminated: bool) -> Optional[str]:
+    # 首行可带方向、注释和以分号分隔的语句，例如 "graph TD;A-->B"
+    declaration = header.split(';', 1)[0].split('%%', 1)[0].split()
+    if len(declaration) > 2:
+        return f"unexpected text after diagram type: {header[:60]}"
+    if len(declaration) == 2 and declaration[1].upper() not in FLOWCHART_DIRECTIONS:
+        return f"invalid flowchart direction: {declaration[1]}"
+
+    # 带引号的标签可以跨行，只检查整张图的引号是否闭合
+    if unterminated:
+        return "unterminated string"
+
+    depth = 0
+    for line in lines:
+        # 流程图关键字区分大小写：End、END 是普通节点
+        keyword = line.split(None, 1)[0].rstrip(';')
+        if keyword == 'subgraph':
+            depth += 1
+        elif keyword == 'end' and line.rstrip(';').strip() == 'end':
+            depth -= 1
+            if depth < 0:
+                return "'end' without matching 'subgraph'"
+    if depth > 0:
+        return "unclosed 'subgraph' block"
+    return None
+
+
+def _check_sequence(lines: List[str]) -> Optional[str]:
+    depth = 0
+    for line in lines:
+        keyword = line.split(None, 1)[0].lower()
+        if keyword in SEQUENCE_BLOCKS:
+            depth += 1
+        elif keyword in SEQUENCE_BRANCHES and depth == 0:
+            return f"'{keyword}' outside of a block"
+        elif keyword == 'end':
+            depth -= 1
+            if depth < 0:
+                return "'end' without matching block"
+    if depth > 0:
+        return "unclosed block (missing 'end')"
+    return None
+
+
+def _check_pie(lines: List[str]) -> Optional[str]:
+    for line in lines:
+        lowered = line.lower()
+        if lowered.startswith(PIE_KEYWORDS + ACCESSIBILITY_KEYWORDS):
+            continue
+        if not PIE_SLICE.match(line):
+            return f'invalid pie slice (expected "label" : value): {line[:60]}'
+    return None
+
+
+def _check_gantt(lines: List[str]) -> Optional[str]:
+    for line in lines:
+        if line.lower().startswith(GANTT_KEYWORDS + ACCESSIBILITY_KEYWORDS):
+            continue
+        if ':' not in line:
+            return f"invalid gantt task (expected 'name : metadata'): {line[:60]}"
+    return None
+
+
+def validate_mermaid(code: str) -> Optional[str]:
+    """
+    检查Mermaid代码中确定会导致渲染失败的错误
+
+    Args:
+        code: Mermaid代码（首行为图表类型）
+
+    Returns:
+        错误说明；未发现问题时返回None
+    """
+    code = code.strip()
+    if not code:
+        return "empty diagram"
+
+    header = code.splitlines()[0].strip()
+    diagram_type = re.split(r'[\s;]', header, 1)[0].lower()
+    # 时序图的消息文字中双引号只是普通字符，其余图表中为字符串界定符
+    lines, unterminated = _statement_lines(code, quoted=diagram_type != 'sequencediagram')
+    if diagram_type in ('graph', 'flowchart'):
+        return _check_flowchart(header, lines, unterminated)
+    if unterminated:
+        # 引号未闭合时无法可靠地判断块结构，交给渲染器
+        return None
+    if diagram_type == 'sequencediagram':
+        return _check_sequence(lines)
+    if diagram_type in ('classdiagram', 'classdiagram-v2', 'statediagram', 'statediagram-v2'):
+        return _check_braces(lines)
+    if diagram_type == 'erdiagram':
+        return _check_braces(lines, skip_relationships=True)
+    if diagram_type == 'pie':
+        return _check_pie(lines)
+    if diagram_type == 'gantt':
+        return _check_gantt(lines)
+    return None
+
+
+class FailureCache:
+    """
+    渲染失败过的图表（按渲染缓存键记录）
+
+    只保存在进程内存中，按容量淘汰最久未使用的条目，并在 ttl 秒后过期，
+    以免渲染器的临时故障被长期记住。
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stores = 0
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            failed_at = self._entries.get(key)
+            if failed_at is None:
+                return False
+            if time.time() - failed_at > self.ttl:
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def add(self, key: str):
+        with self._lock:
+            self._entries[key] = time.time()
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": True,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "stores": self.stores,
+            }
+
+
+def get_failure_cache() -> Optional[FailureCache]:
+    """
+    获取进程共享的渲染失败记录
+
+    通过环境变量配置：
+        MERMAID_FAILURE_CACHE_ENABLED: 是否启用（默认 true）
+        MERMAID_FAILURE_CACHE_SIZE: 最多记录的图表数（默认 4096）
+        MERMAID_FAILURE_CACHE_TTL: 记录保留秒数（默认 600）
+
+    Returns:
+        失败记录实例，禁用时返回None
+    """
+    global _failure_cache
+    if os.environ.get("MERMAID_FAILURE_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    with _failure_cache_lock:
+        if _failure_cache is None:
+            _failure_cache = FailureCache(
+                max_entries=int(os.environ.get("MERMAID_FAILURE_CACHE_SIZE", "4096")),
+                ttl=float(os.environ.get("MERMAID_FAILURE_CACHE_TTL", "600")),
+            )
+        return _failure_cache
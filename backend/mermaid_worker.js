@@ -0,0 +1,144 @@
+#!/usr/bin/env node
+/**
+ * Mermaid常驻渲染进程
+ * 启动时打开一个浏览器页面并加载mermaid，之后通过stdin/stdout逐行收发JSON请求，
+ * 避免每个图表都重新启动Chromium。
+ *
+ * 请求: {"id": 1, "code": "...", "output": "/path/x.png", "theme": "neutral",
+ *        "background": "white", "width": 800, "height": 600, "scale": 1}
+ * 输出路径以 .svg 结尾时直接写出SVG（纯文本标签），否则截图为PNG。
+ * 响应: {"id": 1, "ok": true} 或 {"id": 1, "ok": false, "kind": "parse" | "render", "error": "..."}
+ * kind 为 parse 表示 Mermaid 无法解析或渲染该图表；render 表示浏览器或页面出错，
+ * 调用方应回收本进程。浏览器断开时进程直接退出。
+ *
+ * 依赖 puppeteer 与 mermaid（@mermaid-js/mermaid-cli 安装时已包含），
+ * 可通过 NODE_PATH 指向其 node_modules 目录。
+ */
+
+const fs = require("fs");
+const readline = require("readline");
+const puppeteer = require("puppeteer");
+
+const mermaidPath = require.resolve("mermaid/dist/mermaid.min.js");
+
+function send(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+// Mermaid 报告的图表错误（语法或布局），与浏览器、页面故障区分
+class DiagramError extends Error {}
+
+function loadLaunchOptions() {
+  // 可选参数：puppeteer配置文件路径（与 mmdc -p 的格式相同）
+  const configPath = process.argv[2];
+  const options = { headless: true };
+  if (configPath) {
+    Object.assign(options, JSON.parse(fs.readFileSync(configPath, "utf-8")));
+  }
+  return options;
+}
+
+async function render(page, request) {
+  await page.setViewport({
+    width: request.width,
+    height: request.height,
+    deviceScaleFactor: request.scale || 1,
+  });
+  const vector = request.output.endsWith(".svg");
+
+  const result = await page.evaluate(
+    async ({ id, code, theme, background, vector }) => {
+      const container = document.getElementById("container");
+      container.innerHTML = "";
+      document.body.style.background = background;
+      // 矢量输出不使用 foreignObject 中的HTML标签，Word等查看器无法显示
+      const htmlLabels = !vector;
+      window.mermaid.initialize({ startOnLoad: false, theme, htmlLabels, flowchart: { htmlLabels } });
+      try {
+        const { svg } = await window.mermaid.render(`diagram-${id}`, code);
+        container.innerHTML = svg;
+        return { svg };
+      } catch (err) {
+        return { diagramError: String((err && err.message) || err) };
+      }
+    },
+    { ...request, vector }
+  );
+  if (result.diagramError !== undefined) {
+    throw new DiagramError(result.diagramError);
+  }
+  const svg = result.svg;
+
+  if (vector) {
+    fs.writeFileSync(request.output, svg);
+    return;
+  }
+
+  const element = await page.$("#container svg");
+  if (!element) {
+    throw new Error("Mermaid produced no SVG output");
+  }
+  await element.screenshot({
+    path: request.output,
+    omitBackground: request.background === "transparent",
+  });
+}
+
+async function main() {
+  const browser = await puppeteer.launch(loadLaunchOptions());
+  // Chromium 崩溃或断开后本进程无法再渲染，退出以便调用方重新启动
+  browser.on("disconnected", () => {
+    process.stderr.write("Mermaid worker browser disconnected\n");
+    process.exit(1);
+  });
+  const page = await browser.newPage();
+  page.on("error", (err) => {
+    process.stderr.write(`Mermaid worker page crashed: ${err}\n`);
+    process.exit(1);
+  });
+  await page.setContent(
+    '<!DOCTYPE html><html><body style="margin:0"><div id="container"></div></body></html>'
+  );
+  await page.addScriptTag({ path: mermaidPath });
+
+  send({ ready: true });
+
+  // 请求按顺序处理，同一页面不并发渲染
+  let chain = Promise.resolve();
+  const input = readline.createInterface({ input: process.stdin });
+
+  input.on("line", (line) => {
+    chain = chain.then(async () => {
+      let request;
+      try {
+        request = JSON.parse(line);
+      } catch (err) {
+        send({ ok: false, error: "Invalid request" });
+        return;
+      }
+      try {
+        await render(page, request);
+        send({ id: request.id, ok: true });
+      } catch (err) {
+        send({
+          id: request.id,
+          ok: false,
+          kind: err instanceof DiagramError ? "parse" : "render",
+          error: String((err && err.message) || err),
+        });
+      }
+    });
+  });
+
+  input.on("close", async () => {
+    await chain;
+    browser.removeAllListeners("disconnected");
+    await browser.close();
+    process.exit(0);
+  });
+}
+
+main().catch((err) => {
+  process.stderr.write(`Mermaid worker failed to start: ${err && err.stack ? err.stack : err}\n`);
+  process.exit(1);
+});
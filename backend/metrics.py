@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+转换流程指标
+进程内的计数器和直方图，以Prometheus文本格式导出；
+各阶段耗时同时记录到请求级的 StageTimings 中，可通过 Server-Timing 响应头返回给客户端。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 默认直方图分桶（秒），覆盖从毫秒级缓存命中到数十秒的大文档转换
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in labels]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self.header()
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # 标签值 -> [各分桶计数, 总和, 总数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels + [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+def format_metric(name: str, metric_type: str, documentation: str,
+                  samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    """
+    格式化采集时才读取的指标（例如缓存、任务队列的现有统计）
+
+    Args:
+        name: 指标名
+        metric_type: counter 或 gauge
+        documentation: 说明
+        samples: (标签, 数值) 列表
+
+    Returns:
+        Prometheus文本行
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+    return lines
+
+
+def render_metrics(extra: Optional[List[str]] = None) -> str:
+    """以Prometheus文本格式导出全部已注册指标"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    if extra:
+        lines.extend(extra)
+    return '\n'.join(lines) + '\n'
+
+
+CONVERSIONS = Counter(
+    "docgen_conversions_total", "Conversions by entry point and outcome", ("mode", "result")
+)
+CONVERSION_SECONDS = Histogram(
+    "docgen_conversion_duration_seconds", "End-to-end conversion time", ("mode",)
+)
+STAGE_SECONDS = Histogram(
+    "docgen_stage_duration_seconds", "Time spent in each pipeline stage", ("stage",)
+)
+STAGE_FAILURES = Counter(
+    "docgen_stage_failures_total", "Pipeline failures by stage", ("stage",)
+)
+MERMAID_DIAGRAMS = Counter(
+    "docgen_mermaid_diagrams_total", "Mermaid diagrams processed by outcome", ("result",)
+)
+MERMAID_RENDER_SECONDS = Histogram(
+    "docgen_mermaid_render_duration_seconds", "Time to render one Mermaid diagram or batch", ("renderer",)
+)
+MERMAID_IMAGE_BYTES = Counter(
+    "docgen_mermaid_image_bytes_total", "Rendered PNG bytes before and after optimization", ("stage",)
+)
+
+
+class StageTimings:
+    """单个请求各阶段的累计耗时"""
+
+    def __init__(self):
+        self._durations: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self._durations[stage] = self._durations.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(seconds * 1000, 1) for stage, seconds in self._durations.items()}
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头的值（毫秒）"""
+        return ', '.join(f"{stage};dur={ms}" for stage, ms in self.as_dict().items())
+
+
+@contextmanager
+def stage_timer(stage: str, timings: Optional[StageTimings] = None):
+    """
+    记录一个阶段的耗时；阶段内抛出异常时计入该阶段的失败次数
+
+    Args:
+        stage: 阶段名称
+        timings: 可选，请求级耗时记录
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings.add(stage, elapsed)
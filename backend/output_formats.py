@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+多格式输出
+Markdown 只解析一次得到 pandoc JSON AST，再由多个 pandoc writer 并行生成各目标格式，
+Mermaid 图片同样只生成一次，供所有格式共用。
+"""
+
+import contextvars
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 格式名称 -> writer 参数、文件扩展名和响应类型
+OUTPUT_FORMATS: Dict[str, Dict] = {
+    "docx": {
+        "args": ["-t", "docx"],
+        "extension": "docx",
+        "mimetype": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "reference_doc": True,
+    },
+    "odt": {
+        "args": ["-t", "odt"],
+        "extension": "odt",
+        "mimetype": "application/vnd.oasis.opendocument.text",
+        "reference_doc": False,
+    },
+    "html": {
+        # 图片内嵌为data URI，单个文件即可查看（需要 pandoc 2.19+）
+        "args": ["-t", "html5", "--standalone", "--embed-resources"],
+        "extension": "html",
+        "mimetype": "text/html",
+        "reference_doc": False,
+    },
+    "pdf": {
+        # pandoc 根据 .pdf 扩展名调用PDF引擎生成，引擎可通过 PANDOC_PDF_ENGINE 指定
+        "args": [],
+        "extension": "pdf",
+        "mimetype": "application/pdf",
+        "reference_doc": False,
+    },
+}
+
+DEFAULT_FORMAT = "docx"
+
+
+class OutputFormatError(Exception):
+    """pandoc 解析或生成某个格式失败"""
+
+    def __init__(self, message: str, details: Optional[str] = None, timeout: bool = False):
+        super().__init__(message)
+        self.details = details
+        self.timeout = timeout
+
+
+def parse_formats(value: Optional[str]) -> List[str]:
+    """
+    解析请求中的 formats 字段（逗号分隔，如 "docx,pdf,html"）
+
+    Args:
+        value: 表单字段值，为空时只输出DOCX
+
+    Returns:
+        去重后的格式列表，保持请求中的顺序
+
+    Raises:
+        ValueError: 包含不支持的格式
+    """
+    formats = []
+    for name in (value or DEFAULT_FORMAT).split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {name}")
+        if name not in formats:
+            formats.append(name)
+    return formats or [DEFAULT_FORMAT]
+
+
+def _run_pandoc(cmd: List[str], workdir: Path, input_text: Optional[str] = None,
+                timeout: float = 60) -> subprocess.CompletedProcess:
+    try:
+        return subprocess.run(
+            cmd,
+            input=input_text,
+            encoding="utf-8",
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+            cwd=workdir
+        )
+    except subprocess.TimeoutExpired:
+        raise OutputFormatError("Conversion timeout - file may be too large or complex", timeout=True)
+    except FileNotFoundError:
+        raise OutputFormatError("Pandoc not found. Please install pandoc and ensure it is in PATH.")
+    except subprocess.CalledProcessError as exc:
+        raise OutputFormatError("Pandoc conversion failed", details=exc.stderr)
+
+
+def markdown_to_ast(markdown_text: str, workdir: Path) -> Path:
+    """
+    把Markdown解析为 pandoc JSON AST 并写入工作目录
+
+    Args:
+        markdown_text: Markdown内容（Mermaid代码块已替换为图片引用）
+        workdir: 请求工作目录
+
+    Returns:
+        AST文件路径
+
+    Raises:
+        OutputFormatError: 解析失败
+    """
+    ast_path = workdir / "document.json"
+    _run_pandoc(["pandoc", "-f", "markdown", "-t", "json", "-o", str(ast_path)], workdir, markdown_text)
+    return ast_path
+
+
+def write_format(ast_path: Path, output_format: str, workdir: Path,
+                 template_path: Optional[Path] = None, pdf_engine: Optional[str] = None) -> Path:
+    """
+    从JSON AST生成一种输出格式
+
+    Args:
+        ast_path: markdown_to_ast 生成的AST文件
+        output_format: OUTPUT_FORMATS 中的格式名称
+        workdir: 请求工作目录（相对图片路径在此解析）
+        template_path: 参考模板，仅DOCX使用
+        pdf_engine: 可选的PDF引擎
+
+    Returns:
+        输出文件路径
+
+    Raises:
+        OutputFormatError: 生成失败
+    """
+    spec = OUTPUT_FORMATS[output_format]
+    output_path = workdir / f"output.{spec['extension']}"
+    cmd = ["pandoc", "-f", "json", str(ast_path), *spec["args"], "-o", str(output_path),
+           f"--resource-path={workdir}"]
+    if template_path is not None and spec["reference_doc"]:
+        cmd.extend(["--reference-doc", str(template_path)])
+    if output_format == "pdf" and pdf_engine:
+        cmd.append(f"--pdf-engine={pdf_engine}")
+
+    _run_pandoc(cmd, workdir)
+    if not output_path.exists():
+        raise OutputFormatError("Output file was not created")
+    return output_path
+
+
+def write_formats(ast_path: Path, formats: List[str], workdir: Path,
+                  template_path: Optional[Path] = None, pdf_engine: Optional[str] = None) -> Dict[str, Path]:
+    """
+    并行生成多种输出格式
+
+    Returns:
+        格式名称 -> 输出文件路径
+
+    Raises:
+        OutputFormatError: 任一格式生成失败（错误信息中注明格式）
+    """
+    if len(formats) == 1:
+        return {formats[0]: write_format(ast_path, formats[0], workdir, template_path, pdf_engine)}
+
+    outputs = {}
+    with ThreadPoolExecutor(max_workers=len(formats), thread_name_prefix="pandoc-writer") as executor:
+        futures = {
+            name: executor.submit(
+                contextvars.copy_context().run, write_format, ast_path, name, workdir, template_path, pdf_engine
+            )
+            for name in formats
+        }
+        for name, future in futures.items():
+            try:
+                outputs[name] = future.result()
+            except OutputFormatError as e:
+                raise OutputFormatError(f"{e} ({name})", details=e.details, timeout=e.timeout)
+    return outputs
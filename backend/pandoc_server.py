@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+常驻Pandoc服务进程池
+维护若干个 pandoc-server 进程，通过本地HTTP接口提交转换任务，避免每次转换都启动新的pandoc进程。
+pandoc-server 不直接访问文件系统，图片和参考模板通过请求中的 files 字段以base64传入。
+"""
+
+import atexit
+import base64
+import json
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+_server_pool: Optional["PandocServerPool"] = None
+_server_pool_lock = threading.Lock()
+
+
+class PandocServerUnavailable(Exception):
+    """服务进程不可用（启动失败、崩溃或超时），调用方应回退到子进程方式"""
+
+
+class PandocServerConversionError(Exception):
+    """pandoc-server 返回的转换错误"""
+
+
+def _find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class PandocServer:
+    """单个 pandoc-server 进程"""
+
+    def __init__(self, server_id: int, timeout: float):
+        self.server_id = server_id
+        self.timeout = timeout
+        self.port: Optional[int] = None
+        self.process: Optional[subprocess.Popen] = None
+        self.started = False
+        self.last_ok = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, startup_timeout: float = 10):
+        """启动服务进程并等待其可以响应请求"""
+        self.port = _find_free_port()
+        cmd = os.environ.get("PANDOC_SERVER_CMD", "pandoc-server").split() + [
+            "--port", str(self.port),
+            # pandoc-server 自身的超时（默认仅2秒），与任务超时保持一致
+            "--timeout", str(int(self.timeout)),
+        ]
+        try:
+            self.process = subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except OSError as e:
+            raise PandocServerUnavailable(f"Failed to start pandoc-server: {e}")
+        self.started = True
+
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if not self.alive:
+                raise PandocServerUnavailable(f"pandoc-server {self.server_id} exited during startup")
+            if self.health_check():
+                logger.info("pandoc-server %s started on port %s (pid %s)", self.server_id, self.port, self.process.pid)
+                return
+            time.sleep(0.1)
+
+        self.stop()
+        raise PandocServerUnavailable(f"pandoc-server {self.server_id} did not become ready")
+
+    def health_check(self) -> bool:
+        """请求 /version 检查服务是否可用"""
+        try:
+            with urllib.request.urlopen(f"{self.url}/version", timeout=2) as response:
+                ok = response.status == 200
+        except (OSError, urllib.error.URLError):
+            return False
+        if ok:
+            self.last_ok = time.monotonic()
+        return ok
+
+    def convert(self, params: Dict) -> Dict:
+        """
+        提交一次转换请求
+
+        Args:
+            params: pandoc-server 请求参数
+
+        Returns:
+            JSON响应（output / base64 / messages）
+        """
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(params).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            # 服务正常但转换失败
+            self.last_ok = time.monotonic()
+            raise PandocServerConversionError(e.read().decode("utf-8", errors="replace"))
+        except (OSError, urllib.error.URLError, ValueError) as e:
+            self.stop()
+            raise PandocServerUnavailable(f"pandoc-server {self.server_id} request failed: {e}")
+
+        self.last_ok = time.monotonic()
+        if body.get("error"):
+            raise PandocServerConversionError(body["error"])
+        return body
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        logger.info("pandoc-server %s stopped", self.server_id)
+        self.process = None
+
+
+class PandocServerPool:
+    """pandoc-server 进程池"""
+
+    def __init__(self, size: int, timeout: float, health_interval: float):
+        """
+        Args:
+            size: 服务进程数量
+            timeout: 单次转换超时时间（秒）
+            health_interval: 空闲超过该时间的服务在使用前先做健康检查（秒）
+        """
+        self.size = size
+        self.timeout = timeout
+        self.health_interval = health_interval
+
+        self._idle: "queue.Queue[PandocServer]" = queue.Queue()
+        for server_id in range(size):
+            self._idle.put(PandocServer(server_id, timeout))
+
+        self.retry_interval = 60
+        self._unavailable_until = 0.0
+
+        self._stats_lock = threading.Lock()
+        self.conversions = 0
+        self.failures = 0
+        self.restarts = 0
+
+    def _ensure_ready(self, server: PandocServer):
+        """确保服务进程在运行且健康，必要时重启"""
+        if server.alive and time.monotonic() - server.last_ok > self.health_interval:
+            if not server.health_check():
+                logger.warning("pandoc-server %s failed health check, restarting", server.server_id)
+                server.stop()
+
+        if not server.alive:
+            if server.started:
+                with self._stats_lock:
+                    self.restarts += 1
+            try:
+                server.start()
+            except PandocServerUnavailable:
+                # 启动失败时暂停一段时间，避免每个请求都重复尝试启动
+                self._unavailable_until = time.monotonic() + self.retry_interval
+                raise
+
+    def convert(self, markdown_text: str, output_path: Path, resource_dir: Path,
+                template_path: Optional[Path] = None):
+        """
+        将Markdown转换为DOCX
+
+        Args:
+            markdown_text: Markdown内容
+            output_path: 输出DOCX路径
+            resource_dir: 资源目录，其中 images/ 下的图片会随请求一起发送
+            template_path: 参考模板路径
+
+        Raises:
+            PandocServerUnavailable: 服务不可用
+            PandocServerConversionError: 转换失败
+        """
+        if time.monotonic() < self._unavailable_until:
+            raise PandocServerUnavailable("pandoc-server is temporarily disabled after a startup failure")
+
+        files = {}
+        images_dir = resource_dir / "images"
+        if images_dir.is_dir():
+            for image in images_dir.iterdir():
+                if image.is_file():
+                    files[f"images/{image.name}"] = base64.b64encode(image.read_bytes()).decode("ascii")
+
+        params = {
+            "text": markdown_text,
+            "from": "markdown",
+            "to": "docx",
+            "files": files,
+        }
+        if template_path is not None and template_path.is_file():
+            files["reference.docx"] = base64.b64encode(template_path.read_bytes()).decode("ascii")
+            params["reference-doc"] = "reference.docx"
+
+        server = self._idle.get()
+        try:
+            self._ensure_ready(server)
+            result = server.convert(params)
+        except (PandocServerUnavailable, PandocServerConversionError):
+            with self._stats_lock:
+                self.failures += 1
+            raise
+        finally:
+            self._idle.put(server)
+
+        output = result.get("output", "")
+        data = base64.b64decode(output) if result.get("base64") else output.encode("utf-8")
+        output_path.write_bytes(data)
+
+        with self._stats_lock:
+            self.conversions += 1
+
+        for message in result.get("messages", []):
+            logger.info("pandoc-server: %s", message)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "servers": self.size,
+                "conversions": self.conversions,
+                "failures": self.failures,
+                "restarts": self.restarts,
+            }
+
+    def shutdown(self):
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            server.stop()
+
+
+def get_pandoc_server_pool() -> PandocServerPool:
+    """
+    获取进程共享的 pandoc-server 进程池
+
+    通过环境变量配置：
+        PANDOC_SERVER_CMD: 启动命令（默认 pandoc-server，也可设为 "pandoc server"）
+        PANDOC_SERVER_WORKERS: 服务进程数量（默认2）
+        PANDOC_SERVER_TIMEOUT: 单次转换超时秒数（默认60）
+        PANDOC_SERVER_HEALTH_INTERVAL: 健康检查间隔秒数（默认30）
+    """
+    global _server_pool
+    with _server_pool_lock:
+        if _server_pool is None:
+            _server_pool = PandocServerPool(
+                size=int(os.environ.get("PANDOC_SERVER_WORKERS", "2")),
+                timeout=float(os.environ.get("PANDOC_SERVER_TIMEOUT", "60")),
+                health_interval=float(os.environ.get("PANDOC_SERVER_HEALTH_INTERVAL", "30"))
+            )
+            atexit.register(_server_pool.shutdown)
+        return _server_pool
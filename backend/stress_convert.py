@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+并发转换压力测试
+同时发起多个 /api/convert 请求，每个文档包含内容不同的Mermaid图表，检查每个DOCX只嵌入了自己的图表
+（工作目录或相对图片路径在请求之间串用时，文档会嵌入其他请求的图片或缺少图片）。
+图表以SVG渲染，按其中的节点文字识别属于哪个请求。需要本机可用的 mmdc 和 pandoc；缓存在测试中禁用。
+用法: python stress_convert.py [请求数量] [并发数]
+"""
+
+import io
+import logging
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# 每个请求都真实渲染和转换，避免缓存掩盖并发问题
+os.environ["MERMAID_CACHE_ENABLED"] = "false"
+os.environ["MERMAID_FAILURE_CACHE_ENABLED"] = "false"
+os.environ["CONVERSION_CACHE_ENABLED"] = "false"
+
+from app import create_app  # noqa: E402
+
+TOKEN = re.compile(r'stress(\d{3})x')
+
+
+def build_document(index: int) -> str:
+    """生成带有本请求专属节点文字的文档"""
+    token = f"stress{index:03d}x"
+    return (
+        f"# 文档 {index}\n\n说明文字。\n\n"
+        f"```mermaid\ngraph TD\n    A[{token}] --> B[{token}]\n```\n"
+    )
+
+
+def embedded_tokens(docx: bytes) -> set:
+    """DOCX媒体中出现的请求编号"""
+    found = set()
+    with zipfile.ZipFile(io.BytesIO(docx)) as archive:
+        for name in archive.namelist():
+            if name.startswith('word/media/'):
+                found.update(int(n) for n in TOKEN.findall(archive.read(name).decode('utf-8', 'replace')))
+    return found
+
+
+def convert(app, index: int):
+    """发起一次转换，返回错误说明；结果正确时返回None"""
+    client = app.test_client()
+    response = client.post(
+        '/api/convert',
+        data={
+            'file': (io.BytesIO(build_document(index).encode('utf-8')), f'stress-{index}.md'),
+            'diagram_format': 'svg',
+        },
+        content_type='multipart/form-data',
+    )
+    try:
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}"
+        tokens = embedded_tokens(response.get_data())
+    finally:
+        response.close()
+    if tokens != {index}:
+        return f"expected diagram {index}, embedded {sorted(tokens) or 'none'}"
+    return None
+
+
+def main():
+    logging.disable(logging.WARNING)
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else requests
+
+    app = create_app()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        errors = list(executor.map(lambda i: convert(app, i), range(requests)))
+    elapsed = time.perf_counter() - started
+
+    failures = [(i, error) for i, error in enumerate(errors) if error is not None]
+    for index, error in failures:
+        print(f"✗ request {index}: {error}")
+    print(f"{requests - len(failures)}/{requests} conversions embedded the right diagram "
+          f"({concurrency} concurrent, {elapsed:.1f}s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
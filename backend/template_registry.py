@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+DOCX模板注册表
+启动时扫描模板目录并在内存中保存每个模板的名称、大小、修改时间和内容哈希，
+后台线程定期轮询目录变化，新增、修改或删除的模板无需重启服务即可生效。
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TemplateRegistry:
+    """模板目录的内存索引"""
+
+    def __init__(self, folder: str, poll_interval: float = 5):
+        """
+        Args:
+            folder: 模板目录
+            poll_interval: 目录轮询间隔（秒），0表示不启动后台轮询
+        """
+        self.folder = Path(folder).resolve()
+        self.poll_interval = poll_interval
+        self._templates: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+        self.refresh()
+
+    def refresh(self):
+        """重新扫描模板目录；大小和修改时间未变化的模板沿用已有哈希"""
+        with self._lock:
+            current = dict(self._templates)
+
+        found: Dict[str, Dict] = {}
+        try:
+            entries = list(os.scandir(self.folder))
+        except OSError as e:
+            logger.warning("Failed to scan template folder %s: %s", self.folder, e)
+            return
+
+        for entry in entries:
+            if not entry.name.endswith('.docx') or entry.name.startswith('.'):
+                continue
+            try:
+                # 解析符号链接后必须仍在模板目录内，不能借链接引用目录外的任意文件
+                path = Path(entry.path).resolve()
+                try:
+                    path.relative_to(self.folder)
+                except ValueError:
+                    logger.debug("Ignoring template outside the template folder: %s -> %s", entry.name, path)
+                    continue
+                if not path.is_file():
+                    continue
+                stat = path.stat()
+                previous = current.get(entry.name)
+                if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+                    found[entry.name] = previous
+                    continue
+                found[entry.name] = {
+                    "name": entry.name,
+                    "path": str(path),
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha256": _sha256(path),
+                }
+            except OSError as e:
+                logger.warning("Failed to index template %s: %s", entry.name, e)
+
+        added = found.keys() - current.keys()
+        removed = current.keys() - found.keys()
+        changed = {name for name in found.keys() & current.keys() if found[name] is not current[name]}
+
+        with self._lock:
+            self._templates = found
+
+        for name in sorted(added):
+            logger.info("Template added: %s", name)
+        for name in sorted(changed):
+            logger.info("Template updated: %s", name)
+        for name in sorted(removed):
+            logger.info("Template removed: %s", name)
+
+    def start(self):
+        """启动后台轮询线程"""
+        if self.poll_interval > 0 and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_loop, name="template-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Template refresh failed: %s", e)
+
+    def get(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            return self._templates.get(name)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return [dict(info) for _, info in sorted(self._templates.items())]
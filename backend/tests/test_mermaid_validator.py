@@ -0,0 +1,57 @@
+"""
+Mermaid预检查的样例：有效图表一律放行，只拒绝确定无法渲染的写法
+"""
+
+import pytest
+
+from mermaid_validator import validate_mermaid
+
+VALID = {
+    "flowchart": "graph TD\n    A[Start] --> B{Check}\n    B -->|yes| C[Done]",
+    "flowchart_inline": "graph LR;A-->B;B-->C",
+    "flowchart_header_comment": "flowchart TD %% main flow\n    A-->B",
+    "flowchart_multiline_label": 'flowchart TD\n    A["first\n    second"] --> B',
+    "flowchart_markdown_string": 'flowchart LR\n    A["`**bold**\n    text`"] --> B',
+    "flowchart_trailing_comment": "graph TD\n    A-->B %% don't \"do this\n    B-->C",
+    "flowchart_percent_in_label": 'graph TD\n    A["50%% done"] --> B',
+    "flowchart_subgraph": "graph TD\n    subgraph one\n        A-->B\n    end\n    B-->C",
+    "flowchart_end_node": "flowchart TD\n    Start --> End\n    End",
+    "flowchart_upper_end_node": "graph TD\n    A --> END;\n    END;",
+    "flowchart_directive": '%%{init: {"theme": "dark"}}%%\ngraph TD\n    A-->B',
+    "sequence": "sequenceDiagram\n    A->>B: hi\n    alt ok\n        B->>A: yes\n    else\n        B->>A: no\n    end",
+    "sequence_lone_quote": 'sequenceDiagram\n    loop every minute\n        A->>B: he said "hi\n    end',
+    "state_note_block": "stateDiagram-v2\n    [*] --> X\n    note right of X\n        uses {braces} and {\n    end note\n    X --> [*]",
+    "state_note_inline": "stateDiagram-v2\n    [*] --> X\n    note left of X : opens {\n    X --> [*]",
+    "state_composite": "stateDiagram-v2\n    state Outer {\n        [*] --> Inner\n    }",
+    "state_description_quote": 'stateDiagram-v2\n    state Outer {\n        S1 : he said "hi\n    }',
+    "class": "classDiagram\n    class Animal {\n        +String name %% field {\n        +eat()\n    }",
+    "class_note": 'classDiagram\n    note for Animal "can open {"\n    class Animal',
+    "er": "erDiagram\n    CUSTOMER ||--o{ ORDER : places\n    ORDER {\n        string id\n    }",
+    "pie": 'pie title Pets\n    "Dogs" : 386\n    "Cats" : 85.5',
+    "gantt": "gantt\n    dateFormat YYYY-MM-DD\n    section A\n    Task one :a1, 2024-01-01, 3d",
+    "unknown_type": "mindmap\n  root((x))\n    {{{",
+}
+
+INVALID = {
+    "flowchart_direction": "graph XY\n    A-->B",
+    "flowchart_unterminated_string": 'graph TD\n    A["never closed] --> B',
+    "flowchart_unclosed_subgraph": "graph TD\n    subgraph one\n        A-->B",
+    "flowchart_stray_end": "graph TD\n    A-->B\n    end",
+    "sequence_unclosed_block": "sequenceDiagram\n    loop forever\n        A->>B: hi",
+    "sequence_else_outside": "sequenceDiagram\n    A->>B: hi\n    else\n    B->>A: no",
+    "state_unclosed_brace": "stateDiagram-v2\n    state Outer {\n        [*] --> Inner",
+    "class_extra_brace": "classDiagram\n    class Animal\n    }",
+    "pie_bad_slice": 'pie\n    "Dogs" 386',
+    "gantt_bad_task": "gantt\n    section A\n    Task without metadata",
+    "empty": "   ",
+}
+
+
+@pytest.mark.parametrize("code", VALID.values(), ids=VALID.keys())
+def test_valid_diagrams_pass(code):
+    assert validate_mermaid(code) is None
+
+
+@pytest.mark.parametrize("code", INVALID.values(), ids=INVALID.keys())
+def test_invalid_diagrams_are_rejected(code):
+    assert validate_mermaid(code) is not None
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+请求工作目录管理
+统一创建和回收 UPLOAD_FOLDER 下的临时工作目录：到期删除由单个后台线程按到期时间堆依次执行，
+超出磁盘配额时优先淘汰最早创建的待删除目录，启动时清理进程崩溃遗留的目录。
+可选把小型转换的工作目录放在内存文件系统（如 /dev/shm）上，避免网络存储上的写入延迟。
+"""
+
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _directory_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager:
+    """UPLOAD_FOLDER 下工作目录的创建、定时回收与配额控制"""
+
+    def __init__(self, root: str, max_bytes: int, orphan_age: float, memory_root: Optional[str] = None,
+                 memory_threshold: int = 0, memory_min_free: int = 0):
+        """
+        Args:
+            root: 工作目录的父目录（UPLOAD_FOLDER）
+            max_bytes: 待删除工作目录占用的磁盘上限，超出时提前删除最早创建的目录，0表示不限制
+            orphan_age: 启动时清理的遗留目录的最小存在时间（秒），避免误删同机其他进程正在使用的目录
+            memory_root: 可选，内存文件系统上的工作目录父目录，为None时全部使用 root
+            memory_threshold: 输入不超过该大小（字节）的转换才放在内存文件系统上
+            memory_min_free: 内存文件系统剩余空间低于该值（字节）时退回磁盘
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.orphan_age = orphan_age
+
+        self.memory_root: Optional[Path] = None
+        self.memory_threshold = memory_threshold
+        self.memory_min_free = memory_min_free
+        if memory_root:
+            try:
+                Path(memory_root).mkdir(parents=True, exist_ok=True)
+                self.memory_root = Path(memory_root)
+                logger.info("In-memory workspaces enabled at %s (inputs up to %s bytes)",
+                            memory_root, memory_threshold)
+            except OSError as e:
+                logger.warning("In-memory workspace directory %s unavailable, using disk only: %s", memory_root, e)
+
+        # path -> {"created_at", "expires_at", "size"}；expires_at 为None表示仍在使用
+        self._workspaces: Dict[str, Dict] = {}
+        # (到期时间, 序号, path)；目录重新登记或提前删除后旧条目在弹出时跳过
+        self._heap: List[Tuple[float, int, str]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self.created = 0
+        self.created_in_memory = 0
+        self.memory_fallbacks = 0
+        # 按原因统计未能使用内存文件系统的次数：input_too_large、low_free_space、unavailable
+        self.memory_fallback_reasons: Dict[str, int] = {}
+        self.expired = 0
+        self.released = 0
+        self.evicted = 0
+        self.orphans_removed = 0
+        self._scheduled_bytes = 0
+
+        self.sweep_orphans()
+
+        self._reaper = threading.Thread(target=self._reap_loop, name="workspace-reaper", daemon=True)
+        self._reaper.start()
+
+    def create(self, input_size: int = 0) -> Path:
+        """
+        创建一个新的工作目录（在调用 schedule_removal 或 remove 之前不会被回收）
+
+        Args:
+            input_size: 输入内容大小（字节），用于决定是否放在内存文件系统上
+
+        Returns:
+            工作目录路径
+        """
+        root = self._select_root(input_size)
+        path = Path(tempfile.mkdtemp(dir=root))
+        in_memory = root is self.memory_root
+        with self._condition:
+            self._workspaces[str(path)] = {
+                "created_at": time.time(), "expires_at": None, "size": 0, "in_memory": in_memory
+            }
+            self.created += 1
+            if in_memory:
+                self.created_in_memory += 1
+        logger.debug("Created %s workspace: %s", 'in-memory' if in_memory else 'disk', path)
+        return path
+
+    def _select_root(self, input_size: int) -> Path:
+        if self.memory_root is None:
+            return self.root
+        if input_size > self.memory_threshold:
+            kind, reason = "input_too_large", f"input size {input_size} exceeds threshold {self.memory_threshold}"
+        else:
+            try:
+                free = shutil.disk_usage(self.memory_root).free
+            except OSError as e:
+                free, kind, reason = 0, "unavailable", str(e)
+            else:
+                kind, reason = "low_free_space", f"only {free} bytes free"
+            if free >= self.memory_min_free:
+                return self.memory_root
+
+        with self._condition:
+            self.memory_fallbacks += 1
+            first = kind not in self.memory_fallback_reasons
+            self.memory_fallback_reasons[kind] = self.memory_fallback_reasons.get(kind, 0) + 1
+        # 每种原因首次出现时记录到INFO，之后的次数见 /metrics
+        logger.log(logging.INFO if first else logging.DEBUG, "Using disk workspace instead of memory: %s", reason)
+        return self.root
+
+    def schedule_removal(self, path: Path, delay: float):
+        """
+        登记工作目录在 delay 秒后删除
+
+        Args:
+            path: 工作目录
+            delay: 延迟秒数
+        """
+        size = _directory_size(path)
+        key = str(path)
+        with self._condition:
+            info = self._workspaces.setdefault(
+                key, {"created_at": time.time(), "expires_at": None, "size": 0, "in_memory": False}
+            )
+            if info["expires_at"] is not None:
+                self._scheduled_bytes -= info["size"]
+            info["expires_at"] = time.time() + delay
+            info["size"] = size
+            self._scheduled_bytes += size
+            heapq.heappush(self._heap, (info["expires_at"], next(self._counter), key))
+            victims = self._select_evictions_locked()
+            self._condition.notify()
+
+        for victim in victims:
+            self._delete(victim)
+            logger.info("Evicted workspace over quota: %s", victim)
+
+    def remove(self, path: Path):
+        """立即删除工作目录"""
+        key = str(path)
+        with self._condition:
+            info = self._workspaces.pop(key, None)
+            if info is not None and info["expires_at"] is not None:
+                self._scheduled_bytes -= info["size"]
+            self.released += 1
+        self._delete(key)
+
+    def _select_evictions_locked(self) -> List[str]:
+        """超出配额时按创建时间从早到晚选出待删除目录（只淘汰已登记延迟删除的目录）"""
+        if not self.max_bytes or self._scheduled_bytes <= self.max_bytes:
+            return []
+
+        candidates = sorted(
+            (info["created_at"], key) for key, info in self._workspaces.items()
+            if info["expires_at"] is not None
+        )
+        victims = []
+        for _, key in candidates:
+            if self._scheduled_bytes <= self.max_bytes:
+                break
+            info = self._workspaces.pop(key)
+            self._scheduled_bytes -= info["size"]
+            self.evicted += 1
+            victims.append(key)
+        return victims
+
+    def _reap_loop(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+
+                expires_at, _, key = heapq.heappop(self._heap)
+                info = self._workspaces.get(key)
+                # 已被删除或重新登记了更晚的到期时间
+                if info is None or info["expires_at"] != expires_at:
+                    continue
+                del self._workspaces[key]
+                self._scheduled_bytes -= info["size"]
+                self.expired += 1
+
+            self._delete(key)
+            logger.debug("Cleaned up expired workspace: %s", key)
+
+    def _delete(self, key: str):
+        try:
+            shutil.rmtree(key, ignore_errors=True)
+        except Exception as e:
+            logger.warning("Failed to cleanup workspace %s: %s", key, e)
+
+    def sweep_orphans(self):
+        """删除根目录下未登记且存在时间超过 orphan_age 的目录（进程崩溃或重启遗留）"""
+        now = time.time()
+        entries = []
+        for root in (self.root, self.memory_root):
+            if root is None:
+                continue
+            try:
+                entries.extend(os.scandir(root))
+            except OSError as e:
+                logger.warning("Failed to scan workspace root %s: %s", root, e)
+
+        with self._condition:
+            known = set(self._workspaces)
+
+        removed = 0
+        for entry in entries:
+            if entry.path in known:
+                continue
+            try:
+                if not entry.is_dir(follow_symlinks=False) or now - entry.stat().st_mtime < self.orphan_age:
+                    continue
+            except OSError:
+                continue
+            self._delete(entry.path)
+            removed += 1
+
+        if removed:
+            self.orphans_removed += removed
+            logger.info("Removed %s orphaned workspace(s)", removed)
+
+    def shutdown(self):
+        """停止后台线程并删除所有登记的工作目录"""
+        with self._condition:
+            self._stopped = True
+            keys = list(self._workspaces)
+            self._workspaces.clear()
+            self._heap.clear()
+            self._scheduled_bytes = 0
+            self._condition.notify()
+        for key in keys:
+            self._delete(key)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            expiries = [info["expires_at"] for info in self._workspaces.values() if info["expires_at"] is not None]
+            scheduled = len(expiries)
+            next_expiry: Optional[float] = min(expiries) if expiries else None
+            return {
+                "root": str(self.root),
+                "memory_root": str(self.memory_root) if self.memory_root else None,
+                "in_memory": sum(1 for info in self._workspaces.values() if info["in_memory"]),
+                "active": len(self._workspaces) - scheduled,
+                "scheduled": scheduled,
+                "scheduled_bytes": self._scheduled_bytes,
+                "max_bytes": self.max_bytes,
+                "next_expiry_in": round(max(0.0, next_expiry - time.time()), 1) if next_expiry else None,
+                "created": self.created,
+                "created_in_memory": self.created_in_memory,
+                "memory_fallbacks": self.memory_fallbacks,
+                "memory_fallback_reasons": dict(self.memory_fallback_reasons),
+                "expired": self.expired,
+                "released": self.released,
+                "evicted": self.evicted,
+                "orphans_removed": self.orphans_removed,
+            }
@@ -2,6 +2,24 @@ import React, { useEffect, useState, useRef } from "react";
 import "./App.css";
 
 const API_BASE = "";
+const JOB_POLL_INTERVAL = 1000;
+
+const STAGE_LABELS = {
+  queued: "排队中",
+  mermaid: "正在渲染流程图",
+  pandoc: "正在生成 DOCX",
+  done: "即将完成"
+};
+
+const readErrorMessage = async (response) => {
+  const errorText = await response.text();
+  try {
+    const errorData = JSON.parse(errorText);
+    return `转换失败: ${errorData.error || response.statusText}`;
+  } catch {
+    return `转换失败: ${errorText || response.statusText}`;
+  }
+};
 
 function App() {
   const [file, setFile] = useState(null);
@@ -12,6 +30,7 @@ function App() {
   const [isConverting, setIsConverting] = useState(false);
   const [isDragging, setIsDragging] = useState(false);
   const fileInputRef = useRef(null);
+  const lastResultRef = useRef(null);
 
   useEffect(() => {
     // 检查后端健康状态
@@ -130,25 +149,57 @@ function App() {
     }
 
     try {
-      const response = await fetch(`${API_BASE}/api/convert`, {
+      // 提交转换任务，随后轮询任务状态
+      const response = await fetch(`${API_BASE}/api/jobs`, {
         method: "POST",
         body: formData
       });
 
       if (!response.ok) {
-        let errorMessage = `转换失败 (${response.status})`;
-        try {
-          const errorData = await response.json();
-          errorMessage = `转换失败: ${errorData.error || response.statusText}`;
-        } catch {
-          const errorText = await response.text();
-          errorMessage = `转换失败: ${errorText || response.statusText}`;
+        setStatus(await readErrorMessage(response));
+        return;
+      }
+
+      let job = await response.json();
+      while (job.status === "queued" || job.status === "running") {
+        setStatus(`正在转换，请稍候...（${STAGE_LABELS[job.stage] || job.stage}）`);
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+
+        const statusResponse = await fetch(`${API_BASE}/api/jobs/${job.job_id}`);
+        if (!statusResponse.ok) {
+          setStatus(await readErrorMessage(statusResponse));
+          return;
         }
-        setStatus(errorMessage);
+        job = await statusResponse.json();
+      }
+
+      if (job.status === "failed") {
+        setStatus(`转换失败: ${job.error}`);
         return;
       }
 
-      const blob = await response.blob();
+      // 与上次下载的结果相同（ETag一致）时直接复用，无需重新下载
+      let blob;
+      const lastResult = lastResultRef.current;
+      if (lastResult && job.etag && lastResult.etag === job.etag) {
+        blob = lastResult.blob;
+      } else {
+        const resultResponse = await fetch(`${API_BASE}${job.result_url}`, {
+          headers: lastResult ? { "If-None-Match": `"${lastResult.etag}"` } : {}
+        });
+        if (resultResponse.status === 304) {
+          blob = lastResult.blob;
+        } else if (!resultResponse.ok) {
+          setStatus(await readErrorMessage(resultResponse));
+          return;
+        } else {
+          blob = await resultResponse.blob();
+          if (job.etag) {
+            lastResultRef.current = { etag: job.etag, blob };
+          }
+        }
+      }
+
       const url = window.URL.createObjectURL(blob);
       const a = document.createElement("a");
       a.href = url;